@@ -0,0 +1,269 @@
+"""
+Offline benchmark of the chatbot graph with a deterministic fake LLM, web search and embeddings.
+
+Every question of benchmark_corpus.json is replayed through the compiled chatbot graph.
+The Gemini LLM, the Tavily web search, professor website scraping and the
+HuggingFace embeddings are replaced by local stand-ins with a configurable latency, so it
+needs no network or API keys. Run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.benchmark
+    python -m AdaptiveRagChatbot.benchmark --llm-latency 0.3 --concurrency 8 --repeat 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+import numpy as np
+
+CORPUS_PATH = "AdaptiveRagChatbot/benchmark_corpus.json"
+
+# structured outputs of the fake LLM for each route of the corpus
+QUESTION_ROUTES = {
+    "vectorstore": "vectorstore",
+    "vectorstore_fallback": "vectorstore",
+    "professor_json": "professor_search",
+    "professor_web": "professor_search",
+    "general": "general_query",
+}
+
+
+def configure_environment():
+    """
+    Turn off the parts of the graph that would make the run depend on earlier runs or the network.
+    """
+    os.environ["CHAIN_CACHE_CHAINS"] = ""
+    # the fake embeddings carry no meaning, the fake LLM router routes from the corpus instead
+    os.environ["LOCAL_ROUTER_ENABLED"] = "False"
+
+
+def build_fake_llm(corpus, latency, jitter):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from langchain_core.runnables import RunnableLambda
+
+    class FakeChatModel(BaseChatModel):
+        """
+        Chat model that sleeps for the configured latency and answers from the corpus.
+        Structured outputs are returned as json and parsed, so callbacks see every call.
+        """
+        latency: float = 0.0
+        jitter: float = 0.0
+        corpus: List[dict] = []
+        model: str = "fake-benchmark-llm"
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake-benchmark"
+
+        def _generate(self, messages, stop=None, run_manager=None, structured_schema: Optional[str] = None, **kwargs: Any):
+            time.sleep(self._delay())
+            return self._result(messages, structured_schema)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, structured_schema: Optional[str] = None, **kwargs: Any):
+            await asyncio.sleep(self._delay())
+            return self._result(messages, structured_schema)
+
+        def with_structured_output(self, schema, **kwargs):
+            return self.bind(structured_schema=schema.__name__) | RunnableLambda(
+                lambda message: schema.model_validate_json(message.content)
+            )
+
+        def _delay(self) -> float:
+            return max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+        def _result(self, messages, structured_schema):
+            prompt = "\n".join(str(m.content) for m in messages)
+            entry = self._entry(prompt)
+            if structured_schema:
+                content = json.dumps(self._structured(structured_schema, entry))
+            else:
+                content = "This is a canned benchmark answer. " * 8
+            usage = {"input_tokens": len(prompt.split()), "output_tokens": len(content.split())}
+            usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+            message = AIMessage(content=content, usage_metadata=usage)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def _entry(self, prompt):
+            for entry in self.corpus:
+                if entry["question"] in prompt:
+                    return entry
+            return {"route": "general", "question": ""}
+
+        @staticmethod
+        def _structured(schema_name, entry):
+            route = entry["route"]
+            if schema_name == "RouteQuery":
+                return {"datasource": QUESTION_ROUTES[route]}
+            if schema_name == "ProfessorSearchRoutes":
+                return {"datasource": "json_data" if route == "professor_json" else "web_search"}
+            if schema_name == "JsonResultRoutes":
+                return {"datasource": "format_search_results"}
+            if schema_name == "GradeDocument":
+                return {"binary_score": "no" if route == "vectorstore_fallback" else "yes"}
+            if schema_name in ("GradeHallucination", "GradeAnswer"):
+                return {"binary_score": "yes"}
+            if schema_name == "GradeGeneration":
+                return {"grounded_score": "yes", "answer_score": "yes"}
+            if schema_name == "RewriteQuery":
+                return {"query": entry["question"]}
+            if schema_name == "ExtractKeywords":
+                return {"professor_name": entry.get("professor"), "university": entry.get("university")}
+            if schema_name == "ProfessorSearchResults":
+                return {"name": entry.get("professor"), "title": "Professor", "department": "Computer Science",
+                        "research_interests": "Machine learning"}
+            raise ValueError(f"No canned output for {schema_name}")
+
+    return FakeChatModel(latency=latency, jitter=jitter, corpus=corpus)
+
+
+def build_fake_web_search(latency):
+    from langchain_core.runnables import RunnableLambda
+
+    results = [{"content": f"Canned web search result {i} for the benchmark."} for i in range(3)]
+
+    def search(inputs):
+        time.sleep(latency)
+        return results
+
+    async def asearch(inputs):
+        await asyncio.sleep(latency)
+        return results
+
+    return RunnableLambda(search, afunc=asearch, name="fake_web_search")
+
+
+def install_stand_ins(corpus, llm_latency, jitter, search_latency):
+    """
+    Override the lazy chat model, embeddings, vector store and web search getters with the
+    stand-ins before anything builds them, then import the graph.
+
+    Returns:
+        CompiledGraph: The chatbot graph built on the stand-ins
+    """
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.vectorstores import InMemoryVectorStore
+    from langchain_community.document_loaders import TextLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    from . import llm_config, retriever_setup, professor_web_search
+
+    # the fake model still goes through the LLM gateway like the real one
+    llm_config.get_chat_model.override(build_fake_llm(corpus, llm_latency, jitter))
+
+    embeddings = DeterministicFakeEmbedding(size=768)
+    docs = TextLoader("AdaptiveRagChatbot/top_uni_detailed.txt").load()
+    splits = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300).split_documents(docs)
+    vector_store = InMemoryVectorStore.from_documents(splits, embeddings)
+
+    retriever_setup.get_embeddings.override(embeddings)
+    retriever_setup.get_vector_store.override(vector_store)
+    retriever_setup.get_retriever.override(vector_store.as_retriever())
+
+    professor_web_search.get_web_search_tool.override(build_fake_web_search(search_latency))
+    professor_web_search.scrape_website_content = lambda url: f"Canned homepage of {url}"
+
+    from .create_graph import chatbot
+    return chatbot
+
+
+def run_route(chatbot, entries, repeat, concurrency, use_async):
+    """
+    Returns:
+        dict: wall time, per request latencies and LLM calls of the route
+    """
+    from .budget import GraphBudget
+
+    questions = [entry["question"] for entry in entries] * repeat
+    latencies, llm_calls = [], []
+
+    def new_run(question):
+        budget = GraphBudget(max_llm_calls=10**6, deadline_seconds=float("inf"))
+        return {"question": question, "budget": budget}, {"callbacks": [budget.callback]}, budget
+
+    def run_one(question):
+        inputs, config, budget = new_run(question)
+        start = time.perf_counter()
+        chatbot.invoke(inputs, config=config)
+        latencies.append(time.perf_counter() - start)
+        llm_calls.append(budget.llm_calls)
+
+    async def arun_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def arun_one(question):
+            async with semaphore:
+                inputs, config, budget = new_run(question)
+                start = time.perf_counter()
+                await chatbot.ainvoke(inputs, config=config)
+                latencies.append(time.perf_counter() - start)
+                llm_calls.append(budget.llm_calls)
+
+        await asyncio.gather(*(arun_one(question) for question in questions))
+
+    start = time.perf_counter()
+    if use_async:
+        asyncio.run(arun_all())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run_one, questions))
+    return {"wall": time.perf_counter() - start, "latencies": latencies, "llm_calls": llm_calls}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the chatbot graph.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Relative jitter of the LLM latency, eg. 0.2")
+    parser.add_argument("--search-latency", type=float, default=0.5, help="Seconds per fake web search")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each question is replayed")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sync", action="store_true", help="Use chatbot.invoke in threads instead of ainvoke")
+    parser.add_argument("--verbose", action="store_true", help="Show the prints of the graph nodes")
+    args = parser.parse_args()
+
+    configure_environment()
+    with open(CORPUS_PATH, "r") as f:
+        corpus = json.load(f)
+
+    random.seed(0)
+    chatbot = install_stand_ins(corpus, args.llm_latency, args.llm_jitter, args.search_latency)
+
+    routes = {}
+    for entry in corpus:
+        routes.setdefault(entry["route"], []).append(entry)
+
+    results = {}
+    for route, entries in routes.items():
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            results[route] = run_route(chatbot, entries, args.repeat, args.concurrency, not args.sync)
+
+    mode = "invoke (threads)" if args.sync else "ainvoke"
+    print(f"\n== chatbot graph, {mode}, concurrency {args.concurrency}, "
+          f"LLM {args.llm_latency * 1000:.0f} ms, web search {args.search_latency * 1000:.0f} ms")
+    print(f"{'route':<22} {'requests':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'LLM calls':>9}")
+    for route, result in results.items():
+        latencies_ms = np.array(result["latencies"]) * 1000
+        print(f"{route:<22} {len(latencies_ms):>8} {len(latencies_ms) / result['wall']:>7.2f} "
+              f"{np.percentile(latencies_ms, 50):>8.1f} {np.percentile(latencies_ms, 95):>8.1f} "
+              f"{np.percentile(latencies_ms, 99):>8.1f} {np.mean(result['llm_calls']):>9.2f}")
+    print(f"\npeak RSS: {peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
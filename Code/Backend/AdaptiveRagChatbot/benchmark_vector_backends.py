@@ -0,0 +1,129 @@
+"""
+Compare the load time, query latency, memory and results of the vector store backends.
+
+The questions of router_examples.json are embedded once, then every backend is loaded
+in a fresh process and searched with the same query vectors, so the embedding model is
+left out of both the latency and the memory. Results are compared with the Chroma ones.
+Run from the Backend directory, after the Chroma store was built:
+
+    python -m AdaptiveRagChatbot.benchmark_vector_backends
+    python -m AdaptiveRagChatbot.benchmark_vector_backends --k 10 --repeat 20
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .benchmark import peak_rss_mb
+
+
+def rss_mb() -> float:
+    """
+    Current resident set size, the peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def open_backend(backend: str, path: str):
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+        from .retriever_setup import CHROMA_PERSIST_DIR
+
+        return Chroma(persist_directory=CHROMA_PERSIST_DIR)
+    if backend == "hnsw":
+        from .hnsw_index import HnswIndex
+
+        return HnswIndex.load(path)
+    from .flat_index import FlatIndex
+
+    return FlatIndex(path, None)
+
+
+def measure_backend(backend: str, path: str, query_vectors: list, k: int, repeat: int) -> dict:
+    """
+    Runs in a fresh process so that the memory of one backend does not count for the next.
+
+    Returns:
+        dict: Timings in ms, memory in MB and the texts of the results of every query
+    """
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    store = open_backend(backend, path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # the first search pays for whatever the backend loads lazily
+    start = time.perf_counter()
+    results = [[d.page_content for d in store.similarity_search_by_vector(query_vectors[0], k=k)]]
+    first_query_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(repeat):
+        for vector in query_vectors:
+            start = time.perf_counter()
+            store.similarity_search_by_vector(vector, k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+    results += [[d.page_content for d in store.similarity_search_by_vector(vector, k=k)] for vector in query_vectors[1:]]
+
+    return {
+        "load_ms": load_ms,
+        "first_query_ms": first_query_ms,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "rss_mb": rss_mb() - rss_before,
+        "results": results,
+    }
+
+
+def run(query_vectors: list, backends: dict, k: int, repeat: int):
+    context = multiprocessing.get_context("spawn")
+    reports = {}
+    for name, (backend, path) in backends.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            reports[name] = executor.submit(measure_backend, backend, path, query_vectors, k, repeat).result()
+
+    reference = reports["chroma"]["results"]
+    print(f"\n== {len(query_vectors)} queries, k={k}, {repeat} repeats")
+    print(f"{'backend':<14} {'load ms':>8} {'first ms':>9} {'p50 ms':>7} {'p95 ms':>7} {'rss MB':>7} {'overlap':>8}")
+    for name, report in reports.items():
+        # share of the Chroma results the backend also returned
+        overlap = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(report["results"], reference)])
+        print(f"{name:<14} {report['load_ms']:>8.1f} {report['first_query_ms']:>9.1f} {report['p50_ms']:>7.2f} "
+              f"{report['p95_ms']:>7.2f} {report['rss_mb']:>7.1f} {overlap:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the vector store backends.")
+    parser.add_argument("--k", type=int, default=4, help="Results per query")
+    parser.add_argument("--repeat", type=int, default=10, help="Times every query is searched")
+    args = parser.parse_args()
+
+    from .retriever_setup import get_embeddings, get_chroma_store
+    from .local_router import load_router_examples
+    from .flat_index import FlatIndex
+    from .hnsw_index import sync_hnsw_index
+
+    questions = [q for examples in load_router_examples()["question_router"].values() for q in examples]
+    # same vectors as embed_query for this model, in one batch
+    query_vectors = get_embeddings().embed_documents(questions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {"chroma": ("chroma", None)}
+        for dtype in ("float16", "int8"):
+            path = os.path.join(tmp, f"flat_{dtype}")
+            FlatIndex.export(get_chroma_store(), path, dtype=dtype)
+            backends[f"flat {dtype}"] = ("flat", path)
+        path = os.path.join(tmp, "hnsw")
+        sync_hnsw_index(get_chroma_store(), path)
+        backends["hnsw"] = ("hnsw", path)
+        run(query_vectors, backends, args.k, args.repeat)
@@ -0,0 +1,114 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .config import GRAPH_MAX_RETRIES, GRAPH_MAX_LLM_CALLS, GRAPH_DEADLINE_SECONDS
+
+
+@dataclass
+class GraphBudget:
+    """
+    Per request limits of a chatbot graph run.
+
+    The same object is carried in the graph state so that nodes and conditional edges
+    can read and update it. LLM calls are counted by the callback handler returned by
+    the callback property, cached chain results are not counted.
+    """
+    max_retries: int = GRAPH_MAX_RETRIES
+    max_llm_calls: int = GRAPH_MAX_LLM_CALLS
+    deadline_seconds: float = GRAPH_DEADLINE_SECONDS
+    started_at: float = field(default_factory=time.monotonic)
+    retries: dict = field(default_factory=dict)
+    llm_calls: int = 0
+    # reason the budget ran out, None while there is budget left
+    exhausted: Optional[str] = None
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self.callback = LLMCallCounter(self)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def out_of_budget(self) -> Optional[str]:
+        """
+        Returns:
+            str | None: Why the budget ran out, or None if there is budget left
+        """
+        if self.llm_calls >= self.max_llm_calls:
+            return "max_llm_calls"
+        if self.elapsed() >= self.deadline_seconds:
+            return "deadline"
+        return None
+
+    def try_retry(self, cycle: str) -> bool:
+        """
+        Record a retry of a graph cycle if the budget allows it.
+
+        Args:
+            cycle (str): Name of the cycle, eg. "generate" or "transform_query"
+
+        Returns:
+            bool: True if the retry can go ahead, otherwise the budget is marked exhausted
+        """
+        with self._lock:
+            reason = self.out_of_budget()
+            if reason is None and self.retries.get(cycle, 0) >= self.max_retries:
+                reason = f"max_retries:{cycle}"
+            if reason is not None:
+                self.exhausted = reason
+                return False
+            self.retries[cycle] = self.retries.get(cycle, 0) + 1
+            return True
+
+    def check(self) -> bool:
+        """
+        Returns:
+            bool: True if there is budget left, otherwise the budget is marked exhausted
+        """
+        with self._lock:
+            reason = self.out_of_budget()
+            if reason is not None:
+                self.exhausted = reason
+                return False
+            return True
+
+    def count_llm_call(self):
+        with self._lock:
+            self.llm_calls += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "llm_calls": self.llm_calls,
+            "max_llm_calls": self.max_llm_calls,
+            "retries": dict(self.retries),
+            "max_retries": self.max_retries,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "deadline_seconds": self.deadline_seconds,
+            "exhausted": self.exhausted,
+        }
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """
+    Counts the LLM calls made during a graph run into its budget.
+    """
+
+    def __init__(self, budget: GraphBudget):
+        self.budget = budget
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.budget.count_llm_call()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.budget.count_llm_call()
+
+
+def budget_from_state(state) -> Optional[GraphBudget]:
+    """
+    Get the budget of the run, None when the graph was invoked without one (no limits).
+    """
+    return state.get("budget")
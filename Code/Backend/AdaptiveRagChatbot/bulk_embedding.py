@@ -0,0 +1,158 @@
+"""
+Bulk embedding of the chunks of an index build.
+
+Texts are sorted by length so that each batch pads to about the same length, and the
+batches are encoded by a pool of worker processes, each with its own copy of the model.
+Embeddings are written to the vector store as soon as a block of them is ready.
+
+Compare the embeddings per second of a few configurations, run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.bulk_embedding --workers 0 2 4 --batch-size 16 32 64
+    python -m AdaptiveRagChatbot.bulk_embedding --source ../data/expanded_descriptions.txt --unsorted
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from .config import (EMBEDDING_MODEL, INGEST_SOURCES, EMBED_WORKERS, EMBED_BATCH_SIZE,
+                     EMBED_WRITE_BATCH_SIZE)
+
+# texts handed to a worker at a time, several batches so that the transfer cost is amortized
+BATCHES_PER_BLOCK = 8
+
+_model = None
+_batch_size = None
+
+
+def _load_model(model_name: str, batch_size: int):
+    global _model, _batch_size
+    from sentence_transformers import SentenceTransformer
+
+    _model = SentenceTransformer(model_name, device="cpu")
+    _batch_size = batch_size
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    import torch
+
+    # workers share the cores instead of each starting one thread per core
+    torch.set_num_threads(threads)
+    _load_model(model_name, batch_size)
+
+
+def _encode_block(block):
+    indices, texts = block
+    # same input as HuggingFaceEmbeddings.embed_documents, so the vectors match the query ones
+    texts = [text.replace("\n", " ") for text in texts]
+    vectors = _model.encode(texts, batch_size=_batch_size, show_progress_bar=False, convert_to_numpy=True)
+    return indices, vectors.tolist()
+
+
+def iter_embeddings(texts: list, workers: int = EMBED_WORKERS, batch_size: int = EMBED_BATCH_SIZE,
+                    sort_by_length: bool = True, model_name: str = EMBEDDING_MODEL):
+    """
+    Embed the texts in blocks, in the order the blocks finish.
+
+    Args:
+        texts (list): Texts to embed
+        workers (int): Worker processes, 0 encodes in this process
+        batch_size (int): Texts per forward pass
+        sort_by_length (bool): Group texts of similar length in the same batch
+
+    Yields:
+        tuple: (indices of the texts in the block, their embeddings)
+    """
+    order = list(range(len(texts)))
+    if sort_by_length:
+        order.sort(key=lambda i: len(texts[i]))
+    block_size = batch_size * BATCHES_PER_BLOCK
+    blocks = [(order[i:i + block_size], [texts[j] for j in order[i:i + block_size]])
+              for i in range(0, len(order), block_size)]
+
+    if workers <= 0:
+        # the torch threads of this process are left as they are, it may be the server
+        _load_model(model_name, batch_size)
+        for block in blocks:
+            yield _encode_block(block)
+        return
+
+    # spawn, torch is not safe to use in a forked child of a process that already used it
+    context = multiprocessing.get_context("spawn")
+    cpus = os.cpu_count() or 1
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(model_name, batch_size, max(1, cpus // workers))) as pool:
+        yield from pool.imap_unordered(_encode_block, blocks)
+
+
+def add_documents_bulk(collection_name: str, documents: list, ids: list, workers: int = EMBED_WORKERS,
+                       batch_size: int = EMBED_BATCH_SIZE, write_batch_size: int = EMBED_WRITE_BATCH_SIZE) -> dict:
+    """
+    Embed the documents with the bulk pipeline and stream them into a Chroma collection.
+
+    Args:
+        collection_name (str): Collection of the persisted Chroma db to add the documents to
+        documents (list): Documents to add
+        ids (list): Id of each document
+
+    Returns:
+        dict: Number of documents, seconds and embeddings per second
+    """
+    import chromadb
+    from .retriever_setup import CHROMA_PERSIST_DIR
+
+    # the precomputed embeddings go through the chroma client, add_documents of the vector store would encode again
+    collection = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR).get_collection(collection_name)
+    start = time.perf_counter()
+    pending = []
+
+    def flush():
+        collection.upsert(
+            ids=[ids[i] for i, _ in pending],
+            embeddings=[vector for _, vector in pending],
+            documents=[documents[i].page_content for i, _ in pending],
+            metadatas=[documents[i].metadata or None for i, _ in pending],
+        )
+        pending.clear()
+
+    texts = [d.page_content for d in documents]
+    for indices, vectors in iter_embeddings(texts, workers=workers, batch_size=batch_size):
+        pending.extend(zip(indices, vectors))
+        if len(pending) >= write_batch_size:
+            flush()
+    if pending:
+        flush()
+
+    seconds = time.perf_counter() - start
+    stats = {"documents": len(documents), "seconds": round(seconds, 2),
+             "per_second": round(len(documents) / seconds, 1) if seconds else 0.0}
+    print(f"\n Embedded {stats['documents']} documents in {stats['seconds']} s, {stats['per_second']} / s")
+    return stats
+
+
+def benchmark(texts: list, workers_options: list, batch_sizes: list, compare_unsorted: bool):
+    print(f"\n{len(texts)} texts, {sum(map(len, texts)) / max(len(texts), 1):.0f} characters on average")
+    print(f"{'workers':>7} {'batch':>6} {'sorted':>7} {'seconds':>8} {'per second':>11}")
+    for workers in workers_options:
+        for batch_size in batch_sizes:
+            for sort_by_length in ([True, False] if compare_unsorted else [True]):
+                start = time.perf_counter()
+                # the model load is part of every configuration, as it is of a real build
+                for _ in iter_embeddings(texts, workers=workers, batch_size=batch_size, sort_by_length=sort_by_length):
+                    pass
+                seconds = time.perf_counter() - start
+                print(f"{workers:>7} {batch_size:>6} {str(sort_by_length):>7} {seconds:>8.1f} {len(texts) / seconds:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the throughput of bulk embedding configurations.")
+    parser.add_argument("--source", nargs="+", default=INGEST_SOURCES, help="Text files to chunk and embed")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="Worker processes, 0 for in process")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[16, 32, 64], help="Texts per forward pass")
+    parser.add_argument("--unsorted", action="store_true", help="Also time every configuration without the length sort")
+    parser.add_argument("--limit", type=int, default=None, help="Only embed the first n chunks")
+    args = parser.parse_args()
+
+    from .ingest import split_sources
+    texts = [d.page_content for d in split_sources(args.source).values()][:args.limit]
+    benchmark(texts, args.workers, args.batch_size, args.unsorted)
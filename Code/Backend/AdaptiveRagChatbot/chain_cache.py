@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.callbacks import dispatch_custom_event, adispatch_custom_event
+from langchain_core.runnables import RunnableLambda
+
+from .llm_config import get_llm
+from .lazy import singleton
+from .prompt_registry import get_prompt_registry
+from .config import CHAIN_CACHE_PATH, CHAIN_CACHE_MAX_ENTRIES, CHAIN_CACHE_CHAINS
+
+# the last_used updates of the hits are written in one commit once this many are pending,
+# or once the oldest pending one is this old, a hit does not commit on its own
+TOUCH_FLUSH_SIZE = 256
+TOUCH_FLUSH_SECONDS = 30.0
+
+
+class ChainCache:
+    """
+    SQLite backed exact match cache for the outputs of structured output chains.
+
+    Once the cache grows past max_entries the least recently used rows are deleted. The
+    last use of a hit is recorded in memory and written with the next insert or flush.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> last use of the hits not written yet
+        self._touched = {}
+        self._touched_since = None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chain_cache (
+                key TEXT PRIMARY KEY,
+                chain TEXT NOT NULL,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chain_cache_last_used ON chain_cache (last_used)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM chain_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if self._touched_since is None:
+                self._touched_since = time.monotonic()
+            if len(self._touched) >= TOUCH_FLUSH_SIZE or time.monotonic() - self._touched_since > TOUCH_FLUSH_SECONDS:
+                self._write_touches()
+                self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, chain: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chain_cache (key, chain, value, last_used) VALUES (?, ?, ?, ?)",
+                (key, chain, value, time.time()),
+            )
+            # the eviction below orders on last_used, it has to see the recent hits
+            self._write_touches()
+            count = self._conn.execute("SELECT COUNT(*) FROM chain_cache").fetchone()[0]
+            if count > self.max_entries:
+                # evict a tenth of the cache at once so that eviction does not run on every insert
+                self._conn.execute(
+                    "DELETE FROM chain_cache WHERE key IN "
+                    "(SELECT key FROM chain_cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries + self.max_entries // 10,),
+                )
+            self._conn.commit()
+
+    def flush(self):
+        """
+        Write the pending last uses, called at shutdown.
+        """
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+
+    def _write_touches(self):
+        if self._touched:
+            self._conn.executemany("UPDATE chain_cache SET last_used = ? WHERE key = ?",
+                                   [(last_used, key) for key, last_used in self._touched.items()])
+            self._touched.clear()
+        self._touched_since = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+@singleton
+def get_chain_cache():
+    return ChainCache(CHAIN_CACHE_PATH, CHAIN_CACHE_MAX_ENTRIES)
+
+
+def cache_key(chain_name: str, model_name: str, inputs, prompt_version: str = None) -> str:
+    payload = json.dumps({"chain": chain_name, "model": model_name, "prompt": prompt_version, "input": inputs},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cached_chain(name: str, chain, schema):
+    """
+    Wrap a structured output chain with the exact match cache.
+
+    Args:
+        name (str): Name of the chain, used in the key and to enable the cache per chain
+        chain (Runnable): The chain to wrap
+        schema (BaseModel): The pydantic class the chain returns
+
+    Returns:
+        Runnable: The chain itself if caching is disabled for it, otherwise the cached chain
+    """
+    if name not in CHAIN_CACHE_CHAINS:
+        return chain
+
+    llm = get_llm()
+    model_name = getattr(llm, "model", type(llm).__name__)
+    # the chains are named after their prompt, editing the prompt invalidates its cached outputs
+    prompt_version = get_prompt_registry().fingerprint(name)
+    chain_cache = get_chain_cache()
+
+    def invoke(inputs, config):
+        key = cache_key(name, model_name, inputs, prompt_version)
+        cached = chain_cache.get(key)
+        if cached is not None:
+            dispatch_custom_event("cache_hit", {"cache": "chain_cache", "key": name}, config=config)
+            return schema.model_validate_json(cached)
+        output = chain.invoke(inputs, config)
+        if output is not None:
+            chain_cache.set(key, name, output.model_dump_json())
+        return output
+
+    async def ainvoke(inputs, config):
+        key = cache_key(name, model_name, inputs, prompt_version)
+        # sqlite reads and commits block, keep them off the event loop
+        cached = await asyncio.to_thread(chain_cache.get, key)
+        if cached is not None:
+            await adispatch_custom_event("cache_hit", {"cache": "chain_cache", "key": name}, config=config)
+            return schema.model_validate_json(cached)
+        output = await chain.ainvoke(inputs, config)
+        if output is not None:
+            await asyncio.to_thread(chain_cache.set, key, name, output.model_dump_json())
+        return output
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=name)
@@ -0,0 +1,63 @@
+"""
+Compare the verdicts and latency of the generation grader modes on a fixed question set.
+
+For every vectorstore question in router_examples.json an answer is generated once and
+then graded by the sequential, concurrent and combined graders. Run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.compare_generation_graders
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+# the chain cache would serve the later modes from the results of the first one
+os.environ["CHAIN_CACHE_CHAINS"] = ""
+
+from .local_router import load_router_examples
+from .graph_setup import retrieve, grade_documents, generate, generation_verdict
+
+MODES = ["sequential", "concurrent", "combined"]
+
+
+def compare(questions):
+    verdicts = {mode: [] for mode in MODES}
+    latencies = {mode: [] for mode in MODES}
+
+    for question in questions:
+        state = retrieve({"question": question})
+        state = grade_documents(state)
+        if not state["documents"]:
+            print(f"\nSkipping, no relevant documents for: {question}")
+            continue
+        state = generate(state)
+
+        for mode in MODES:
+            start = time.perf_counter()
+            verdict = generation_verdict(state["question"], state["documents"], state["generation"], mode=mode)
+            latencies[mode].append(time.perf_counter() - start)
+            verdicts[mode].append(verdict)
+
+        print(f"\n{question}\n  " + ", ".join(f"{mode}: {verdicts[mode][-1]}" for mode in MODES))
+
+    graded = len(verdicts["sequential"])
+    if not graded:
+        print("\nNo question could be graded")
+        return
+
+    print(f"\n== {graded} graded questions")
+    print(f"{'mode':<12} {'agreement':>10} {'mean ms':>9} {'p95 ms':>8}")
+    for mode in MODES:
+        agreement = np.mean([a == b for a, b in zip(verdicts[mode], verdicts["sequential"])])
+        print(f"{mode:<12} {agreement:>10.3f} {np.mean(latencies[mode]) * 1000:>9.1f} "
+              f"{np.percentile(latencies[mode], 95) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the generation grader modes.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first n questions")
+    args = parser.parse_args()
+
+    questions = load_router_examples()["question_router"]["vectorstore"][:args.limit]
+    compare(questions)
@@ -0,0 +1,171 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+## Document grading
+# "batch" grades every retrieved document concurrently, "sequential" grades them one by one
+GRADE_DOCUMENTS_MODE: str = os.getenv("GRADE_DOCUMENTS_MODE", "batch").lower()
+# maximum number of grader calls in flight at the same time
+GRADER_MAX_CONCURRENCY: int = int(os.getenv("GRADER_MAX_CONCURRENCY", 4))
+# "llm" grades the documents with the LLM retrieval grader, "reranker" with a local cross-encoder
+RELEVANCE_GRADER: str = os.getenv("RELEVANCE_GRADER", "llm").lower()
+RERANKER_MODEL: str = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# documents scoring below are not relevant, in the units of the model scores (logits for the ms-marco models)
+RERANKER_THRESHOLD: float = float(os.getenv("RERANKER_THRESHOLD", 0.0))
+RERANKER_MAX_LENGTH: int = int(os.getenv("RERANKER_MAX_LENGTH", 512))
+
+## Retrieval
+# "hybrid" fuses the dense and BM25 rankings, "dense" only uses the vector store similarity
+RETRIEVER_MODE: str = os.getenv("RETRIEVER_MODE", "hybrid").lower()
+# number of documents returned to the graph
+RETRIEVER_K: int = int(os.getenv("RETRIEVER_K", 4))
+# number of candidates taken from each ranking before the fusion
+HYBRID_FETCH_K: int = int(os.getenv("HYBRID_FETCH_K", 20))
+HYBRID_DENSE_WEIGHT: float = float(os.getenv("HYBRID_DENSE_WEIGHT", 1.0))
+HYBRID_SPARSE_WEIGHT: float = float(os.getenv("HYBRID_SPARSE_WEIGHT", 1.0))
+# reciprocal rank fusion constant, larger values flatten the advantage of the top ranks
+HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", 60))
+BM25_INDEX_PATH: str = os.getenv("BM25_INDEX_PATH", "AdaptiveRagChatbot/bm25_index.json")
+# restrict the search to the chunks of the universities named in the question, when it names any
+UNIVERSITY_FILTER_ENABLED: bool = os.getenv("UNIVERSITY_FILTER_ENABLED", "True").lower() == "true"
+
+## Multi-source retrieval
+# also search the curated datasets of Code/data, each in its own collection, and merge the results,
+# build the collections with python -m AdaptiveRagChatbot.multi_source before turning it on
+MULTI_SOURCE_ENABLED: bool = os.getenv("MULTI_SOURCE_ENABLED", "False").lower() == "true"
+# resolved from this file, Code/data does not depend on the directory the server is started from
+MULTI_SOURCE_DATA_DIR: str = os.getenv("MULTI_SOURCE_DATA_DIR", str(Path(__file__).resolve().parents[2] / "data"))
+# weight of each source in the merged ranking, a source weighted 0 is not searched
+MULTI_SOURCE_WEIGHTS: dict = {
+    "guide": float(os.getenv("SOURCE_WEIGHT_GUIDE", 1.0)),
+    "university_profiles": float(os.getenv("SOURCE_WEIGHT_UNIVERSITY_PROFILES", 1.0)),
+    "university_info": float(os.getenv("SOURCE_WEIGHT_UNIVERSITY_INFO", 0.8)),
+    "expanded_descriptions": float(os.getenv("SOURCE_WEIGHT_EXPANDED_DESCRIPTIONS", 0.5)),
+}
+# candidates taken from each source before the merge
+MULTI_SOURCE_FETCH_K: int = int(os.getenv("MULTI_SOURCE_FETCH_K", 6))
+# "chroma" searches the Chroma collection, "flat" a quantized memory-mapped copy of its embeddings
+# and "hnsw" an approximate nearest neighbour graph of them, for corpora too large for brute force
+VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "chroma").lower()
+FLAT_INDEX_DIR: str = os.getenv("FLAT_INDEX_DIR", "AdaptiveRagChatbot/flat_index")
+# "int8" or "float16" storage of the flat index vectors
+FLAT_INDEX_DTYPE: str = os.getenv("FLAT_INDEX_DTYPE", "int8").lower()
+HNSW_INDEX_DIR: str = os.getenv("HNSW_INDEX_DIR", "AdaptiveRagChatbot/hnsw_index")
+# links per node, only used when the graph is created
+HNSW_M: int = int(os.getenv("HNSW_M", 16))
+# candidate list size while inserting, only used when the graph is created
+HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+# candidate list size while searching, trades latency for recall
+HNSW_EF_SEARCH: int = int(os.getenv("HNSW_EF_SEARCH", 64))
+
+## Index building
+EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+# comma separated text files chunked into the vector store
+INGEST_SOURCES: list = [
+    path.strip() for path in os.getenv("INGEST_SOURCES", "AdaptiveRagChatbot/top_uni_detailed.txt").split(",") if path.strip()
+]
+CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", 300))
+# "university" splits the sources along their university sections and tags the chunks with the
+# university, location and rank of their section, "recursive" splits them by size only
+CHUNKING_MODE: str = os.getenv("CHUNKING_MODE", "university").lower()
+# a chunk never crosses a section, the pieces of one section need less overlap
+UNIVERSITY_CHUNK_OVERLAP: int = int(os.getenv("UNIVERSITY_CHUNK_OVERLAP", 100))
+# hash, source file and offsets of every chunk in the vector store, and the model that embedded them
+INGEST_MANIFEST_PATH: str = os.getenv("INGEST_MANIFEST_PATH", "AdaptiveRagChatbot/ingest_manifest.json")
+# processes encoding the chunks of an ingestion, 0 lets the vector store encode them with its own embedding model
+EMBED_WORKERS: int = int(os.getenv("EMBED_WORKERS", 0))
+# texts per forward pass of the embedding model
+EMBED_BATCH_SIZE: int = int(os.getenv("EMBED_BATCH_SIZE", 32))
+# embeddings written to the vector store per call
+EMBED_WRITE_BATCH_SIZE: int = int(os.getenv("EMBED_WRITE_BATCH_SIZE", 256))
+
+## Query embedding cache
+QUERY_EMBEDDING_CACHE_ENABLED: bool = os.getenv("QUERY_EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", 4096))
+# a 768 dimensions embedding takes about 3 KB
+QUERY_EMBEDDING_CACHE_MAX_BYTES: int = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+## Semantic answer cache
+SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() == "true"
+# minimum cosine similarity between two questions naming the same universities for them to share an answer
+SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_TTL_SECONDS: int = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 60 * 60 * 24))
+SEMANTIC_CACHE_MAX_ENTRIES: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+SEMANTIC_CACHE_PATH: str = os.getenv("SEMANTIC_CACHE_PATH", "AdaptiveRagChatbot/cache/semantic_cache.npz")
+# the cache is written at most once per this many seconds after a change, and at shutdown
+SEMANTIC_CACHE_SAVE_SECONDS: float = float(os.getenv("SEMANTIC_CACHE_SAVE_SECONDS", 30))
+
+## Exact match cache for the structured output chains
+CHAIN_CACHE_PATH: str = os.getenv("CHAIN_CACHE_PATH", "AdaptiveRagChatbot/cache/chain_cache.sqlite3")
+CHAIN_CACHE_MAX_ENTRIES: int = int(os.getenv("CHAIN_CACHE_MAX_ENTRIES", 20000))
+# comma separated names of the chains to cache, set it empty to turn the cache off
+CHAIN_CACHE_CHAINS: set = {
+    name.strip() for name in os.getenv(
+        "CHAIN_CACHE_CHAINS",
+        "question_router,professor_search_router,json_results_router,"
+        "retrieval_grader,hallucination_grader,answer_grader,"
+        "generation_grader,question_rewriter,keywords_extractor",
+    ).split(",") if name.strip()
+}
+
+## Local embedding router
+# off until the margin is calibrated, check the leave-one-out accuracy with python -m AdaptiveRagChatbot.evaluate_router
+LOCAL_ROUTER_ENABLED: bool = os.getenv("LOCAL_ROUTER_ENABLED", "False").lower() == "true"
+# below this gap between the best and the second best label similarity the LLM router is used, not calibrated yet
+LOCAL_ROUTER_MIN_MARGIN: float = float(os.getenv("LOCAL_ROUTER_MIN_MARGIN", 0.08))
+# number of most similar examples of a label averaged to score the label
+LOCAL_ROUTER_TOP_K: int = int(os.getenv("LOCAL_ROUTER_TOP_K", 3))
+LOCAL_ROUTER_EXAMPLES_PATH: str = os.getenv("LOCAL_ROUTER_EXAMPLES_PATH", "AdaptiveRagChatbot/router_examples.json")
+
+## Professor lookup
+# find the professor and university names of the json in the question before asking the LLM extractor
+ENTITY_MATCHER_ENABLED: bool = os.getenv("ENTITY_MATCHER_ENABLED", "True").lower() == "true"
+UNIVERSITY_PROFESSORS_PATH: str = os.getenv("UNIVERSITY_PROFESSORS_PATH", "AdaptiveRagChatbot/university_professors.json")
+
+## Generation grading
+# "sequential" runs the hallucination grader then the answer grader, "concurrent" runs both
+# at the same time and "combined" gets both verdicts from a single LLM call
+GENERATION_GRADER_MODE: str = os.getenv("GENERATION_GRADER_MODE", "concurrent").lower()
+
+## Per request budget of the graph
+# maximum retries of each graph cycle (generate after a hallucination, transform_query after a not useful answer)
+GRAPH_MAX_RETRIES: int = int(os.getenv("GRAPH_MAX_RETRIES", 2))
+GRAPH_MAX_LLM_CALLS: int = int(os.getenv("GRAPH_MAX_LLM_CALLS", 15))
+GRAPH_DEADLINE_SECONDS: float = float(os.getenv("GRAPH_DEADLINE_SECONDS", 60))
+
+## Speculative retrieval
+# start the vectorstore retrieval while the question is being routed, used only if the route is vectorstore
+SPECULATIVE_RETRIEVAL: bool = os.getenv("SPECULATIVE_RETRIEVAL", "True").lower() == "true"
+# also grade the prefetched documents before the route is known, wastes grader calls on the other routes
+SPECULATIVE_GRADING: bool = os.getenv("SPECULATIVE_GRADING", "False").lower() == "true"
+
+## Prompts
+# vendored bundle of the versioned prompt templates, prompts of the override file replace the bundled ones
+PROMPTS_PATH: str = os.getenv("PROMPTS_PATH", "AdaptiveRagChatbot/prompts.json")
+PROMPTS_OVERRIDE_PATH: str = os.getenv("PROMPTS_OVERRIDE_PATH") or None
+
+## LLM gateway
+# every LLM call waits for a concurrency slot and a rate limit token of its provider
+LLM_PROVIDER_LIMITS: dict = {
+    "google": {
+        "requests_per_minute": float(os.getenv("LLM_GOOGLE_RPM", 1000)),
+        "max_concurrency": int(os.getenv("LLM_GOOGLE_MAX_CONCURRENCY", 16)),
+    },
+    "groq": {
+        "requests_per_minute": float(os.getenv("LLM_GROQ_RPM", 30)),
+        "max_concurrency": int(os.getenv("LLM_GROQ_MAX_CONCURRENCY", 4)),
+    },
+}
+# attempts after a rate limited (429) or unavailable (5xx) response, with jittered exponential backoff
+LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_RETRY_BASE_SECONDS: float = float(os.getenv("LLM_RETRY_BASE_SECONDS", 0.5))
+LLM_RETRY_MAX_SECONDS: float = float(os.getenv("LLM_RETRY_MAX_SECONDS", 20))
+# a call still waiting for its turn after this long fails with LLMGatewayBusy instead of piling up
+LLM_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+
+## Request coalescing
+# concurrent requests with the same rewritten question share one graph run
+SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "True").lower() == "true"
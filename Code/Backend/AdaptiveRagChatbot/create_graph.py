@@ -1,48 +1,68 @@
 from langgraph.graph import START, END, StateGraph
+from langchain_core.runnables import RunnableLambda
 from .graph_setup import (GraphState,
-                         professor_search,
-                         web_search,
-                         professor_search_from_json,
-                         format_search_results,
-                         general_query, 
-                         retrieve,generate,
-                         decide_to_generate,
-                         route_question,
-                         route_professor_query,
-                         route_json_results, 
-                         grade_documents,
-                         grade_generations,
-                         transform_query)
+                         professor_search, aprofessor_search,
+                         web_search, aweb_search,
+                         professor_search_from_json, aprofessor_search_from_json,
+                         format_search_results, aformat_search_results,
+                         general_query, ageneral_query,
+                         retrieve, aretrieve,
+                         generate, agenerate,
+                         decide_to_generate, adecide_to_generate,
+                         route_question, aroute_question,
+                         route_professor_query, aroute_professor_query,
+                         route_json_results, aroute_json_results,
+                         grade_documents, agrade_documents,
+                         grade_generations, agrade_generations,
+                         transform_query, atransform_query,
+                         route_and_prefetch, aroute_and_prefetch,
+                         selected_route)
+from .config import SPECULATIVE_RETRIEVAL
+
+
+def sync_and_async(func, afunc):
+    """
+    Pair a sync node/edge with its async version, chatbot.invoke runs func and chatbot.ainvoke runs afunc
+    """
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
 
 workflow = StateGraph(GraphState)
 
 #define nodes
 
-workflow.add_node("professor_search", professor_search)
-workflow.add_node("web_search", web_search)
-workflow.add_node("professor_search_from_json", professor_search_from_json)
-workflow.add_node("format_search_results", format_search_results)
-workflow.add_node("retrieve",retrieve)
-workflow.add_node("grade_documents", grade_documents)
-workflow.add_node("generate", generate)
-workflow.add_node("general_query", general_query)
-workflow.add_node("transform_query", transform_query)
+workflow.add_node("professor_search", sync_and_async(professor_search, aprofessor_search))
+workflow.add_node("web_search", sync_and_async(web_search, aweb_search))
+workflow.add_node("professor_search_from_json", sync_and_async(professor_search_from_json, aprofessor_search_from_json))
+workflow.add_node("format_search_results", sync_and_async(format_search_results, aformat_search_results))
+workflow.add_node("retrieve", sync_and_async(retrieve, aretrieve))
+workflow.add_node("grade_documents", sync_and_async(grade_documents, agrade_documents))
+workflow.add_node("generate", sync_and_async(generate, agenerate))
+workflow.add_node("general_query", sync_and_async(general_query, ageneral_query))
+workflow.add_node("transform_query", sync_and_async(transform_query, atransform_query))
 
 
 #build graph
-workflow.add_conditional_edges(
-    START,
-    route_question,
-    {
-        "professor_search": "professor_search",
-        "vectorstore": "retrieve",
-        "general_query": "general_query",
-    }
-)
+question_routes = {
+    "professor_search": "professor_search",
+    "vectorstore": "retrieve",
+    "general_query": "general_query",
+}
+
+if SPECULATIVE_RETRIEVAL:
+    # routing and vectorstore retrieval run at the same time in the route_question node
+    workflow.add_node("route_question", sync_and_async(route_and_prefetch, aroute_and_prefetch))
+    workflow.add_edge(START, "route_question")
+    workflow.add_conditional_edges("route_question", selected_route, question_routes)
+else:
+    workflow.add_conditional_edges(
+        START,
+        sync_and_async(route_question, aroute_question),
+        question_routes
+    )
 
 workflow.add_conditional_edges(
     "professor_search",
-    route_professor_query,
+    sync_and_async(route_professor_query, aroute_professor_query),
     {
         "json_data": "professor_search_from_json",
         "web_search": "web_search",
@@ -53,7 +73,7 @@ workflow.add_conditional_edges(
 workflow.add_edge("retrieve","grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
-    decide_to_generate,
+    sync_and_async(decide_to_generate, adecide_to_generate),
     {
         "transform_query": "transform_query",
         "generate": "generate",
@@ -63,16 +83,17 @@ workflow.add_conditional_edges(
 workflow.add_edge("transform_query", "web_search")
 workflow.add_conditional_edges(
     "generate",
-    grade_generations,
+    sync_and_async(grade_generations, agrade_generations),
     {
         "hallucination": "generate",
         "useful": END,
         "not useful": "transform_query",
+        "budget exhausted": END,
     }
 )
 workflow.add_conditional_edges(
     "professor_search_from_json",
-     route_json_results,
+     sync_and_async(route_json_results, aroute_json_results),
      {
          "not found" : "web_search",
          "found data": "format_search_results"
@@ -82,4 +103,4 @@ workflow.add_edge("web_search", "format_search_results")
 workflow.add_edge("format_search_results", END)
 workflow.add_edge("general_query", END)
 
-chatbot = workflow.compile()
\ No newline at end of file
+chatbot = workflow.compile()
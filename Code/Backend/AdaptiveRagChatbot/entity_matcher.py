@@ -0,0 +1,179 @@
+import json
+import unicodedata
+from collections import deque
+
+from langchain_core.callbacks import dispatch_custom_event, adispatch_custom_event
+from langchain_core.runnables import RunnableLambda
+
+from .lazy import singleton
+from .config import ENTITY_MATCHER_ENABLED, UNIVERSITY_PROFESSORS_PATH
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, strip the accents and replace punctuation with spaces, padded with a space on
+    both sides so that a normalized name only matches whole words of a normalized question.
+    """
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    words = "".join(c if c.isalnum() else " " for c in text.lower()).split()
+    return f" {' '.join(words)} "
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton, finds every occurrence of every pattern in one pass over the text.
+    """
+
+    def __init__(self, patterns: list):
+        # goto transitions, failure link and ids of the patterns ending at each state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.lengths = [len(pattern) for pattern in patterns]
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(pattern_id)
+
+        # breadth first so that the failure link of a state is set before its children need it
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                # the children of the root fall back to the root
+                if state:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> list:
+        """
+        Returns:
+            list: (start, end, pattern id) of every match, overlapping ones included
+        """
+        matches = []
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.output[state]:
+                matches.append((end - self.lengths[pattern_id], end, pattern_id))
+        return matches
+
+
+class EntityMatcher:
+    """
+    Find the professor and university names of university_professors.json in a question without the LLM.
+
+    Names are matched on whole words, ignoring case, accents and punctuation. Professor
+    names of a single word are left to the LLM extractor, they match too many questions.
+    """
+
+    def __init__(self, directory: dict):
+        # normalized name -> canonical names, several professors can share a name
+        self.names = {"professor": {}, "university": {}}
+        self.universities_of = {}
+        for university, professors in directory.items():
+            self.names["university"].setdefault(normalize_text(university), set()).add(university)
+            for name, _ in professors:
+                self.universities_of.setdefault(name, set()).add(university)
+                normalized = normalize_text(name)
+                if len(normalized.split()) > 1:
+                    self.names["professor"].setdefault(normalized, set()).add(name)
+
+        self.patterns = [(kind, normalized) for kind in self.names for normalized in self.names[kind]]
+        self.automaton = AhoCorasick([normalized for _, normalized in self.patterns])
+
+    def match(self, question: str) -> dict:
+        """
+        Args:
+            question (str): The user question
+
+        Returns:
+            dict: "professor" and "university" -> canonical names of the longest match of each kind
+        """
+        longest = {}
+        for start, end, pattern_id in self.automaton.find(normalize_text(question)):
+            kind, normalized = self.patterns[pattern_id]
+            if end - start > len(longest.get(kind, "")):
+                longest[kind] = normalized
+        return {kind: self.names[kind][normalized] for kind, normalized in longest.items()}
+
+    def extract(self, question: str):
+        """
+        Returns:
+            tuple: (professor name, university), None for the ones not in the question
+        """
+        matches = self.match(question)
+        universities = matches.get("university", set())
+        professors = matches.get("professor", set())
+        if universities and professors:
+            # prefer a professor of the university that was named
+            professors = {p for p in professors if self.universities_of[p] & universities} or professors
+            universities = {u for u in universities if any(u in self.universities_of[p] for p in professors)}
+
+        professor = min(professors) if professors else None
+        university = min(universities) if universities else None
+        return professor, university
+
+
+def load_university_professors(path: str = UNIVERSITY_PROFESSORS_PATH) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+@singleton
+def get_entity_matcher():
+    return EntityMatcher(load_university_professors())
+
+
+def local_first_keywords(llm_extractor, schema):
+    """
+    Take the professor and university from the entity matcher and only call the LLM extractor when it finds neither.
+
+    Args:
+        llm_extractor (Runnable): The LLM keywords extraction chain
+        schema (BaseModel): The pydantic class the extractor returns, with professor_name and university fields
+
+    Returns:
+        Runnable: The LLM extractor itself if the entity matcher is disabled
+    """
+    if not ENTITY_MATCHER_ENABLED:
+        return llm_extractor
+
+    matcher = get_entity_matcher()
+
+    def local_extract(question):
+        professor, university = matcher.extract(question)
+        if professor is None and university is None:
+            print("\n No known professor or university in the question, using LLM extractor")
+            return None
+        print(f"\n Entity matcher: {professor}, {university}")
+        return schema(professor_name=professor, university=university)
+
+    def invoke(inputs, config):
+        keywords = local_extract(inputs["question"])
+        if keywords is not None:
+            dispatch_custom_event("local_route", {"router": "keywords_extractor", "label": "entity_matcher"}, config=config)
+            return keywords
+        return llm_extractor.invoke(inputs, config)
+
+    async def ainvoke(inputs, config):
+        keywords = local_extract(inputs["question"])
+        if keywords is not None:
+            await adispatch_custom_event("local_route", {"router": "keywords_extractor", "label": "entity_matcher"}, config=config)
+            return keywords
+        return await llm_extractor.ainvoke(inputs, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="keywords_extractor")
@@ -0,0 +1,90 @@
+"""
+Recall@k and latency of the HNSW index against exact search, over a sweep of M and ef_search.
+
+The corpus is the embeddings stored in Chroma, the queries are the questions of
+router_examples.json. --grow-to pads the corpus with perturbed copies of the stored
+embeddings to see how the index behaves once the corpus is much larger. Run from the
+Backend directory, after the Chroma store was built:
+
+    python -m AdaptiveRagChatbot.evaluate_hnsw
+    python -m AdaptiveRagChatbot.evaluate_hnsw --grow-to 200000 --m 8 16 32 --ef 16 32 64 128 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .hnsw_index import HnswIndex
+from .config import HNSW_EF_CONSTRUCTION
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def grow(vectors: np.ndarray, size: int, noise: float = 0.5, seed: int = 0) -> np.ndarray:
+    """
+    Pad the corpus to size rows with noisy copies of its vectors, so that the neighbourhoods stay realistic.
+    """
+    if size <= len(vectors):
+        return vectors
+    rng = np.random.default_rng(seed)
+    copies = vectors[rng.integers(0, len(vectors), size - len(vectors))]
+    copies = copies + noise * rng.standard_normal(copies.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return np.vstack([vectors, normalize(copies)])
+
+
+def exact_search(corpus: np.ndarray, queries: np.ndarray, k: int):
+    """
+    Returns:
+        tuple: (top k rows of every query, mean ms per query)
+    """
+    start = time.perf_counter()
+    similarities = queries @ corpus.T
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return top, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def sweep(corpus: np.ndarray, queries: np.ndarray, k: int, m_values: list, ef_values: list, ef_construction: int):
+    exact, exact_ms = exact_search(corpus, queries, k)
+    print(f"\n== {len(corpus)} vectors, {len(queries)} queries, k={k}")
+    print(f"exact search: {exact_ms:.3f} ms per query")
+    print(f"{'M':>4} {'build s':>8} {'ef':>5} {'recall@k':>9} {'mean ms':>8} {'p95 ms':>7}")
+
+    ids = [str(i) for i in range(len(corpus))]
+    for m in m_values:
+        start = time.perf_counter()
+        index = HnswIndex.create(corpus.shape[1], m=m, ef_construction=ef_construction, capacity=len(corpus))
+        index.add(ids, corpus, [""] * len(corpus), [{}] * len(corpus))
+        build_seconds = time.perf_counter() - start
+
+        for ef in ef_values:
+            index.set_ef_search(ef)
+            recalls, latencies = [], []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                labels, _ = index.search_by_vector(query, k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                # labels are the row numbers, the rows were added in order to an empty index
+                recalls.append(len(set(labels) & set(truth.tolist())) / k)
+            print(f"{m:>4} {build_seconds:>8.1f} {ef:>5} {np.mean(recalls):>9.3f} "
+                  f"{np.mean(latencies):>8.3f} {np.percentile(latencies, 95):>7.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the HNSW parameters against exact search.")
+    parser.add_argument("--k", type=int, default=4, help="Results per query")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32], help="Links per node")
+    parser.add_argument("--ef", type=int, nargs="+", default=[8, 16, 32, 64, 128], help="Search candidate list sizes")
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION, help="Insert candidate list size")
+    parser.add_argument("--grow-to", type=int, default=0, help="Pad the corpus to this many vectors")
+    args = parser.parse_args()
+
+    from .retriever_setup import get_embeddings, get_chroma_store
+    from .local_router import load_router_examples
+
+    corpus = normalize(np.asarray(get_chroma_store().get(include=["embeddings"])["embeddings"], dtype=np.float32))
+    corpus = grow(corpus, args.grow_to)
+    questions = [q for examples in load_router_examples()["question_router"].values() for q in examples]
+    queries = normalize(np.asarray(get_embeddings().embed_documents(questions), dtype=np.float32))
+    sweep(corpus, queries, args.k, args.m, args.ef, args.ef_construction)
@@ -0,0 +1,77 @@
+"""
+Compare the cross-encoder reranker with the LLM retrieval grader on a fixed question set.
+
+For every vectorstore question in router_examples.json the documents are retrieved once and
+graded by both. The LLM verdicts are the reference, the reranker is scored against them over
+a sweep of thresholds. Run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.evaluate_relevance_grader
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+# grade with the LLM every time, the latency of a cache hit says nothing
+os.environ["CHAIN_CACHE_CHAINS"] = ""
+
+from .local_router import load_router_examples
+from .graph_setup import retrieve, grade_documents_batch
+from .reranker import get_reranker
+from .config import RERANKER_THRESHOLD
+
+
+def evaluate(questions, thresholds):
+    reranker = get_reranker()
+    reference, scores = [], []
+    latencies = {"llm": [], "reranker": []}
+
+    for question in questions:
+        documents = retrieve({"question": question})["documents"]
+        if not documents:
+            continue
+
+        start = time.perf_counter()
+        grades = grade_documents_batch(question, documents)
+        latencies["llm"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        question_scores = reranker.scores(question, documents)
+        latencies["reranker"].append(time.perf_counter() - start)
+
+        reference.extend(grade.binary_score == "yes" for grade in grades)
+        scores.extend(question_scores)
+        print(f"\n{question}\n  llm: {sum(g.binary_score == 'yes' for g in grades)}/{len(documents)} relevant, "
+              f"reranker scores: {', '.join(f'{s:.2f}' for s in question_scores)}")
+
+    if not reference:
+        print("\nNo documents were retrieved")
+        return
+
+    reference, scores = np.array(reference), np.array(scores)
+    print(f"\n== {len(latencies['llm'])} questions, {len(reference)} documents, "
+          f"{reference.mean():.1%} relevant according to the LLM")
+    print(f"{'threshold':>9} {'agreement':>10} {'precision':>10} {'recall':>7}")
+    for threshold in thresholds:
+        predicted = scores >= threshold
+        true_positives = (predicted & reference).sum()
+        precision = true_positives / predicted.sum() if predicted.sum() else float("nan")
+        recall = true_positives / reference.sum() if reference.sum() else float("nan")
+        print(f"{threshold:>9.2f} {(predicted == reference).mean():>10.3f} {precision:>10.3f} {recall:>7.3f}")
+
+    print(f"\n{'grader':<9} {'mean ms':>9} {'p95 ms':>8}  (per question)")
+    for grader, values in latencies.items():
+        print(f"{grader:<9} {np.mean(values) * 1000:>9.1f} {np.percentile(values, 95) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the reranker with the LLM retrieval grader.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first n questions")
+    parser.add_argument("--thresholds", type=float, nargs="+",
+                        default=sorted({-4.0, -2.0, 0.0, 2.0, 4.0, RERANKER_THRESHOLD}),
+                        help="Reranker thresholds to score against the LLM verdicts")
+    args = parser.parse_args()
+
+    questions = load_router_examples()["question_router"]["vectorstore"][:args.limit]
+    evaluate(questions, args.thresholds)
@@ -0,0 +1,90 @@
+"""
+Accuracy and latency report of the local embedding router on the labelled examples.
+
+Accuracy is measured leave-one-out: every example is classified against all the other
+examples. Run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.evaluate_router
+    python -m AdaptiveRagChatbot.evaluate_router --llm   # also time the LLM routers on the same questions
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .retriever_setup import get_embeddings
+from .local_router import EmbeddingRouter, load_router_examples
+from .config import LOCAL_ROUTER_MIN_MARGIN, LOCAL_ROUTER_TOP_K
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def leave_one_out(router: EmbeddingRouter):
+    """
+    Returns:
+        list: (true label, predicted label, margin) for every example
+    """
+    results = []
+    similarity_matrix = router.example_vectors @ router.example_vectors.T
+    for i, label_id in enumerate(router.example_labels):
+        similarities = similarity_matrix[i].copy()
+        similarities[i] = -np.inf
+        predicted, margin = router.best_label(router.label_scores(similarities))
+        results.append((router.labels[label_id], predicted, margin))
+    return results
+
+
+def report_router(name, examples, min_margin, top_k, with_llm):
+    router = EmbeddingRouter(get_embeddings(), examples, min_margin=min_margin, top_k=top_k)
+    results = leave_one_out(router)
+
+    total = len(results)
+    correct = sum(true == predicted for true, predicted, _ in results)
+    confident = [(true, predicted) for true, predicted, margin in results if margin >= min_margin]
+    confident_correct = sum(true == predicted for true, predicted in confident)
+
+    print(f"\n== {name} ({total} examples, margin >= {min_margin}, top_k = {top_k})")
+    print(f"accuracy (all)              : {correct / total:.3f}")
+    print(f"coverage (answered locally) : {len(confident) / total:.3f}")
+    if confident:
+        print(f"accuracy (answered locally) : {confident_correct / len(confident):.3f}")
+
+    for label in router.labels:
+        label_results = [predicted for true, predicted, _ in results if true == label]
+        label_correct = sum(predicted == label for predicted in label_results)
+        print(f"  {label:<20} {label_correct}/{len(label_results)}")
+
+    questions = [q for label in examples for q in examples[label]]
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        router.classify(question)
+        latencies.append(time.perf_counter() - start)
+    print(f"local latency p50/p95 (ms)  : {percentile(latencies, 50):.1f} / {percentile(latencies, 95):.1f}")
+
+    if with_llm:
+        from . import routes
+        llm_router = {"question_router": routes.get_llm_question_router,
+                      "professor_search_router": routes.get_llm_professor_search_router}[name]()
+        labels = [label for label in examples for _ in examples[label]]
+        llm_correct, llm_latencies = 0, []
+        for question, label in zip(questions, labels):
+            start = time.perf_counter()
+            source = llm_router.invoke({"question": question})
+            llm_latencies.append(time.perf_counter() - start)
+            llm_correct += source.datasource == label
+        print(f"LLM accuracy                : {llm_correct / total:.3f}")
+        print(f"LLM latency p50/p95 (ms)    : {percentile(llm_latencies, 50):.1f} / {percentile(llm_latencies, 95):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the local embedding router.")
+    parser.add_argument("--min-margin", type=float, default=LOCAL_ROUTER_MIN_MARGIN)
+    parser.add_argument("--top-k", type=int, default=LOCAL_ROUTER_TOP_K)
+    parser.add_argument("--llm", action="store_true", help="Also evaluate the LLM routers, needs the API keys")
+    args = parser.parse_args()
+
+    for router_name, router_examples in load_router_examples().items():
+        report_router(router_name, router_examples, args.min_margin, args.top_k, args.llm)
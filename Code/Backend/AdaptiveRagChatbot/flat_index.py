@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+from .metadata_filter import matches_filter
+
+# files of an index directory
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+# rows upcast to float32 per matrix-vector product, the whole top-100 corpus fits in one block
+SEARCH_BLOCK_ROWS = 16384
+# metadata filters whose matching rows are remembered, a question names a handful of universities
+FILTER_CACHE_SIZE = 256
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    Args:
+        vectors (np.ndarray): Unit norm float32 vectors, one per row
+        dtype (str): "float16" or "int8"
+
+    Returns:
+        tuple: (quantized vectors, float32 scale of each row, ones for float16)
+    """
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    if dtype == "int8":
+        # symmetric per row, the largest component of a row maps to 127
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported flat index dtype {dtype!r}, use float16 or int8")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class FlatIndex(VectorStore):
+    """
+    Brute force cosine search over a quantized, memory-mapped embedding matrix.
+
+    The vectors and the chunk texts are memory-mapped, so loading only reads the small
+    metadata file and the pages a search touches are shared with the page cache. A search
+    is one matrix-vector product followed by an argpartition for the top k.
+    """
+
+    def __init__(self, path: str, embedding_function):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.texts = np.memmap(os.path.join(path, TEXTS_FILE), dtype=np.uint8, mode="r") if self.offsets[-1] else None
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.metadatas = meta["metadatas"]
+        self.dtype = meta["dtype"]
+        # filter -> rows whose metadata matches it
+        self.filter_rows = {}
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def write(path: str, vectors, texts: List[str], metadatas: List[dict], ids: List[str], dtype: str = "int8"):
+        """
+        Write an index directory, replacing the one at the path.
+
+        Args:
+            path (str): Index directory
+            vectors (array): Embedding of each text, they are normalized before quantization
+            texts (list): Chunk texts
+            metadatas (list): Metadata of each chunk
+            ids (list): Id of each chunk
+            dtype (str): "float16" or "int8"
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = normalize(vectors.reshape(len(texts), -1)) if len(texts) else np.zeros((0, 1), dtype=np.float32)
+        quantized, scales = quantize(vectors, dtype)
+        FlatIndex.write_quantized(path, quantized, scales, texts, metadatas, ids, dtype)
+
+    @staticmethod
+    def write_quantized(path: str, quantized: np.ndarray, scales: np.ndarray, texts: List[str],
+                        metadatas: List[dict], ids: List[str], dtype: str):
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+
+        # written aside and swapped in, a running server keeps reading the files it mapped
+        staging = f"{path}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        np.save(os.path.join(staging, VECTORS_FILE), quantized)
+        np.save(os.path.join(staging, SCALES_FILE), scales)
+        np.save(os.path.join(staging, OFFSETS_FILE), offsets)
+        with open(os.path.join(staging, TEXTS_FILE), "wb") as f:
+            f.write(b"".join(encoded))
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump({"dtype": dtype, "ids": list(ids), "metadatas": [m or {} for m in metadatas]}, f)
+
+        previous = f"{path}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, previous)
+        os.rename(staging, path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    @classmethod
+    def export(cls, vector_store, path: str, dtype: str = "int8"):
+        """
+        Write the chunks and embeddings of a Chroma store to an index directory, nothing is re-embedded.
+        """
+        stored = vector_store.get(include=["embeddings", "documents", "metadatas"])
+        vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+        cls.write(path, vectors, stored["documents"], stored["metadatas"], stored["ids"], dtype=dtype)
+        print(f"\n Flat index of {len(stored['ids'])} chunks written to {path} ({dtype})")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, path: str = None, dtype: str = "int8", **kwargs):
+        texts = list(texts)
+        ids = ids or [str(i) for i in range(len(texts))]
+        cls.write(path, embedding.embed_documents(texts), texts, metadatas or [{} for _ in texts], ids, dtype=dtype)
+        return cls(path, embedding)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Embed and insert chunks, a chunk whose id is already in the index replaces it.
+
+        The files are rewritten and swapped in like an export, so this is meant for a few
+        chunks at a time, the ingest command keeps the index in sync with Chroma on its own.
+        """
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        added = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32).reshape(len(texts), -1)
+        quantized, scales = quantize(normalize(added), self.dtype)
+
+        replaced = set(ids)
+        kept = [row for row, cid in enumerate(self.ids) if cid not in replaced]
+        if kept:
+            # the kept rows are copied as they are, nothing is re-embedded or quantized again
+            quantized = np.concatenate([np.asarray(self.vectors[kept]), quantized])
+            scales = np.concatenate([np.asarray(self.scales[kept]), scales])
+        self.write_quantized(self.path, quantized, scales, [self.text(row) for row in kept] + texts,
+                             [self.metadatas[row] for row in kept] + metadatas, [self.ids[row] for row in kept] + ids,
+                             self.dtype)
+        self.__init__(self.path, self.embedding_function)
+        return ids
+
+    def text(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.texts[start:end]).decode("utf-8") if end > start else ""
+
+    def rows_matching(self, filter: dict) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Rows whose metadata matches the filter, in order
+        """
+        key = json.dumps(filter, sort_keys=True)
+        rows = self.filter_rows.get(key)
+        if rows is None:
+            if len(self.filter_rows) >= FILTER_CACHE_SIZE:
+                self.filter_rows.clear()
+            rows = np.array([row for row, metadata in enumerate(self.metadatas) if matches_filter(metadata, filter)],
+                            dtype=np.int64)
+            self.filter_rows[key] = rows
+        return rows
+
+    def search_by_vector(self, embedding, k: int, filter: Optional[dict] = None):
+        """
+        Args:
+            embedding (list): Query vector
+            k (int): Number of chunks to return
+            filter (dict): Only search the rows whose metadata matches it, the product skips the others
+
+        Returns:
+            tuple: (rows of the k most similar chunks, their cosine similarities), most similar first
+        """
+        rows = self.rows_matching(filter) if filter else None
+        size = len(self) if rows is None else len(rows)
+        if not size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        similarities = np.empty(size, dtype=np.float32)
+        # upcast a block of rows at a time, float32 accumulation without a float32 copy of the whole matrix
+        for start in range(0, size, SEARCH_BLOCK_ROWS):
+            if rows is None:
+                block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            else:
+                block = self.vectors[rows[start:start + SEARCH_BLOCK_ROWS]]
+            similarities[start:start + len(block)] = block.astype(np.float32) @ query
+        similarities *= self.scales if rows is None else self.scales[rows]
+        k = min(k, size)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return (top if rows is None else rows[top]), similarities[top]
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, filter: Optional[dict] = None):
+        rows, similarities = self.search_by_vector(embedding, k, filter=filter)
+        return [(Document(page_content=self.text(row), metadata=dict(self.metadatas[row])), float(similarity))
+                for row, similarity in zip(rows, similarities)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        # the query embedding is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(self.similarity_search, query, k, filter)
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity is already a relevance score
+        return lambda score: score
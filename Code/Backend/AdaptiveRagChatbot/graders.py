@@ -1,7 +1,10 @@
 from typing import Literal
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda, RunnableParallel
 from pydantic import BaseModel, Field
-from .llm_config import llm
+from .llm_config import get_llm
+from .chain_cache import cached_chain
+from .prompt_registry import get_prompt
+from .lazy import singleton
 
 ##Retrieval Grader
 class GradeDocument(BaseModel):
@@ -10,22 +13,11 @@ class GradeDocument(BaseModel):
         description="Document are relevant to the question, 'yes' or 'no'"
     )
 
-structured_llm_grader = llm.with_structured_output(GradeDocument)
 
-#Grader Prompt 
-system = """You are a grader assessing relevance of a retrieved document to a user question. \n 
-    If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
-    It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
-    Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
-
-grade_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-       ("human", "Retrieved document: \n\n {document} \n\n User question: {question}"),
-    ]
-)
-
-retrieval_grader = grade_prompt | structured_llm_grader
+@singleton
+def get_retrieval_grader():
+    structured_llm_grader = get_llm().with_structured_output(GradeDocument)
+    return cached_chain("retrieval_grader", get_prompt("retrieval_grader") | structured_llm_grader, GradeDocument)
 
 
 ##Halluciation Grader
@@ -35,18 +27,13 @@ class GradeHallucination(BaseModel):
         description="Answer is grounded in the facts, 'yes' or 'no'"
     )
 
-structured_llm_hallucination_grader = llm.with_structured_output(GradeHallucination)
 
-system = """You are a grader assessing whether an LLM generation is grounded in / supported by a set of retrieved facts. \n 
-     Give a binary score 'yes' or 'no'. 'Yes' means that the answer is grounded in / supported by the set of facts."""
-hallucination_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system),
-        ("human", "Set of facts: \n\n {documents} \n\n LLM generation: {generation}"),
-    ]
-)
-
-hallucination_grader = hallucination_prompt | structured_llm_hallucination_grader
+@singleton
+def get_hallucination_grader():
+    structured_llm_hallucination_grader = get_llm().with_structured_output(GradeHallucination)
+    return cached_chain("hallucination_grader",
+                        get_prompt("hallucination_grader") | structured_llm_hallucination_grader,
+                        GradeHallucination)
 
 
 ##Answer Grader
@@ -56,15 +43,36 @@ class GradeAnswer(BaseModel):
         description="LLM answer addresses the user question, 'yes' or 'no'"
     )
 
-structured_llm_answer_grader = llm.with_structured_output(GradeAnswer)
-# Prompt
-system = """You are a grader assessing whether an answer addresses a question \n 
-     Give a binary score 'yes' or 'no'. Yes' means that the answer addresses the question."""
-answer_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system),
-        ("human", "User question: \n\n {question} \n\n LLM generation: {generation}"),
-    ]
-)
-
-answer_grader = answer_prompt | structured_llm_answer_grader
+
+@singleton
+def get_answer_grader():
+    structured_llm_answer_grader = get_llm().with_structured_output(GradeAnswer)
+    return cached_chain("answer_grader", get_prompt("answer_grader") | structured_llm_answer_grader, GradeAnswer)
+
+
+##Generation Graders run concurrently
+# both graders get only the keys of their own prompt so their cache keys match the sequential path
+@singleton
+def get_generation_graders_parallel():
+    return RunnableParallel(
+        hallucination=RunnableLambda(lambda x: {"documents": x["documents"], "generation": x["generation"]}) | get_hallucination_grader(),
+        answer=RunnableLambda(lambda x: {"question": x["question"], "generation": x["generation"]}) | get_answer_grader(),
+    )
+
+
+##Combined Generation Grader
+class GradeGeneration(BaseModel):
+    """Binary scores for both the hallucination check and the answer check on generated text."""
+    grounded_score:str = Field(
+        description="Answer is grounded in the facts, 'yes' or 'no'"
+    )
+    answer_score:str = Field(
+        description="LLM answer addresses the user question, 'yes' or 'no'"
+    )
+
+
+@singleton
+def get_generation_grader():
+    structured_llm_generation_grader = get_llm().with_structured_output(GradeGeneration)
+    return cached_chain("generation_grader", get_prompt("generation_grader") | structured_llm_generation_grader, GradeGeneration)
+
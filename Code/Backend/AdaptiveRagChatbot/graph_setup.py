@@ -1,12 +1,24 @@
-from typing import List
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import List, Optional
 from typing_extensions import TypedDict
+from langchain.schema import Document
 
-from .retriever_setup import retriever 
-from .llm_config import llm
-from .graders import retrieval_grader, hallucination_grader,answer_grader
-from .query_rewriter import question_rewriter
-from .professor_web_search import web_search_tool, professor_search_json
-from .routes import question_router,professor_search_router,json_results_router
+from .retriever_setup import get_retriever
+from .llm_config import get_llm
+from .reranker import get_reranker
+from .graders import (get_retrieval_grader, get_hallucination_grader, get_answer_grader,
+                      get_generation_graders_parallel, get_generation_grader)
+from .query_rewriter import get_question_rewriter
+from .professor_web_search import get_web_search_tool, professor_search_json, aprofessor_search_json
+from .routes import get_question_router, get_professor_search_router, get_json_results_router
+from .prompt_registry import get_prompt
+from .lazy import singleton
+from .config import (GRADE_DOCUMENTS_MODE, GRADER_MAX_CONCURRENCY, GENERATION_GRADER_MODE,
+                     SPECULATIVE_GRADING, RELEVANCE_GRADER)
+from .budget import GraphBudget, budget_from_state
 
 
 class GraphState(TypedDict):
@@ -17,15 +29,22 @@ class GraphState(TypedDict):
         question: question
         generation: LLM generation
         documents: list of documents
+        budget: per request limits on retries, LLM calls and time, optional
+        datasource: route picked by route_and_prefetch
+        prefetched_documents: documents retrieved while routing
+        prefetched_relevant: prefetched documents graded as relevant while routing
     """
 
     question: str
     generation:str
     documents: List[str]
+    budget: Optional[GraphBudget]
+    datasource: Optional[str]
+    prefetched_documents: Optional[List[Document]]
+    prefetched_relevant: Optional[List[Document]]
 
 
 ## Graph Flow
-from langchain.schema import Document
 
 def retrieve(state):
     """
@@ -40,12 +59,29 @@ def retrieve(state):
     print("\n RETRIEVE")
     question = state['question']
 
-    documents = retriever.invoke(question)
+    if state.get("prefetched_documents") is not None:
+        print("\n Using documents prefetched while routing")
+        return {"documents": state["prefetched_documents"], "question": question, "prefetched_documents": None}
+
+    documents = get_retriever().invoke(question)
+    return{"documents": documents,"question":question}
+
+async def aretrieve(state):
+    """
+    Async version of retrieve
+    """
+    print("\n RETRIEVE")
+    question = state['question']
+
+    if state.get("prefetched_documents") is not None:
+        print("\n Using documents prefetched while routing")
+        return {"documents": state["prefetched_documents"], "question": question, "prefetched_documents": None}
+
+    documents = await get_retriever().ainvoke(question)
     return{"documents": documents,"question":question}
 
 
 ##Generator
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 
 # def get_chain():
@@ -57,9 +93,17 @@ from langchain_core.output_parsers import StrOutputParser
 #     rag_chain = prompt | llm | StrOutputParser()
 #     return rag_chain
 
-prompt = hub.pull("rlm/rag-prompt")
+# tag for the LLM calls whose output is the answer shown to the user, used to pick the tokens to stream
+FINAL_ANSWER_TAG = "final_answer"
+
+@singleton
+def get_answer_llm():
+    return get_llm().with_config(tags=[FINAL_ANSWER_TAG])
 
-rag_chain = prompt | llm | StrOutputParser()
+@singleton
+def get_rag_chain():
+    # vendored copy of the rlm/rag-prompt hub prompt, startup does not depend on the network
+    return get_prompt("rag") | get_answer_llm() | StrOutputParser()
 
 def generate(state):
     """
@@ -78,7 +122,18 @@ def generate(state):
 
     #RAG Generation
     
-    generation = rag_chain.invoke({"context":documents, "question": question})
+    generation = get_rag_chain().invoke({"context":documents, "question": question})
+    return {"documents": documents, "question": question, "generation": generation}
+
+async def agenerate(state):
+    """
+    Async version of generate
+    """
+    print("\n GENERATE")
+    question = state['question']
+    documents = state['documents']
+
+    generation = await get_rag_chain().ainvoke({"context":documents, "question": question})
     return {"documents": documents, "question": question, "generation": generation}
 
 def grade_documents(state):
@@ -95,11 +150,79 @@ def grade_documents(state):
     question = state["question"]
     documents = state["documents"]
 
+    if state.get("prefetched_relevant") is not None:
+        print("\n Using documents graded while routing")
+        return {"documents": state["prefetched_relevant"], "question": question, "prefetched_relevant": None}
+
+    return {"documents": relevant_documents(question, documents), "question": question}
+
+async def agrade_documents(state):
+    """
+    Async version of grade_documents
+    """
+    print("\n Check Document relevance to question")
+    question = state["question"]
+    documents = state["documents"]
+
+    if state.get("prefetched_relevant") is not None:
+        print("\n Using documents graded while routing")
+        return {"documents": state["prefetched_relevant"], "question": question, "prefetched_relevant": None}
+
+    return {"documents": await arelevant_documents(question, documents), "question": question}
+
+def relevant_documents(question, documents, cancelled: Optional[threading.Event] = None):
+    """
+    Grade the documents with the configured grader and grading mode and keep the relevant ones.
+
+    Args:
+        question (str): The user question
+        documents (list): Retrieved documents
+        cancelled (threading.Event): Set when the grades are no longer needed, checked before each grader call
+
+    Returns:
+        list: Relevant documents, most relevant first with the reranker
+    """
+    check_cancelled(cancelled)
+    if RELEVANCE_GRADER == "reranker":
+        documents, scores = get_reranker().rerank(question, documents)
+    elif GRADE_DOCUMENTS_MODE == "batch":
+        scores = grade_documents_batch(question, documents, cancelled)
+    else:
+        scores = []
+        for d in documents:
+            check_cancelled(cancelled)
+            scores.append(get_retrieval_grader().invoke({"question": question, "document": d.page_content}))
+    return filter_graded_documents(documents, scores)
+
+async def arelevant_documents(question, documents):
+    """
+    Async version of relevant_documents
+    """
+    if RELEVANCE_GRADER == "reranker":
+        # the forward pass is CPU bound, keep it off the event loop
+        documents, scores = await asyncio.to_thread(get_reranker().rerank, question, documents)
+    elif GRADE_DOCUMENTS_MODE == "batch":
+        scores = await agrade_documents_batch(question, documents)
+    else:
+        scores = [
+            await get_retrieval_grader().ainvoke({"question": question, "document": d.page_content})
+            for d in documents
+        ]
+    return filter_graded_documents(documents, scores)
+
+def filter_graded_documents(documents, scores):
+    """
+    Keep only the documents graded as relevant.
+
+    Args:
+        documents (list): Retrieved documents
+        scores (list): Grader outputs in the same order as the documents
+
+    Returns:
+        list: Relevant documents
+    """
     filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content}
-        )
+    for d, score in zip(documents, scores):
         grade = score.binary_score
         if grade == "yes":
             print("\n Document is relevant")
@@ -107,7 +230,37 @@ def grade_documents(state):
         else:
             print("\nDocument is not relevant to the question")
             continue
-    return {"documents": filtered_docs, "question": question}
+    return filtered_docs
+
+def grade_documents_batch(question, documents, cancelled: Optional[threading.Event] = None):
+    """
+    Grade all the documents against the question at the same time.
+
+    Args:
+        question (str): The user question
+        documents (list): Retrieved documents to grade
+        cancelled (threading.Event): Checked between waves of GRADER_MAX_CONCURRENCY calls
+
+    Returns:
+        list: Grader outputs in the same order as the documents
+    """
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+    # batch keeps the output order same as the input order
+    if cancelled is None:
+        return get_retrieval_grader().batch(inputs, config={"max_concurrency": GRADER_MAX_CONCURRENCY})
+    scores = []
+    for i in range(0, len(inputs), GRADER_MAX_CONCURRENCY):
+        check_cancelled(cancelled)
+        scores += get_retrieval_grader().batch(inputs[i:i + GRADER_MAX_CONCURRENCY],
+                                               config={"max_concurrency": GRADER_MAX_CONCURRENCY})
+    return scores
+
+async def agrade_documents_batch(question, documents):
+    """
+    Async version of grade_documents_batch
+    """
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+    return await get_retrieval_grader().abatch(inputs, config={"max_concurrency": GRADER_MAX_CONCURRENCY})
 
 def transform_query(state):
     """
@@ -124,7 +277,19 @@ def transform_query(state):
     documents = state["documents"]
 
     #rewrite query
-    res = question_rewriter.invoke({"question": question})
+    res = get_question_rewriter().invoke({"question": question})
+    print("\nNew transformed query in adaptive rag", res.query)
+    return {"documents": documents, "question": res.query}
+
+async def atransform_query(state):
+    """
+    Async version of transform_query
+    """
+    print("\n Transform Query")
+    question = state["question"]
+    documents = state["documents"]
+
+    res = await get_question_rewriter().ainvoke({"question": question})
     print("\nNew transformed query in adaptive rag", res.query)
     return {"documents": documents, "question": res.query}
 
@@ -140,13 +305,33 @@ def professor_search(state):
     """
     return {"question": state["question"]}
 
+async def aprofessor_search(state):
+    """
+    Async version of professor_search
+    """
+    return {"question": state["question"]}
+
 
 def web_search(state):
     print("\nWeb Search")
     question = state["question"]
 
     #web search
-    docs = web_search_tool.invoke({"query":question})
+    docs = get_web_search_tool().invoke({"query":question})
+
+    web_results = "\n".join([d["content"] for d in docs])
+    web_results = Document(page_content = web_results)
+
+    return{"documents":web_results, "question":question}
+
+async def aweb_search(state):
+    """
+    Async version of web_search
+    """
+    print("\nWeb Search")
+    question = state["question"]
+
+    docs = await get_web_search_tool().ainvoke({"query":question})
 
     web_results = "\n".join([d["content"] for d in docs])
     web_results = Document(page_content = web_results)
@@ -171,6 +356,17 @@ def professor_search_from_json(state):
     
     return{"documents":json_results, "question":question}
 
+async def aprofessor_search_from_json(state):
+    """
+    Async version of professor_search_from_json
+    """
+    print("\n Professor Search from JSON")
+    question = state["question"]
+
+    json_results = await aprofessor_search_json(question)
+
+    return{"documents":json_results, "question":question}
+
 def format_search_results(state):
     """
     Format the search results for display to the user
@@ -184,11 +380,22 @@ def format_search_results(state):
     question = state['question']
     documents = state['documents']
     print("\n Format Search Results")
-    resp = llm.invoke(f"""For the question by the user :: {question} \n
-                        The results of web search are {documents}. \n Now give the answer only addressing the user question from the retrieved web search document
-                        \n NO PREAMBLE AND EXTRA TEXTS""")
+    resp = get_answer_llm().invoke(format_search_results_prompt(question, documents))
     return {"question":question, "generation":resp.content}
 
+async def aformat_search_results(state):
+    """
+    Async version of format_search_results
+    """
+    question = state['question']
+    documents = state['documents']
+    print("\n Format Search Results")
+    resp = await get_answer_llm().ainvoke(format_search_results_prompt(question, documents))
+    return {"question":question, "generation":resp.content}
+
+def format_search_results_prompt(question, documents):
+    return get_prompt("format_search_results").format_messages(question=question, documents=documents)
+
 def general_query(state):
     """
     Respond to general query of the user 
@@ -201,11 +408,133 @@ def general_query(state):
     """
     question = state['question']
     print("\n General Query")
-    resp = llm.invoke(question)
+    resp = get_answer_llm().invoke(question)
+    return {"question":question, "generation":resp.content}
+
+async def ageneral_query(state):
+    """
+    Async version of general_query
+    """
+    question = state['question']
+    print("\n General Query")
+    resp = await get_answer_llm().ainvoke(question)
     return {"question":question, "generation":resp.content}
 
 
 
+## Speculative retrieval
+# retrieval runs in these threads while the sync graph waits on the router
+prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+class PrefetchCancelled(Exception):
+    """
+    Stops a prefetch thread once the question was routed away from the vectorstore.
+    """
+
+def check_cancelled(cancelled: Optional[threading.Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise PrefetchCancelled()
+
+def drop_prefetch(future, cancelled):
+    # a started thread cannot be cancelled, the flag stops it before its next grader call
+    cancelled.set()
+    future.cancel()
+    print("\n Dropping prefetched documents")
+
+def drop_aprefetch(task):
+    task.cancel()
+    # a prefetch that already failed would otherwise log "Task exception was never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    print("\n Dropping prefetched documents")
+
+def route_and_prefetch(state):
+    """
+    Route the question and retrieve vectorstore documents at the same time.
+    The prefetched documents are kept only if the question is routed to the vectorstore.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Adds datasource, and the prefetched documents on the vectorstore route
+    """
+    question = state["question"]
+    cancelled = threading.Event()
+    # copy the context so that the callbacks of the run (budget, tracing) see the prefetch calls
+    future = prefetch_executor.submit(copy_context().run, prefetch_documents, question, cancelled)
+
+    try:
+        datasource = route_question(state)
+    except BaseException:
+        drop_prefetch(future, cancelled)
+        raise
+    if datasource != "vectorstore":
+        drop_prefetch(future, cancelled)
+        return {"datasource": datasource}
+
+    try:
+        documents, relevant = future.result()
+    except Exception as e:
+        # the retrieve node retrieves again without the prefetch
+        print(f"\n Prefetch failed, retrieving again: {e!r}")
+        return {"datasource": datasource}
+    return {"datasource": datasource, "prefetched_documents": documents, "prefetched_relevant": relevant}
+
+async def aroute_and_prefetch(state):
+    """
+    Async version of route_and_prefetch
+    """
+    question = state["question"]
+    task = asyncio.create_task(aprefetch_documents(question))
+
+    datasource = None
+    try:
+        datasource = await aroute_question(state)
+    finally:
+        if datasource != "vectorstore":
+            drop_aprefetch(task)
+    if datasource != "vectorstore":
+        return {"datasource": datasource}
+
+    try:
+        documents, relevant = await task
+    except Exception as e:
+        # the retrieve node retrieves again without the prefetch
+        print(f"\n Prefetch failed, retrieving again: {e!r}")
+        return {"datasource": datasource}
+    return {"datasource": datasource, "prefetched_documents": documents, "prefetched_relevant": relevant}
+
+def prefetch_documents(question, cancelled: Optional[threading.Event] = None):
+    """
+    Args:
+        question (str): The user question
+        cancelled (threading.Event): Set once the question is routed elsewhere, stops the prefetch before its next call
+
+    Returns:
+        tuple: (retrieved documents, relevant documents or None if SPECULATIVE_GRADING is off)
+    """
+    check_cancelled(cancelled)
+    print("\n Prefetch RETRIEVE")
+    documents = get_retriever().invoke(question)
+    relevant = relevant_documents(question, documents, cancelled) if SPECULATIVE_GRADING else None
+    return documents, relevant
+
+async def aprefetch_documents(question):
+    """
+    Async version of prefetch_documents
+    """
+    print("\n Prefetch RETRIEVE")
+    documents = await get_retriever().ainvoke(question)
+    relevant = await arelevant_documents(question, documents) if SPECULATIVE_GRADING else None
+    return documents, relevant
+
+def selected_route(state):
+    """
+    Route picked by route_and_prefetch.
+    """
+    return state["datasource"]
+
+
 ### Conditional edges
 
 def route_question(state):
@@ -221,7 +550,20 @@ def route_question(state):
     print("\n Route Question")
     question = state["question"]
 
-    source = question_router.invoke({"question": question})
+    source = get_question_router().invoke({"question": question})
+    return question_route(source)
+
+async def aroute_question(state):
+    """
+    Async version of route_question
+    """
+    print("\n Route Question")
+    question = state["question"]
+
+    source = await get_question_router().ainvoke({"question": question})
+    return question_route(source)
+
+def question_route(source):
     print("\n SOURCE:"+source.datasource)
     if source.datasource == "vectorstore":
         return "vectorstore"
@@ -243,7 +585,19 @@ def route_professor_query(state):
     """
     print("\n Route Professor Query")
     question = state["question"]
-    source = professor_search_router.invoke({"question": question})
+    source = get_professor_search_router().invoke({"question": question})
+    return professor_query_route(source)
+
+async def aroute_professor_query(state):
+    """
+    Async version of route_professor_query
+    """
+    print("\n Route Professor Query")
+    question = state["question"]
+    source = await get_professor_search_router().ainvoke({"question": question})
+    return professor_query_route(source)
+
+def professor_query_route(source):
     print("\n SOURCE:"+source.datasource)
     if source.datasource == "json_data":
         return "json_data"
@@ -254,7 +608,17 @@ def route_json_results(state):
     print("\n Route according to JSON Results")
     question = state["question"]
     documents = state["documents"]
-    source = json_results_router.invoke({"question":question,"documents": documents})
+    source = get_json_results_router().invoke({"question":question,"documents": documents})
+    return json_results_route(source)
+
+async def aroute_json_results(state):
+    print("\n Route according to JSON Results")
+    question = state["question"]
+    documents = state["documents"]
+    source = await get_json_results_router().ainvoke({"question":question,"documents": documents})
+    return json_results_route(source)
+
+def json_results_route(source):
     print("\n SOURCE:"+source.datasource)
     if source.datasource == "web_search":
         return "not found"
@@ -287,6 +651,12 @@ def decide_to_generate(state):
         # We have relevant documents, so generate answer
         print("\nDecision: Generate answer")
         return "generate"
+
+async def adecide_to_generate(state):
+    """
+    Async version of decide_to_generate, no LLM call is made here
+    """
+    return decide_to_generate(state)
     
 def grade_generations(state):
     """
@@ -299,26 +669,133 @@ def grade_generations(state):
         str: Decision for next node to call
     """
     print("\n Check hallucinations")
-    question = state["question"]
-    documents = state["documents"]
-    generation = state["generation"]
-    score = hallucination_grader.invoke(
+    budget = budget_from_state(state)
+    if budget is not None and not budget.check():
+        print(f"\n Budget exhausted ({budget.exhausted}), returning the generation without grading")
+        return "budget exhausted"
+    verdict = generation_verdict(state["question"], state["documents"], state["generation"])
+    return budget_verdict(budget, verdict)
+
+async def agrade_generations(state):
+    """
+    Async version of grade_generations
+    """
+    print("\n Check hallucinations")
+    budget = budget_from_state(state)
+    if budget is not None and not budget.check():
+        print(f"\n Budget exhausted ({budget.exhausted}), returning the generation without grading")
+        return "budget exhausted"
+    verdict = await ageneration_verdict(state["question"], state["documents"], state["generation"])
+    return budget_verdict(budget, verdict)
+
+def budget_verdict(budget, verdict):
+    """
+    Stop the hallucination and not useful cycles once the budget has run out.
+
+    Args:
+        budget (GraphBudget): The budget of the run, None for no limits
+        verdict (str): Decision of the generation graders
+
+    Returns:
+        str: The verdict, or "budget exhausted" to end with the current generation
+    """
+    if budget is None or verdict == "useful":
+        return verdict
+    cycle = "generate" if verdict == "hallucination" else "transform_query"
+    if budget.try_retry(cycle):
+        return verdict
+    print(f"\n Budget exhausted ({budget.exhausted}), returning the best generation")
+    return "budget exhausted"
+
+def generation_verdict(question, documents, generation, mode=None):
+    """
+    Grade the generation with the configured generation grader mode.
+
+    Args:
+        question (str): The user question
+        documents (list): Documents the generation is based on
+        generation (str): LLM generation
+        mode (str): "sequential", "concurrent" or "combined", defaults to GENERATION_GRADER_MODE
+
+    Returns:
+        str: "useful", "not useful" or "hallucination"
+    """
+    mode = mode or GENERATION_GRADER_MODE
+    inputs = {"question": question, "documents": documents, "generation": generation}
+
+    if mode == "combined":
+        score = get_generation_grader().invoke(inputs)
+        return generation_grade_route(score.grounded_score, score.answer_score)
+
+    if mode == "concurrent":
+        scores = get_generation_graders_parallel().invoke(inputs)
+        return generation_grade_route(scores["hallucination"].binary_score, scores["answer"].binary_score)
+
+    score = get_hallucination_grader().invoke(
         {"documents": documents, "generation": generation}
     )
     grade = score.binary_score
     if grade == "yes":
         print("\n Generation is grounded in the documents")
         print("\n Grade generation vs question")
-        score = answer_grader.invoke(
+        score = get_answer_grader().invoke(
             {"question": question, "generation": generation}
         )   
-        grade = score.binary_score
-        if grade == "yes":
-            print("\n Decision: Generation answers the question")
-            return "useful"
-        else:
-            print("\n Decision: Generation does not addreess question")
-            return "not useful"
+        return answer_grade_route(score)
     else:
         print("\n Generation is not grounded in the documents, Retry...")
-        return "hallucination"
\ No newline at end of file
+        return "hallucination"
+
+async def ageneration_verdict(question, documents, generation, mode=None):
+    """
+    Async version of generation_verdict
+    """
+    mode = mode or GENERATION_GRADER_MODE
+    inputs = {"question": question, "documents": documents, "generation": generation}
+
+    if mode == "combined":
+        score = await get_generation_grader().ainvoke(inputs)
+        return generation_grade_route(score.grounded_score, score.answer_score)
+
+    if mode == "concurrent":
+        scores = await get_generation_graders_parallel().ainvoke(inputs)
+        return generation_grade_route(scores["hallucination"].binary_score, scores["answer"].binary_score)
+
+    score = await get_hallucination_grader().ainvoke(
+        {"documents": documents, "generation": generation}
+    )
+    grade = score.binary_score
+    if grade == "yes":
+        print("\n Generation is grounded in the documents")
+        print("\n Grade generation vs question")
+        score = await get_answer_grader().ainvoke(
+            {"question": question, "generation": generation}
+        )
+        return answer_grade_route(score)
+    else:
+        print("\n Generation is not grounded in the documents, Retry...")
+        return "hallucination"
+
+def generation_grade_route(grounded_grade, answer_grade):
+    """
+    Decision when both the hallucination and the answer verdicts are known at once.
+    """
+    if grounded_grade != "yes":
+        print("\n Generation is not grounded in the documents, Retry...")
+        return "hallucination"
+    print("\n Generation is grounded in the documents")
+    if answer_grade == "yes":
+        print("\n Decision: Generation answers the question")
+        return "useful"
+    else:
+        print("\n Decision: Generation does not addreess question")
+        return "not useful"
+
+def answer_grade_route(score):
+    grade = score.binary_score
+    if grade == "yes":
+        print("\n Decision: Generation answers the question")
+        return "useful"
+    else:
+        print("\n Decision: Generation does not addreess question")
+        return "not useful"
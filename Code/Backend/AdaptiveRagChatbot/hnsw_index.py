@@ -0,0 +1,263 @@
+import asyncio
+import json
+import os
+import shutil
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+from .config import HNSW_INDEX_DIR, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+from .metadata_filter import matches_filter
+
+INDEX_FILE = "index.bin"
+META_FILE = "meta.json"
+
+# room added when the graph is full, so that inserts do not resize one chunk at a time
+GROWTH_FACTOR = 1.5
+# a filter matching at most this many chunks is searched exactly over their vectors, a graph
+# search restricted to a small part of the corpus visits most of the graph for few results
+EXACT_FILTER_LIMIT = 4096
+# metadata filters whose matching labels are remembered until the next insert or delete
+FILTER_CACHE_SIZE = 256
+
+
+class HnswIndex(VectorStore):
+    """
+    Approximate cosine search over an HNSW graph (hnswlib) for corpora too large for brute force.
+
+    Chunks are inserted and deleted in place. Deleted chunks are only marked, their slots
+    are reused by later inserts, so the graph never has to be rebuilt. m and ef_construction
+    are fixed when the graph is created. ef_search is a setting of the whole graph, it is not
+    changed per search so that concurrent queries run in parallel without a lock.
+    """
+
+    def __init__(self, index, chunks: dict, embedding_function=None, ef_search: int = 64):
+        """
+        Args:
+            index (hnswlib.Index): The graph, labels are the keys of chunks
+            chunks (dict): label -> {"id", "text", "metadata"} of the live chunks
+            embedding_function (Embeddings): Embeds the text queries
+            ef_search (int): Candidate list size of a search, larger is slower and more accurate
+        """
+        self.index = index
+        self.chunks = chunks
+        self.labels = {chunk["id"]: label for label, chunk in chunks.items()}
+        # labels of deleted chunks are never given out again
+        self.next_label = max(chunks, default=-1) + 1
+        self.embedding_function = embedding_function
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+        # filter -> labels whose metadata matches it
+        self.filter_labels = {}
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def create(cls, dim: int, m: int = 16, ef_construction: int = 200, capacity: int = 1024, **kwargs):
+        import hnswlib
+
+        index = hnswlib.Index(space="cosine", dim=dim)
+        index.init_index(max_elements=max(capacity, 1), ef_construction=ef_construction, M=m, allow_replace_deleted=True)
+        return cls(index, {}, **kwargs)
+
+    @classmethod
+    def load(cls, path: str, embedding_function=None, ef_search: int = 64):
+        import hnswlib
+
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+        index = hnswlib.Index(space="cosine", dim=meta["dim"])
+        index.load_index(os.path.join(path, INDEX_FILE), allow_replace_deleted=True)
+        chunks = {int(label): chunk for label, chunk in meta["chunks"].items()}
+        store = cls(index, chunks, embedding_function=embedding_function, ef_search=ef_search)
+        store.next_label = max(store.next_label, meta["next_label"])
+        return store
+
+    def save(self, path: str):
+        """
+        Write the graph and the chunks, swapped in so that a reader never sees half of them.
+        """
+        staging = f"{path}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        self.index.save_index(os.path.join(staging, INDEX_FILE))
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump({"dim": self.index.dim, "m": self.index.M, "ef_construction": self.index.ef_construction,
+                       "next_label": self.next_label, "chunks": self.chunks}, f)
+
+        previous = f"{path}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, previous)
+        os.rename(staging, path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    def add(self, ids: List[str], vectors, texts: List[str], metadatas: List[dict]):
+        """
+        Insert chunks, a chunk whose id is already in the index replaces it.
+        """
+        if not len(ids):
+            return
+        self.delete(ids=[cid for cid in ids if cid in self.labels])
+        self.filter_labels.clear()
+        # slots of deleted chunks are reused before the graph grows
+        needed = len(self.chunks) + len(ids)
+        if needed > self.index.max_elements:
+            self.index.resize_index(int(needed * GROWTH_FACTOR))
+
+        labels = np.arange(self.next_label, self.next_label + len(ids))
+        self.next_label += len(ids)
+        self.index.add_items(np.asarray(vectors, dtype=np.float32), labels, replace_deleted=True)
+        for label, cid, text, metadata in zip(labels.tolist(), ids, texts, metadatas):
+            self.chunks[label] = {"id": cid, "text": text, "metadata": metadata or {}}
+            self.labels[cid] = label
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any):
+        self.filter_labels.clear()
+        for cid in ids or []:
+            label = self.labels.pop(cid, None)
+            if label is not None:
+                self.index.mark_deleted(label)
+                del self.chunks[label]
+
+    def sync(self, vector_store, batch_size: int = 1024) -> dict:
+        """
+        Apply the inserts and deletes that make the index match a Chroma store, nothing is re-embedded.
+
+        Returns:
+            dict: Number of chunks added and deleted
+        """
+        stored_ids = set(vector_store.get(include=[])["ids"])
+        stale = [cid for cid in self.labels if cid not in stored_ids]
+        missing = sorted(stored_ids - set(self.labels))
+        self.delete(ids=stale)
+        for i in range(0, len(missing), batch_size):
+            stored = vector_store.get(ids=missing[i:i + batch_size], include=["embeddings", "documents", "metadatas"])
+            self.add(stored["ids"], stored["embeddings"], stored["documents"], stored["metadatas"])
+        print(f"\n HNSW index synced, {len(missing)} added, {len(stale)} deleted, {len(self)} chunks")
+        return {"add": len(missing), "delete": len(stale)}
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, m: int = 16, ef_construction: int = 200, **kwargs):
+        texts = list(texts)
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        store = cls.create(vectors.shape[1], m=m, ef_construction=ef_construction, capacity=len(texts),
+                           embedding_function=embedding, **kwargs)
+        store.add(ids or [str(i) for i in range(len(texts))], vectors, texts, metadatas or [{} for _ in texts])
+        return store
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(self.next_label + i) for i in range(len(texts))]
+        self.add(ids, self.embedding_function.embed_documents(texts), texts, metadatas or [{} for _ in texts])
+        return ids
+
+    def labels_matching(self, filter: dict) -> List[int]:
+        """
+        Returns:
+            list: Labels of the live chunks whose metadata matches the filter
+        """
+        key = json.dumps(filter, sort_keys=True)
+        labels = self.filter_labels.get(key)
+        if labels is None:
+            if len(self.filter_labels) >= FILTER_CACHE_SIZE:
+                self.filter_labels.clear()
+            labels = [label for label, chunk in self.chunks.items() if matches_filter(chunk["metadata"], filter)]
+            self.filter_labels[key] = labels
+        return labels
+
+    def set_ef_search(self, ef_search: int):
+        """
+        Change the candidate list size of the searches, only while no search is running, eg. in the evaluation sweep.
+        """
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+
+    def search_by_vector(self, embedding, k: int, filter: Optional[dict] = None):
+        """
+        Args:
+            embedding (list): Query vector
+            k (int): Number of chunks to return
+            filter (dict): Only return the chunks whose metadata matches it
+
+        Returns:
+            tuple: (labels of the k most similar chunks, their cosine similarities), most similar first
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        allowed = self.labels_matching(filter) if filter else None
+        if allowed is not None and len(allowed) <= EXACT_FILTER_LIMIT:
+            return self._exact_search(query, k, allowed)
+
+        k = min(k, len(self) if allowed is None else len(allowed))
+        if not k:
+            return [], []
+        search_filter = None
+        if allowed is not None:
+            allowed = set(allowed)
+            search_filter = lambda label: label in allowed
+        # hnswlib searches with max(ef, k) candidates, the shared ef is never changed here
+        labels, distances = self.index.knn_query(query, k=k, filter=search_filter)
+        return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+    def _exact_search(self, query: np.ndarray, k: int, labels: List[int]):
+        k = min(k, len(labels))
+        if not k:
+            return [], []
+        # the graph stores the vectors normalized
+        vectors = np.asarray(self.index.get_items(labels), dtype=np.float32)
+        similarities = vectors @ (query / (np.linalg.norm(query) or 1.0))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [labels[i] for i in top.tolist()], similarities[top].tolist()
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, filter: Optional[dict] = None):
+        labels, similarities = self.search_by_vector(embedding, k, filter=filter)
+        return [(Document(page_content=self.chunks[label]["text"], metadata=dict(self.chunks[label]["metadata"])), similarity)
+                for label, similarity in zip(labels, similarities)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        # the query embedding and the graph search are CPU bound, keep them off the event loop
+        return await asyncio.to_thread(self.similarity_search, query, k, filter)
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity is already a relevance score
+        return lambda score: score
+
+
+def sync_hnsw_index(vector_store, path: str = HNSW_INDEX_DIR) -> dict:
+    """
+    Create the HNSW index of a Chroma store, or bring the persisted one up to date with it.
+
+    Returns:
+        dict: Number of chunks added and deleted
+    """
+    if os.path.exists(path):
+        store = HnswIndex.load(path, ef_search=HNSW_EF_SEARCH)
+    else:
+        first = vector_store.get(limit=1, include=["embeddings"])["embeddings"]
+        if first is None or not len(first):
+            raise ValueError("The vector store is empty, run the ingest command first")
+        store = HnswIndex.create(len(first[0]), m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                                 capacity=len(vector_store.get(include=[])["ids"]), ef_search=HNSW_EF_SEARCH)
+    changes = store.sync(vector_store)
+    if changes["add"] or changes["delete"] or not os.path.exists(path):
+        store.save(path)
+    return changes
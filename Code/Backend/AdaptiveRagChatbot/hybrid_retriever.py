@@ -0,0 +1,165 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, List, Optional
+
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from .metadata_filter import matches_filter
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "of", "on", "or", "the", "their", "there", "this", "to", "what", "which",
+    "who", "with", "about", "tell", "its",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In memory Okapi BM25 inverted index over the chunks of the vector store.
+
+    The chunks themselves are kept in the index so that a keyword hit can be returned
+    without a round trip to the vector store.
+    """
+
+    def __init__(self, texts: List[str], metadatas: List[dict] = None, k1: float = 1.5, b: float = 0.75):
+        self.texts = list(texts)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.texts]
+        self.k1 = k1
+        self.b = b
+
+        # term -> [(chunk id, term frequency), ...]
+        self.postings = {}
+        self.lengths = []
+        for chunk_id, text in enumerate(self.texts):
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((chunk_id, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+        n = len(self.texts)
+        self.idf = {term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for term, postings in self.postings.items()}
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], **kwargs):
+        return cls([d.page_content for d in documents], [d.metadata for d in documents], **kwargs)
+
+    def search(self, query: str, k: int, filter: Optional[dict] = None) -> List[tuple]:
+        """
+        Args:
+            query (str): The user question
+            k (int): Number of chunks to return
+            filter (dict): Only score the chunks whose metadata matches it
+
+        Returns:
+            list: (chunk id, score) of the k best scoring chunks, best first
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        if filter:
+            scores = {chunk_id: score for chunk_id, score in scores.items() if matches_filter(self.metadatas[chunk_id], filter)}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def document(self, chunk_id: int) -> Document:
+        return Document(page_content=self.texts[chunk_id], metadata=dict(self.metadatas[chunk_id]))
+
+    def save(self, path: str):
+        """
+        Only the chunks are written, the postings are rebuilt on load.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "texts": self.texts, "metadatas": self.metadatas}, f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["texts"], data["metadatas"], k1=data["k1"], b=data["b"])
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuse the dense similarity ranking of the vector store with the BM25 ranking using reciprocal rank fusion.
+
+    A chunk scores weight / (rrf_k + rank) in each ranking it appears in, rank starting at 1.
+    Dense and BM25 hits of the same chunk are merged on the chunk text. Without a BM25 index
+    only the dense ranking is used. When the question names universities, both rankings are
+    restricted to their chunks, and the unfiltered rankings are used if none of them matches.
+    """
+
+    vector_store: Any
+    bm25_index: Any = None
+    university_detector: Any = None
+    k: int = 4
+    fetch_k: int = 20
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+    rrf_k: int = 60
+
+    def metadata_filter(self, query: str) -> Optional[dict]:
+        return self.university_detector.filter_for(query) if self.university_detector is not None else None
+
+    def fuse(self, query: str, dense_documents: List[Document], filter: Optional[dict] = None) -> List[Document]:
+        """
+        Args:
+            query (str): The user question
+            dense_documents (list): Vector store results, best first
+            filter (dict): Metadata filter the dense results were searched with
+
+        Returns:
+            list: The k best documents after the fusion
+        """
+        sparse_documents = []
+        if self.bm25_index is not None:
+            sparse_documents = [self.bm25_index.document(chunk_id)
+                                for chunk_id, _ in self.bm25_index.search(query, self.fetch_k, filter=filter)]
+
+        scores, documents = {}, {}
+        for weight, ranking in ((self.dense_weight, dense_documents), (self.sparse_weight, sparse_documents)):
+            if not weight:
+                continue
+            for rank, document in enumerate(ranking, start=1):
+                key = document.page_content
+                documents.setdefault(key, document)
+                scores[key] = scores.get(key, 0.0) + weight / (self.rrf_k + rank)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in ranked]
+
+    def search(self, query: str, filter: Optional[dict] = None) -> List[Document]:
+        """
+        Fused results for an explicit metadata filter, without the fallback to the unfiltered search.
+        """
+        if filter:
+            return self.fuse(query, self.vector_store.similarity_search(query, k=self.fetch_k, filter=filter), filter)
+        return self.fuse(query, self.vector_store.similarity_search(query, k=self.fetch_k))
+
+    async def asearch(self, query: str, filter: Optional[dict] = None) -> List[Document]:
+        if filter:
+            return self.fuse(query, await self.vector_store.asimilarity_search(query, k=self.fetch_k, filter=filter), filter)
+        return self.fuse(query, await self.vector_store.asimilarity_search(query, k=self.fetch_k))
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        filter = self.metadata_filter(query)
+        return (self.search(query, filter) if filter else None) or self.search(query)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        filter = self.metadata_filter(query)
+        return (await self.asearch(query, filter) if filter else None) or await self.asearch(query)
@@ -0,0 +1,221 @@
+"""
+Bring the vector store up to date with the source files, embedding only the chunks that changed.
+
+Every chunk is identified by the hash of its source file, text and metadata, so a chunk whose
+text did not change keeps its embedding, chunks that are gone are deleted and the new ones are
+embedded. The manifest records the source file and offsets of every chunk and the
+embedding model, changing the model re-embeds everything. Run from the Backend directory:
+
+    python -m AdaptiveRagChatbot.ingest --dry-run   # only report what would change
+    python -m AdaptiveRagChatbot.ingest
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from .config import (EMBEDDING_MODEL, INGEST_SOURCES, CHUNK_SIZE, CHUNK_OVERLAP, CHUNKING_MODE,
+                     UNIVERSITY_CHUNK_OVERLAP, INGEST_MANIFEST_PATH, BM25_INDEX_PATH, EMBED_WORKERS, VECTOR_BACKEND,
+                     FLAT_INDEX_DIR, FLAT_INDEX_DTYPE)
+
+# chunks sent to the vector store per call, chroma rejects very large batches
+BATCH_SIZE = 256
+
+
+# metadata that only locates a chunk, kept in the manifest and not in the vector store
+OFFSET_KEYS = ("start_index", "end_index")
+
+
+def chunk_id(source: str, text: str, metadata: dict = None) -> str:
+    key = f"{source}\n{text}"
+    # chunks without section metadata keep the ids they had before the sections were tagged
+    tags = {k: v for k, v in (metadata or {}).items() if k not in ("source", *OFFSET_KEYS)}
+    if tags:
+        key += "\n" + json.dumps(tags, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def split_sources(sources: list, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> dict:
+    """
+    A source with university sections is split along them when CHUNKING_MODE is "university",
+    any other source is split by size only.
+
+    Args:
+        sources (list): Paths of the text files
+
+    Returns:
+        dict: chunk id -> Document, with its offsets and section metadata in the metadata
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import TextLoader
+    from .university_chunking import split_sections, split_by_university
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    chunks = {}
+    for source in sources:
+        loaded = TextLoader(source).load()
+        text = loaded[0].page_content if loaded else ""
+        if CHUNKING_MODE == "university" and any(metadata for _, _, metadata in split_sections(text)):
+            documents = split_by_university(text, source, chunk_size, UNIVERSITY_CHUNK_OVERLAP)
+        else:
+            documents = text_splitter.split_documents(loaded)
+            for document in documents:
+                document.metadata["source"] = source
+                document.metadata["end_index"] = document.metadata["start_index"] + len(document.page_content)
+        for document in documents:
+            # identical chunks of a file are stored once, at their first offset
+            chunks.setdefault(chunk_id(source, document.page_content, document.metadata), document)
+    return chunks
+
+
+def stored_document(document):
+    """
+    Copy of the chunk as it is stored, offsets live in the manifest so that a chunk that only moved keeps its embedding.
+    """
+    from langchain.schema import Document
+
+    return Document(page_content=document.page_content,
+                    metadata={k: v for k, v in document.metadata.items() if k not in OFFSET_KEYS})
+
+
+def load_manifest(path: str = INGEST_MANIFEST_PATH) -> dict:
+    if not os.path.exists(path):
+        return {"model": None, "chunks": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def manifest_entry(document) -> dict:
+    entry = {"source": document.metadata["source"], "start": document.metadata["start_index"],
+             "end": document.metadata["end_index"]}
+    # the university detector is built from the tagged sections
+    tags = {k: v for k, v in document.metadata.items() if k not in ("source", *OFFSET_KEYS)}
+    if tags:
+        entry["metadata"] = tags
+    return entry
+
+
+def save_manifest(chunks: dict, path: str = INGEST_MANIFEST_PATH):
+    manifest = {
+        "model": EMBEDDING_MODEL,
+        "chunking": CHUNKING_MODE,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": UNIVERSITY_CHUNK_OVERLAP if CHUNKING_MODE == "university" else CHUNK_OVERLAP,
+        "chunks": {cid: manifest_entry(d) for cid, d in chunks.items()},
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def plan(chunks: dict, stored_ids: set, manifest: dict) -> dict:
+    """
+    Args:
+        chunks (dict): chunk id -> Document of the current sources
+        stored_ids (set): Ids in the vector store
+        manifest (dict): Manifest of the last ingestion
+
+    Returns:
+        dict: Ids to "add", "delete" and "keep"
+    """
+    if manifest["model"] != EMBEDDING_MODEL:
+        # embeddings of another model (or of an unknown one) cannot be mixed with the new ones
+        return {"add": set(chunks), "delete": set(stored_ids), "keep": set()}
+    return {
+        "add": set(chunks) - stored_ids,
+        "delete": stored_ids - set(chunks),
+        "keep": set(chunks) & stored_ids,
+    }
+
+
+def update_store(vector_store, chunks: dict, sources: list, manifest_path: str = INGEST_MANIFEST_PATH,
+                 dry_run: bool = False, collection_name: str = None) -> dict:
+    """
+    Upsert the new and changed chunks into a vector store, delete its stale ones and record them in its manifest.
+
+    Args:
+        vector_store (Chroma): The store to update, may be empty
+        chunks (dict): chunk id -> Document of the current sources, with their offsets
+        sources (list): Paths of the source files, for the report
+        manifest_path (str): Manifest of the store
+        dry_run (bool): Only report the changes
+        collection_name (str): Chroma collection of the store, the one of top_uni_detailed.txt by default
+
+    Returns:
+        dict: Number of chunks added, deleted and kept
+    """
+    stored_ids = set(vector_store.get(include=[])["ids"])
+    manifest = load_manifest(manifest_path)
+    changes = plan(chunks, stored_ids, manifest)
+    report = {action: len(ids) for action, ids in changes.items()}
+
+    print(f"\n Ingest {', '.join(sources)} with {EMBEDDING_MODEL}")
+    if manifest["model"] not in (None, EMBEDDING_MODEL):
+        print(f"\n Embedding model changed from {manifest['model']}, re-embedding everything")
+    for source in sources:
+        added = sum(chunks[cid].metadata["source"] == source for cid in changes["add"])
+        print(f"   {source}: {added} new or changed chunks")
+    moved = sum(manifest["chunks"].get(cid, {}).get("start") not in (None, chunks[cid].metadata["start_index"])
+                for cid in changes["keep"])
+    print(f"\n {report['add']} to add, {report['delete']} to delete, {report['keep']} unchanged ({moved} moved)")
+    if dry_run:
+        return report
+
+    start = time.perf_counter()
+    delete_ids = sorted(changes["delete"])
+    for i in range(0, len(delete_ids), BATCH_SIZE):
+        vector_store.delete(ids=delete_ids[i:i + BATCH_SIZE])
+    add_ids = sorted(changes["add"], key=lambda cid: (chunks[cid].metadata["source"], chunks[cid].metadata["start_index"]))
+    if EMBED_WORKERS > 0 and add_ids:
+        from .bulk_embedding import add_documents_bulk
+        from .retriever_setup import CHROMA_COLLECTION
+        add_documents_bulk(collection_name or CHROMA_COLLECTION, [stored_document(chunks[cid]) for cid in add_ids], add_ids)
+    else:
+        for i in range(0, len(add_ids), BATCH_SIZE):
+            batch = add_ids[i:i + BATCH_SIZE]
+            vector_store.add_documents([stored_document(chunks[cid]) for cid in batch], ids=batch)
+    print(f"\n Vector store updated in {time.perf_counter() - start:.1f} s")
+
+    save_manifest(chunks, manifest_path)
+    return report
+
+
+def ingest(vector_store, sources: list = INGEST_SOURCES, dry_run: bool = False) -> dict:
+    """
+    Upsert the new and changed chunks of the sources and delete the stale ones, then update the indexes built from them.
+
+    Args:
+        vector_store (Chroma): The store to update, may be empty
+        sources (list): Paths of the text files
+        dry_run (bool): Only report the changes
+
+    Returns:
+        dict: Number of chunks added, deleted and kept
+    """
+    chunks = split_sources(sources)
+    report = update_store(vector_store, chunks, sources, dry_run=dry_run)
+    if dry_run:
+        return report
+    if report["add"] or report["delete"] or not os.path.exists(BM25_INDEX_PATH):
+        # the BM25 index covers the same chunks as the embeddings
+        from .hybrid_retriever import BM25Index
+        BM25Index.from_documents([stored_document(chunks[cid]) for cid in sorted(chunks)]).save(BM25_INDEX_PATH)
+        print("\n BM25 index rebuilt")
+    if VECTOR_BACKEND == "flat" and (report["add"] or report["delete"] or not os.path.exists(FLAT_INDEX_DIR)):
+        from .flat_index import FlatIndex
+        FlatIndex.export(vector_store, FLAT_INDEX_DIR, dtype=FLAT_INDEX_DTYPE)
+    if VECTOR_BACKEND == "hnsw":
+        # inserts and deletes in place, only the changed chunks touch the graph
+        from .hnsw_index import sync_hnsw_index
+        sync_hnsw_index(vector_store)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the vector store from the source files.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--source", nargs="+", default=INGEST_SOURCES, help="Text files to ingest, chunks of any other file are deleted")
+    args = parser.parse_args()
+
+    from .retriever_setup import open_vector_store
+    ingest(open_vector_store(), sources=args.source, dry_run=args.dry_run)
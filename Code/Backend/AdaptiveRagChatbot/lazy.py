@@ -0,0 +1,34 @@
+import functools
+import threading
+
+_UNSET = object()
+
+
+def singleton(builder):
+    """
+    Turn a builder function into a getter of a process wide object built on first use.
+
+    The getter is thread safe, the builder runs at most once. The built value can be
+    replaced with getter.override(value), eg. by the benchmark to install stand-ins,
+    and getter.is_built() tells if the object exists yet.
+    """
+    lock = threading.Lock()
+    value = _UNSET
+
+    @functools.wraps(builder)
+    def get():
+        nonlocal value
+        if value is _UNSET:
+            with lock:
+                if value is _UNSET:
+                    value = builder()
+        return value
+
+    def override(new_value):
+        nonlocal value
+        with lock:
+            value = new_value
+
+    get.override = override
+    get.is_built = lambda: value is not _UNSET
+    return get
@@ -1,8 +1,24 @@
 # from langchain_groq import ChatGroq
 # llm = ChatGroq(model = "meta-llama/llama-4-scout-17b-16e-instruct", temperature=0)
 
-from langchain_google_genai import ChatGoogleGenerativeAI
+from .lazy import singleton
+from .llm_gateway import get_llm_gateway, PRIORITY_CHAT
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0)
\ No newline at end of file
+
+@singleton
+def get_chat_model():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash",
+        temperature=0,
+        # a single attempt, rate limited calls are retried by the gateway
+        max_retries=1)
+
+
+@singleton
+def get_llm():
+    """
+    The chat model of the chatbot, every call goes through the LLM gateway.
+    """
+    return get_llm_gateway().wrap(get_chat_model(), provider="google", priority=PRIORITY_CHAT)
@@ -0,0 +1,423 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Optional
+
+from langchain_core.runnables import Runnable
+
+from .lazy import singleton
+from .tracing import metrics
+from .config import (LLM_PROVIDER_LIMITS,
+                     LLM_MAX_RETRIES,
+                     LLM_RETRY_BASE_SECONDS,
+                     LLM_RETRY_MAX_SECONDS,
+                     LLM_QUEUE_TIMEOUT_SECONDS)
+
+# lower goes first, only among the calls waiting for the same provider
+PRIORITY_CHAT = 0
+PRIORITY_SOP_REVIEW = 10
+
+# longest a waiter sleeps before checking the limiter again when nobody wakes it up
+MAX_WAIT_SECONDS = 1.0
+
+
+class LLMGatewayBusy(Exception):
+    """
+    Raised when a call waited too long for its turn or was still rate limited after every retry.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProviderLimiter:
+    """
+    Token bucket rate limit and bounded concurrency of one LLM provider.
+
+    Waiting calls are kept in a priority queue and only the head of the queue may take a
+    concurrency slot and a token, so a burst of low priority calls can not starve the
+    interactive ones. Each provider has its own queue, priorities do not order the calls
+    of different providers. Sync callers wait on a threading.Event and async callers on an
+    asyncio.Event, both are woken when a slot is released.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, max_concurrency: int, burst: Optional[float] = None):
+        self.name = name
+        self.rate = requests_per_minute / 60
+        self.max_concurrency = max_concurrency
+        self.capacity = burst or max(1.0, min(float(max_concurrency), requests_per_minute))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+
+        # heap of [priority, sequence, notify]
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority: int, timeout: float):
+        """
+        Block until the call may go ahead, release() must be called once it is done.
+        """
+        event = threading.Event()
+        entry = self._enqueue(priority, event.set)
+        started_at = time.monotonic()
+        try:
+            while True:
+                wait = self._poll(entry, started_at, timeout)
+                if wait is None:
+                    return
+                event.wait(wait)
+                event.clear()
+        except BaseException:
+            self._abandon(entry)
+            raise
+
+    async def aacquire(self, priority: int, timeout: float):
+        """
+        Async version of acquire
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop of an abandoned waiter is already closed
+                pass
+
+        entry = self._enqueue(priority, notify)
+        started_at = time.monotonic()
+        try:
+            while True:
+                wait = self._poll(entry, started_at, timeout)
+                if wait is None:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except BaseException:
+            # also on cancellation, eg. a speculative prefetch dropped by the router
+            self._abandon(entry)
+            raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._gauges()
+            self._wake_head()
+
+    def back_off(self, seconds: float):
+        """
+        Stop handing out tokens for a while after the provider rate limited a call.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": len(self._waiters),
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "tokens": round(self.tokens, 2),
+                "requests_per_minute": self.rate * 60,
+                "paused_for_seconds": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            }
+
+    def _enqueue(self, priority, notify):
+        entry = [priority, next(self._sequence), notify]
+        with self._lock:
+            heapq.heappush(self._waiters, entry)
+            metrics.observe(f"gateway.{self.name}.queue_depth_on_arrival", len(self._waiters) - 1)
+            self._gauges()
+        return entry
+
+    def _poll(self, entry, started_at, timeout) -> Optional[float]:
+        """
+        Returns:
+            float | None: None once the call is admitted, otherwise seconds to wait before polling again
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._admit(entry, now)
+            if wait is None:
+                metrics.observe(f"gateway.{self.name}.wait_ms", (now - started_at) * 1000)
+                return None
+            remaining = started_at + timeout - now
+        if remaining <= 0:
+            metrics.increment(f"gateway.{self.name}.queue_timeouts")
+            raise LLMGatewayBusy(f"No {self.name} LLM capacity within {timeout:.0f} seconds", retry_after=wait)
+        return min(wait, remaining, MAX_WAIT_SECONDS)
+
+    def _admit(self, entry, now) -> Optional[float]:
+        # called with the lock held
+        if self._waiters[0] is not entry or self.in_flight >= self.max_concurrency:
+            return MAX_WAIT_SECONDS
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate if self.rate > 0 else MAX_WAIT_SECONDS
+
+        self.tokens -= 1
+        heapq.heappop(self._waiters)
+        self.in_flight += 1
+        self._gauges()
+        # the next waiter may be admitted right away if there is another slot and token
+        self._wake_head()
+        return None
+
+    def _abandon(self, entry):
+        with self._lock:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._gauges()
+                self._wake_head()
+
+    def _wake_head(self):
+        if self._waiters:
+            self._waiters[0][2]()
+
+    def _gauges(self):
+        metrics.set_gauge(f"gateway.{self.name}.queue_depth", len(self._waiters))
+        metrics.set_gauge(f"gateway.{self.name}.in_flight", self.in_flight)
+
+
+class LLMGateway:
+    """
+    Single entry point of every LLM call: waits for the provider limiter, then retries
+    rate limited and unavailable responses with jittered exponential backoff.
+
+    The providers are limited independently, a call only waits behind the calls of its own provider.
+    """
+
+    def __init__(self, provider_limits: dict, max_retries: int, retry_base_seconds: float,
+                 retry_max_seconds: float, queue_timeout_seconds: float):
+        self.provider_limits = provider_limits
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        with self._lock:
+            if provider not in self.limiters:
+                limits = self.provider_limits.get(provider, {"requests_per_minute": 60, "max_concurrency": 4})
+                self.limiters[provider] = ProviderLimiter(provider, **limits)
+            return self.limiters[provider]
+
+    def wrap(self, runnable, provider: str, priority: int = PRIORITY_CHAT) -> "GatewayRunnable":
+        """
+        Args:
+            runnable (Runnable): A chat model, or a chain that calls exactly one
+            provider (str): Key of the provider limits, eg. "google"
+            priority (int): PRIORITY_CHAT or PRIORITY_SOP_REVIEW
+
+        Returns:
+            GatewayRunnable: The runnable with every call going through the gateway
+        """
+        return GatewayRunnable(runnable, self, provider, priority)
+
+    def call(self, func, provider: str, priority: int):
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire(priority, self.queue_timeout_seconds)
+            try:
+                return func()
+            except Exception as e:
+                delay = self._retry_delay(limiter, e, attempt)
+            finally:
+                limiter.release()
+            time.sleep(delay)
+
+    async def acall(self, afunc, provider: str, priority: int):
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            await limiter.aacquire(priority, self.queue_timeout_seconds)
+            try:
+                return await afunc()
+            except Exception as e:
+                delay = self._retry_delay(limiter, e, attempt)
+            finally:
+                limiter.release()
+            await asyncio.sleep(delay)
+
+    def call_stream(self, func, provider: str, priority: int):
+        """
+        Streaming version of call, the slot is held until the stream is exhausted or closed.
+        A call is only retried if it failed before its first chunk.
+        """
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire(priority, self.queue_timeout_seconds)
+            streamed = False
+            try:
+                for chunk in func():
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                if streamed:
+                    raise
+                delay = self._retry_delay(limiter, e, attempt)
+            finally:
+                limiter.release()
+            time.sleep(delay)
+
+    async def acall_stream(self, afunc, provider: str, priority: int):
+        """
+        Async version of call_stream
+        """
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            await limiter.aacquire(priority, self.queue_timeout_seconds)
+            streamed = False
+            try:
+                async for chunk in afunc():
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                if streamed:
+                    raise
+                delay = self._retry_delay(limiter, e, attempt)
+            finally:
+                limiter.release()
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, limiter: ProviderLimiter, error: Exception, attempt: int) -> float:
+        """
+        Returns:
+            float: Seconds to wait before the next attempt, re-raises the error if it should not be retried
+        """
+        rate_limited = is_rate_limit_error(error)
+        if not (rate_limited or is_unavailable_error(error)):
+            raise error
+
+        metrics.increment(f"gateway.{limiter.name}.{'rate_limited' if rate_limited else 'unavailable'}")
+        # full jitter so that the calls rate limited together do not retry together
+        delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+        delay = max(delay, retry_after_seconds(error) or 0.0)
+        if rate_limited:
+            limiter.back_off(delay)
+
+        if attempt >= self.max_retries:
+            metrics.increment(f"gateway.{limiter.name}.gave_up")
+            raise LLMGatewayBusy(f"{limiter.name} LLM is overloaded: {error}", retry_after=delay) from error
+        metrics.increment(f"gateway.{limiter.name}.retries")
+        print(f"\n {limiter.name} LLM call failed ({type(error).__name__}), retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            limiters = dict(self.limiters)
+        return {provider: limiter.stats() for provider, limiter in limiters.items()}
+
+
+class GatewayRunnable(Runnable):
+    """
+    Runnable that sends the calls of the wrapped runnable through the gateway.
+
+    It adds no run of its own to the callbacks, so tracing, budgets and token streaming
+    still see the wrapped chat model directly. batch and abatch of Runnable call invoke and
+    ainvoke once per input, so every call of a batch waits for the limiter too.
+    """
+
+    def __init__(self, runnable, gateway: LLMGateway, provider: str, priority: int):
+        self.runnable = runnable
+        self.gateway = gateway
+        self.provider = provider
+        self.priority = priority
+        self.name = getattr(runnable, "name", None)
+
+    @property
+    def model(self):
+        return getattr(self.runnable, "model", type(self.runnable).__name__)
+
+    @property
+    def InputType(self):
+        return self.runnable.InputType
+
+    @property
+    def OutputType(self):
+        return self.runnable.OutputType
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.gateway.call(lambda: self.runnable.invoke(input, config, **kwargs),
+                                 self.provider, self.priority)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.gateway.acall(lambda: self.runnable.ainvoke(input, config, **kwargs),
+                                        self.provider, self.priority)
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self.gateway.call_stream(lambda: self.runnable.stream(input, config, **kwargs),
+                                            self.provider, self.priority)
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.gateway.acall_stream(lambda: self.runnable.astream(input, config, **kwargs),
+                                                     self.provider, self.priority):
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs) -> "GatewayRunnable":
+        return GatewayRunnable(self.runnable.with_structured_output(schema, **kwargs),
+                               self.gateway, self.provider, self.priority)
+
+    def with_priority(self, priority: int) -> "GatewayRunnable":
+        return GatewayRunnable(self.runnable, self.gateway, self.provider, priority)
+
+
+def status_code(error: Exception) -> Optional[int]:
+    for candidate in (error, getattr(error, "response", None)):
+        for attribute in ("status_code", "code"):
+            value = getattr(candidate, attribute, None)
+            if isinstance(value, int):
+                return int(value)
+    return None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if status_code(error) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("429", "resourceexhausted", "resource_exhausted", "ratelimit",
+                                             "rate limit", "too many requests"))
+
+
+def is_unavailable_error(error: Exception) -> bool:
+    if status_code(error) in (500, 502, 503, 504):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("serviceunavailable", "service unavailable", "overloaded"))
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+@singleton
+def get_llm_gateway():
+    return LLMGateway(LLM_PROVIDER_LIMITS,
+                      max_retries=LLM_MAX_RETRIES,
+                      retry_base_seconds=LLM_RETRY_BASE_SECONDS,
+                      retry_max_seconds=LLM_RETRY_MAX_SECONDS,
+                      queue_timeout_seconds=LLM_QUEUE_TIMEOUT_SECONDS)
@@ -0,0 +1,134 @@
+import asyncio
+import json
+
+import numpy as np
+from langchain_core.callbacks import dispatch_custom_event, adispatch_custom_event
+from langchain_core.runnables import RunnableLambda
+
+from .retriever_setup import get_embeddings
+from .config import (LOCAL_ROUTER_ENABLED,
+                     LOCAL_ROUTER_MIN_MARGIN,
+                     LOCAL_ROUTER_TOP_K,
+                     LOCAL_ROUTER_EXAMPLES_PATH)
+
+
+class EmbeddingRouter:
+    """
+    Route a question locally by comparing its embedding with labelled example questions.
+
+    Each label is scored with the mean cosine similarity of its top_k most similar
+    examples. The route is only trusted when the best label beats the second best
+    by at least min_margin.
+    """
+
+    def __init__(self, embeddings, examples: dict, min_margin: float, top_k: int):
+        self.embeddings = embeddings
+        self.min_margin = min_margin
+        self.top_k = top_k
+        self.labels = list(examples)
+
+        texts, label_ids = [], []
+        for label_id, label in enumerate(self.labels):
+            texts.extend(examples[label])
+            label_ids.extend([label_id] * len(examples[label]))
+
+        self.example_vectors = self._normalize(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+        self.example_labels = np.asarray(label_ids)
+
+    def scores(self, question: str) -> dict:
+        """
+        Args:
+            question (str): The user question
+
+        Returns:
+            dict: Score of each label
+        """
+        query = self._normalize(np.asarray(self.embeddings.embed_query(question), dtype=np.float32))
+        return self.label_scores(self.example_vectors @ query)
+
+    def label_scores(self, similarities: np.ndarray) -> dict:
+        """
+        Args:
+            similarities (np.ndarray): Similarity of the question with every example
+
+        Returns:
+            dict: Score of each label
+        """
+        scores = {}
+        for label_id, label in enumerate(self.labels):
+            label_similarities = similarities[self.example_labels == label_id]
+            k = min(self.top_k, len(label_similarities))
+            scores[label] = float(np.mean(np.sort(label_similarities)[-k:]))
+        return scores
+
+    def classify(self, question: str):
+        """
+        Returns:
+            tuple: (best label, margin over the second best label)
+        """
+        return self.best_label(self.scores(question))
+
+    @staticmethod
+    def best_label(scores: dict):
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        margin = ranked[0][1] - ranked[1][1] if len(ranked) > 1 else 1.0
+        return ranked[0][0], margin
+
+    def route(self, question: str):
+        """
+        Returns:
+            str | None: The label, or None when the router is not confident enough
+        """
+        label, margin = self.classify(question)
+        if margin < self.min_margin:
+            print(f"\n Local router not confident ({label}, margin {margin:.3f}), using LLM router")
+            return None
+        print(f"\n Local router: {label} (margin {margin:.3f})")
+        return label
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def load_router_examples(path: str = LOCAL_ROUTER_EXAMPLES_PATH) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def local_first(router_name: str, llm_router, schema):
+    """
+    Try the local embedding router first and fall back to the LLM router below the margin.
+
+    Args:
+        router_name (str): Key of the router in the examples file
+        llm_router (Runnable): The LLM routing chain
+        schema (BaseModel): The pydantic class the LLM router returns, it must have a datasource field
+
+    Returns:
+        Runnable: The LLM router itself if the local router is disabled
+    """
+    if not LOCAL_ROUTER_ENABLED:
+        return llm_router
+
+    local_router = EmbeddingRouter(get_embeddings(),
+                                   load_router_examples()[router_name],
+                                   min_margin=LOCAL_ROUTER_MIN_MARGIN,
+                                   top_k=LOCAL_ROUTER_TOP_K)
+
+    def invoke(inputs, config):
+        label = local_router.route(inputs["question"])
+        if label is not None:
+            dispatch_custom_event("local_route", {"router": router_name, "label": label}, config=config)
+            return schema(datasource=label)
+        return llm_router.invoke(inputs, config)
+
+    async def ainvoke(inputs, config):
+        label = await asyncio.to_thread(local_router.route, inputs["question"])
+        if label is not None:
+            await adispatch_custom_event("local_route", {"router": router_name, "label": label}, config=config)
+            return schema(datasource=label)
+        return await llm_router.ainvoke(inputs, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=router_name)
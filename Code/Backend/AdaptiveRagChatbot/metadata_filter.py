@@ -0,0 +1,157 @@
+from typing import List, Optional
+
+from .entity_matcher import AhoCorasick, normalize_text
+from .lazy import singleton
+from .config import INGEST_MANIFEST_PATH, MULTI_SOURCE_ENABLED
+
+
+def matches_filter(metadata: dict, metadata_filter: Optional[dict]) -> bool:
+    """
+    Evaluate the subset of the Chroma filter syntax used by the retrievers on the metadata of a chunk.
+
+    Args:
+        metadata (dict): Metadata of the chunk
+        metadata_filter (dict): key -> value, or key -> {"$in": [values]}, all keys must match
+
+    Returns:
+        bool: True if the chunk passes the filter, always True without a filter
+    """
+    for key, condition in (metadata_filter or {}).items():
+        value = (metadata or {}).get(key)
+        if isinstance(condition, dict):
+            if value not in condition.get("$in", []):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+# the detector result is a hard filter, a name that may refer to another school is better left unmatched
+US_STATES = {
+    "alabama", "alaska", "arizona", "arkansas", "california", "colorado", "connecticut", "delaware", "florida",
+    "georgia", "hawaii", "idaho", "illinois", "indiana", "iowa", "kansas", "kentucky", "louisiana", "maine",
+    "maryland", "massachusetts", "michigan", "minnesota", "mississippi", "missouri", "montana", "nebraska",
+    "nevada", "new hampshire", "new jersey", "new mexico", "new york", "north carolina", "north dakota", "ohio",
+    "oklahoma", "oregon", "pennsylvania", "rhode island", "south carolina", "south dakota", "tennessee", "texas",
+    "utah", "vermont", "virginia", "washington", "west virginia", "wisconsin", "wyoming",
+}
+# aliases shared with other schools, "Cal" is also Cal State and Cal Poly
+AMBIGUOUS_ALIASES = {"cal"}
+# a name followed by one of these words is part of the name of another school, "Penn State", "Michigan Tech"
+OTHER_SCHOOL_WORDS = {"state", "tech", "poly", "polytechnic"}
+
+
+def ambiguous_alias(normalized: str) -> bool:
+    """
+    Returns:
+        bool: True for a state name, an abbreviation of two letters ("UT", "CU") or a known ambiguous alias
+    """
+    name = normalized.strip()
+    return name in US_STATES or name in AMBIGUOUS_ALIASES or len(name.replace(" ", "")) <= 2
+
+
+def university_filter(universities: List[str]) -> Optional[dict]:
+    if not universities:
+        return None
+    if len(universities) == 1:
+        return {"university": universities[0]}
+    return {"university": {"$in": list(universities)}}
+
+
+class UniversityDetector:
+    """
+    Find the universities named in a question, by name or alias, to restrict the search to their chunks.
+
+    Overlapping names are resolved leftmost-longest, so "UW-Madison" is the University of
+    Wisconsin-Madison and not "Wisconsin". Aliases that may name another school or a state,
+    or that several universities share, are not matched: "Penn State" is not the University
+    of Pennsylvania and "universities in Michigan" names no university.
+    """
+
+    def __init__(self, universities: dict):
+        """
+        Args:
+            universities (dict): University -> its aliases
+        """
+        # normalized name -> universities it may refer to, an alias can be shared
+        self.names = {}
+        for university, aliases in universities.items():
+            variants = [university]
+            if university.lower().startswith("the "):
+                variants.append(university[4:])
+            variants += [alias for alias in aliases if not ambiguous_alias(normalize_text(alias))]
+            for variant in variants:
+                normalized = normalize_text(variant)
+                if normalized.strip():
+                    self.names.setdefault(normalized, set()).add(university)
+        # an alias of several universities, eg. "CU" of Columbia and Cornell, names none of them
+        self.names = {name: found for name, found in self.names.items()
+                      if len(found) == 1 or any(name == normalize_text(university) for university in found)}
+        self.patterns = list(self.names)
+        self.automaton = AhoCorasick(self.patterns)
+
+    def detect(self, question: str) -> List[str]:
+        """
+        Returns:
+            list: Universities named in the question, sorted
+        """
+        text = normalize_text(question)
+        matches = sorted(self.automaton.find(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        universities, covered_until = set(), 0
+        for start, end, pattern_id in matches:
+            # the space that pads a name can be shared with the previous match
+            if start + 1 < covered_until:
+                continue
+            following = text[end:].split(maxsplit=1)
+            if following and following[0] in OTHER_SCHOOL_WORDS:
+                continue
+            universities |= self.names[self.patterns[pattern_id]]
+            covered_until = end
+        return sorted(universities)
+
+    def filter_for(self, question: str) -> Optional[dict]:
+        """
+        Returns:
+            dict | None: Metadata filter on the universities of the question, None if it names none
+        """
+        return university_filter(self.detect(question))
+
+
+def universities_from_manifest(manifest: dict) -> dict:
+    """
+    Returns:
+        dict: University -> aliases of every university that has chunks in the ingestion manifest
+    """
+    universities = {}
+    for chunk in manifest["chunks"].values():
+        metadata = chunk.get("metadata", {})
+        if metadata.get("university"):
+            aliases = [alias.strip() for alias in metadata.get("aliases", "").split(",") if alias.strip()]
+            universities.setdefault(metadata["university"], set()).update(aliases)
+    return universities
+
+
+def has_university_metadata(manifest_path: str) -> bool:
+    """
+    Returns:
+        bool: True if the chunks of the collection are tagged with their university, only those collections can be filtered
+    """
+    from .ingest import load_manifest
+
+    return bool(universities_from_manifest(load_manifest(manifest_path)))
+
+
+@singleton
+def get_university_detector():
+    from .ingest import load_manifest
+
+    paths = [INGEST_MANIFEST_PATH]
+    if MULTI_SOURCE_ENABLED:
+        from .multi_source import enabled_sources, manifest_path
+        paths += [manifest_path(name) for name in enabled_sources()]
+    universities = {}
+    for path in paths:
+        for university, aliases in universities_from_manifest(load_manifest(path)).items():
+            universities.setdefault(university, set()).update(aliases)
+    print(f"\nUniversity detector with {len(universities)} universities")
+    return UniversityDetector(universities)
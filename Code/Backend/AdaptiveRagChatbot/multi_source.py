@@ -0,0 +1,311 @@
+"""
+Index the curated datasets of Code/data into their own Chroma collections and search them
+along with top_uni_detailed.txt.
+
+Every dataset gets a collection, a manifest and the incremental update of the ingest command.
+A question is searched in all the collections in parallel and their rankings are merged with
+a weighted reciprocal rank fusion, the weight of a source says how much its hits are trusted.
+Run from the Backend directory to build or update the collections:
+
+    python -m AdaptiveRagChatbot.multi_source --dry-run
+    python -m AdaptiveRagChatbot.multi_source --source university_profiles
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from .lazy import singleton
+from .config import (MULTI_SOURCE_DATA_DIR, MULTI_SOURCE_WEIGHTS, MULTI_SOURCE_FETCH_K, RETRIEVER_K,
+                     HYBRID_RRF_K, CHUNK_SIZE, UNIVERSITY_CHUNK_OVERLAP, INGEST_MANIFEST_PATH)
+
+# name of the collection of top_uni_detailed.txt, the one the ingest command maintains
+GUIDE_SOURCE = "guide"
+
+# the texts of the datasets store their line breaks escaped
+ESCAPED_NEWLINE = re.compile(r"\\n")
+
+
+def unescape(text: Optional[str]) -> str:
+    return ESCAPED_NEWLINE.sub("\n", text or "").strip()
+
+
+def name_key(name: str) -> str:
+    # the ranking page urls drop the accents, punctuation and small words of the names,
+    # "University of Hawai’i at Mānoa" is "university-hawaii-manoa"
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    return "".join(t for t in re.findall(r"[a-z0-9]+", ascii_name) if t not in ("of", "the", "at", "and", "in"))
+
+
+def load_profiles(data_dir: str = MULTI_SOURCE_DATA_DIR) -> List[dict]:
+    with open(os.path.join(data_dir, "updated_university_data.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def profile_aliases(profile: dict) -> str:
+    """
+    Returns:
+        str: The aliases of a profile, comma separated like the ones of the university sections
+    """
+    # the field repeats the name and appends the aliases to it, eg. "California Institute of Technology caltech"
+    aliases = (profile.get("aliases") or "").strip()
+    if aliases.startswith(profile["name"]):
+        aliases = aliases[len(profile["name"]):].strip()
+    return aliases
+
+
+def profile_metadata(profile: dict) -> dict:
+    metadata = {"university": profile["name"], "location": profile.get("Location") or "",
+                "aliases": profile_aliases(profile)}
+    if profile.get("rank"):
+        # "2", "=14" or a band like "201-250", not the national rank of top_uni_detailed.txt
+        metadata["world_rank"] = profile["rank"]
+    return metadata
+
+
+def university_profile_records(data_dir: str = MULTI_SOURCE_DATA_DIR) -> List[tuple]:
+    """
+    Rankings, scores, student numbers, subjects and programs of each university.
+
+    updated_university_data.json has every record of uni_with_description.json plus the
+    programs, the older file is not indexed again.
+    """
+    records = []
+    for profile in load_profiles(data_dir):
+        lines = [profile["name"]]
+        if profile.get("rank"):
+            lines.append(f"World rank: {profile['rank']} (Times Higher Education)")
+        if profile.get("Location"):
+            lines.append(f"Location: {profile['Location']}")
+        if profile.get("uni_url"):
+            lines.append(f"Website: {profile['uni_url']}")
+        scores = [f"{label} score {profile[key]}" for key, label in
+                  (("scores_teaching", "teaching"), ("scores_research", "research"), ("scores_citations", "citations"))
+                  if profile.get(key) is not None]
+        if scores:
+            lines.append(f"Scores: {', '.join(scores)}")
+        if profile.get("stats_number_students"):
+            lines.append(f"Students: {profile['stats_number_students']}, "
+                         f"international students: {profile.get('stats_pc_intl_students') or 'unknown'}")
+        if profile.get("subjects_offered"):
+            lines.append(f"Subjects offered: {profile['subjects_offered']}")
+        if profile.get("programs"):
+            lines.append(f"Programs: {'; '.join(profile['programs'])}")
+        text = "\n".join(lines)
+        if profile.get("Description"):
+            text += f"\n\n{unescape(profile['Description'])}"
+        records.append((text, profile_metadata(profile)))
+    return records
+
+
+def university_info_records(data_dir: str = MULTI_SOURCE_DATA_DIR) -> List[tuple]:
+    """
+    Descriptions of the university ranking pages, the university is found from the page url.
+    """
+    profiles = {name_key(profile["name"]): profile for profile in load_profiles(data_dir)}
+    records = []
+    with open(os.path.join(data_dir, "university_info.csv"), "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            slug = re.sub(r"-\d+$", "", row["URL"].rstrip("/").rsplit("/", 1)[-1])
+            key = name_key(slug)
+            # some urls add the short name, "california-institute-technology-caltech"
+            profile = profiles.get(key) or next((p for k, p in profiles.items() if key.startswith(k)), None)
+            if profile is not None:
+                metadata = {**profile_metadata(profile), "location": row["Location"] or profile.get("Location") or ""}
+            else:
+                metadata = {"university": slug.replace("-", " ").title(), "location": row["Location"] or ""}
+            text = f"{metadata['university']}\nLocation: {metadata['location']}\n\n{unescape(row['Description'])}"
+            records.append((text, metadata))
+    return records
+
+
+def expanded_description_records(data_dir: str = MULTI_SOURCE_DATA_DIR) -> List[tuple]:
+    """
+    The long descriptions, expanded_descriptions.txt is the same text without the university of each one.
+    """
+    records = []
+    with open(os.path.join(data_dir, "universities_enriched_long_description.csv"), "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("Expanded Description", "").strip():
+                text = f"{row['name']}\n\n{unescape(row['Expanded Description'])}"
+                records.append((text, profile_metadata(row)))
+    return records
+
+
+# collection name -> (dataset file, its records)
+SOURCES = {
+    "university_profiles": ("updated_university_data.json", university_profile_records),
+    "university_info": ("university_info.csv", university_info_records),
+    "expanded_descriptions": ("universities_enriched_long_description.csv", expanded_description_records),
+}
+
+
+def manifest_path(name: str) -> str:
+    return os.path.join(os.path.dirname(INGEST_MANIFEST_PATH), f"ingest_manifest_{name}.json")
+
+
+def split_source(name: str, data_dir: str = MULTI_SOURCE_DATA_DIR) -> dict:
+    """
+    Returns:
+        dict: chunk id -> Document of the dataset of a collection
+    """
+    from .ingest import chunk_id
+    from .university_chunking import split_records
+
+    filename, records = SOURCES[name]
+    source = os.path.join(data_dir, filename)
+    chunks = {}
+    for document in split_records(records(data_dir), source, CHUNK_SIZE, UNIVERSITY_CHUNK_OVERLAP):
+        chunks.setdefault(chunk_id(source, document.page_content, document.metadata), document)
+    return chunks
+
+
+def ingest_source(name: str, vector_store, dry_run: bool = False) -> dict:
+    """
+    Bring the collection of a dataset up to date with it.
+
+    Returns:
+        dict: Number of chunks added, deleted and kept
+    """
+    from .ingest import update_store
+
+    chunks = split_source(name)
+    return update_store(vector_store, chunks, [os.path.join(MULTI_SOURCE_DATA_DIR, SOURCES[name][0])],
+                        manifest_path=manifest_path(name), dry_run=dry_run, collection_name=name)
+
+
+def open_collection(name: str):
+    from langchain_chroma import Chroma
+    from .retriever_setup import CHROMA_PERSIST_DIR, get_embeddings
+
+    return Chroma(collection_name=name, persist_directory=CHROMA_PERSIST_DIR, embedding_function=get_embeddings())
+
+
+def enabled_sources() -> List[str]:
+    # a source weighted 0 is not searched
+    return [name for name in SOURCES if MULTI_SOURCE_WEIGHTS.get(name, 0.0) > 0]
+
+
+@singleton
+def get_source_collections() -> dict:
+    """
+    Open the collection of every enabled dataset, a collection that was never built is left out
+    """
+    collections = {}
+    for name in enabled_sources():
+        if not os.path.exists(manifest_path(name)):
+            # embedding a dataset takes minutes, it is not done in the server
+            print(f"\nWARNING: collection {name} was never built, searching without it. "
+                  f"Run python -m AdaptiveRagChatbot.multi_source --source {name}")
+            continue
+        collections[name] = open_collection(name)
+    return collections
+
+
+# one thread per collection, shared by the concurrent requests
+fan_out_executor = ThreadPoolExecutor(max_workers=len(SOURCES) + 1, thread_name_prefix="multi_source")
+
+
+class MultiSourceRetriever(BaseRetriever):
+    """
+    Search several collections in parallel and merge their rankings with a weighted reciprocal rank fusion.
+
+    A chunk scores weight / (rrf_k + rank) in the ranking of its source, the same text found
+    in two sources adds up. When the question names universities every collection tagged with
+    universities is searched for their chunks only, and all of them unfiltered if none has any.
+    """
+
+    retrievers: Dict[str, Any]
+    weights: Dict[str, float]
+    university_detector: Any = None
+    # sources whose chunks have university metadata, the others are always searched unfiltered
+    filtered_sources: List[str] = []
+    embeddings: Any = None
+    k: int = 4
+    rrf_k: int = 60
+
+    def merge(self, rankings: Dict[str, List[Document]]) -> List[Document]:
+        scores, documents = {}, {}
+        for name, ranking in rankings.items():
+            for rank, document in enumerate(ranking, start=1):
+                key = document.page_content
+                documents.setdefault(key, Document(page_content=key, metadata={**document.metadata, "collection": name}))
+                scores[key] = scores.get(key, 0.0) + self.weights.get(name, 1.0) / (self.rrf_k + rank)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in ranked]
+
+    def source_filter(self, name: str, filter: Optional[dict]) -> Optional[dict]:
+        return filter if name in self.filtered_sources else None
+
+    def fan_out(self, query: str, filter: Optional[dict]) -> Dict[str, List[Document]]:
+        futures = {name: fan_out_executor.submit(retriever.search, query, self.source_filter(name, filter))
+                   for name, retriever in self.retrievers.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    async def afan_out(self, query: str, filter: Optional[dict]) -> Dict[str, List[Document]]:
+        rankings = await asyncio.gather(*(retriever.asearch(query, self.source_filter(name, filter))
+                                          for name, retriever in self.retrievers.items()))
+        return dict(zip(self.retrievers, rankings))
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.embeddings is not None:
+            # embedded once here, the collections all hit the query embedding cache instead of encoding it in parallel
+            self.embeddings.embed_query(query)
+        filter = self.university_detector.filter_for(query) if self.university_detector is not None else None
+        rankings = self.fan_out(query, filter)
+        if filter and not any(rankings[name] for name in self.filtered_sources if name in rankings):
+            rankings = self.fan_out(query, None)
+        return self.merge(rankings)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if self.embeddings is not None:
+            await self.embeddings.aembed_query(query)
+        filter = self.university_detector.filter_for(query) if self.university_detector is not None else None
+        rankings = await self.afan_out(query, filter)
+        if filter and not any(rankings[name] for name in self.filtered_sources if name in rankings):
+            rankings = await self.afan_out(query, None)
+        return self.merge(rankings)
+
+
+def build_multi_source_retriever(guide_retriever, university_detector=None, embeddings=None) -> MultiSourceRetriever:
+    """
+    Args:
+        guide_retriever (HybridRetriever): Retriever of top_uni_detailed.txt, searched with the dataset collections
+        university_detector (UniversityDetector): Restricts every collection to the universities of the question
+        embeddings (CachedQueryEmbeddings): Query embedding cache shared by the collections
+    """
+    from .hybrid_retriever import HybridRetriever
+    from .metadata_filter import has_university_metadata
+
+    retrievers = {GUIDE_SOURCE: guide_retriever}
+    manifests = {GUIDE_SOURCE: INGEST_MANIFEST_PATH, **{name: manifest_path(name) for name in enabled_sources()}}
+    for name, collection in get_source_collections().items():
+        # dense ranking only, the search is already narrowed to the universities of the question
+        retrievers[name] = HybridRetriever(vector_store=collection, k=MULTI_SOURCE_FETCH_K,
+                                           fetch_k=MULTI_SOURCE_FETCH_K, sparse_weight=0.0)
+    return MultiSourceRetriever(retrievers=retrievers,
+                                weights=MULTI_SOURCE_WEIGHTS,
+                                university_detector=university_detector,
+                                filtered_sources=[name for name in retrievers if has_university_metadata(manifests[name])],
+                                embeddings=embeddings,
+                                k=RETRIEVER_K,
+                                rrf_k=HYBRID_RRF_K)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the collections of the curated datasets.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--source", nargs="+", default=list(SOURCES), choices=list(SOURCES), help="Collections to update")
+    args = parser.parse_args()
+
+    for name in args.source:
+        ingest_source(name, open_collection(name), dry_run=args.dry_run)
@@ -1,17 +1,25 @@
-from langchain_community.tools.tavily_search import TavilySearchResults
 from pydantic import BaseModel
 from typing import List,Optional
-from langchain_core.prompts import ChatPromptTemplate
 
+import asyncio
 import json
 from bs4 import BeautifulSoup
 import requests
 
-from .llm_config import llm
+from .llm_config import get_llm
+from .chain_cache import cached_chain
+from .prompt_registry import get_prompt
+from .entity_matcher import local_first_keywords
+from .lazy import singleton
+from .config import UNIVERSITY_PROFESSORS_PATH
 
 
 ## Initialize web search tool for general searches
-web_search_tool = TavilySearchResults(k=3)
+@singleton
+def get_web_search_tool():
+    from langchain_community.tools.tavily_search import TavilySearchResults
+
+    return TavilySearchResults(k=3)
 
 ##Extracting keywords like professor name and university from query
 class ExtractKeywords(BaseModel):
@@ -21,24 +29,12 @@ class ExtractKeywords(BaseModel):
     professor_name: Optional[str] = None
     university: Optional[str] = None
 
-structured_extract_keywords = llm.with_structured_output(ExtractKeywords)
-
-#Grader Prompt
-system = system = """You are an expert in extracting structured information from text. \n
-Extract the following details strictly as defined: \n
-- **Professor Name**: Extract the full name with proper casing. Do not abbreviate. \n
-- **University**: Extract the full university name, avoiding abbreviations. If a location is mentioned, format it as "<University Name> - <Location>". \n
-Return only the extracted values without additional text or explanations."""
-
-
-extract_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-         ("human", "User question: {question}"),
-    ]
-)
 
-keywords_extractor = extract_prompt | structured_extract_keywords
+@singleton
+def get_keywords_extractor():
+    structured_extract_keywords = get_llm().with_structured_output(ExtractKeywords)
+    llm_extractor = cached_chain("keywords_extractor", get_prompt("keywords_extractor") | structured_extract_keywords, ExtractKeywords)
+    return local_first_keywords(llm_extractor, ExtractKeywords)
 
 
 
@@ -58,33 +54,14 @@ class ProfessorSearchResults(BaseModel):
     publications: Optional[List] = None
     website: Optional[str] = None
 
-structured_professor_search = llm.with_structured_output(ProfessorSearchResults)
-
-#Grader Prompt 
-system = """You are an expert at extracting information form the given extracted professors webpage. \n
-    You are to extract the following information: \n
-    - Name \n
-    - Title \n
-    - Department \n
-    - Email \n
-    - Phone \n
-    - Office \n
-    - Research Interests \n
-    - Bio \n
-    - Publications \n
-    """
-
-extract_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-       ("human", "Retrieved document: \n\n {document}"),
-    ]
-)
 
-professor_data_extractor = extract_prompt | structured_professor_search
+@singleton
+def get_professor_data_extractor():
+    structured_professor_search = get_llm().with_structured_output(ProfessorSearchResults)
+    return get_prompt("professor_data_extractor") | structured_professor_search
 
 def get_professors_website(professor_name: str, university: str):
-     with open("AdaptiveRagChatbot/university_professors.json", "r") as f:
+     with open(UNIVERSITY_PROFESSORS_PATH, "r") as f:
         data = json.load(f)
         
         # if university present
@@ -124,7 +101,7 @@ def professor_search_json(question: str):
         ProfessorSearchResults: The results of the search
     """
     print("\n Professor Search by extracting website from json")
-    resp =  keywords_extractor.invoke({"question": question})
+    resp =  get_keywords_extractor().invoke({"question": question})
     print(resp.professor_name, resp.university)
     professor_name = resp.professor_name
     university = resp.university
@@ -136,7 +113,7 @@ def professor_search_json(question: str):
             data = scrape_website_content(professors_website)
             print("\n SCRAPED DATA FROM WEBSITE : ",data)
             print(type(data))
-            formatted_data = professor_data_extractor.invoke({"document": data})
+            formatted_data = get_professor_data_extractor().invoke({"document": data})
             formatted_data_dict = formatted_data.model_dump()
             formatted_data_dict["website"] = professors_website  
             
@@ -146,5 +123,37 @@ def professor_search_json(question: str):
             
     
 
+    else:
+        return "not found"
+
+async def aprofessor_search_json(question: str):
+    """
+    Async version of professor_search_json, blocking file and website reads run in a thread.
+    
+    Args:
+        query (str): The query to search for professors
+    
+    Returns:
+        ProfessorSearchResults: The results of the search
+    """
+    print("\n Professor Search by extracting website from json")
+    resp = await get_keywords_extractor().ainvoke({"question": question})
+    print(resp.professor_name, resp.university)
+    professor_name = resp.professor_name
+    university = resp.university
+
+    if professor_name or university:
+        professors_website = await asyncio.to_thread(get_professors_website, professor_name, university)
+        print("\n WEBSITE : ",professors_website)
+        if professors_website:
+            data = await asyncio.to_thread(scrape_website_content, professors_website)
+            formatted_data = await get_professor_data_extractor().ainvoke({"document": data})
+            formatted_data_dict = formatted_data.model_dump()
+            formatted_data_dict["website"] = professors_website
+
+            final_result = ProfessorSearchResults(**formatted_data_dict)
+            print(final_result)
+            return final_result
+
     else:
         return "not found"
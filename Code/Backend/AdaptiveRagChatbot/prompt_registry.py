@@ -0,0 +1,78 @@
+import hashlib
+import json
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from .lazy import singleton
+from .config import PROMPTS_PATH, PROMPTS_OVERRIDE_PATH
+
+
+class PromptRegistry:
+    """
+    Versioned chat prompt templates of the chatbot and the SOP reviewer.
+
+    Every template of the bundle is compiled once when the registry is created, so a
+    broken template fails the warm up instead of the first request that uses it.
+    """
+
+    def __init__(self, bundle: dict):
+        self.prompts = {}
+        self.versions = {}
+        self.fingerprints = {}
+        for name, entry in bundle.items():
+            messages = [tuple(message) for message in entry["messages"]]
+            self.prompts[name] = ChatPromptTemplate.from_messages(messages)
+            self.versions[name] = str(entry.get("version", "unversioned"))
+            # changes whenever the text changes, even if the version was not bumped
+            digest = hashlib.sha256(json.dumps(entry["messages"]).encode("utf-8")).hexdigest()[:12]
+            self.fingerprints[name] = f"{self.versions[name]}:{digest}"
+
+    def get(self, name: str) -> ChatPromptTemplate:
+        """
+        Args:
+            name (str): Name of the prompt in the bundle, eg. "retrieval_grader"
+
+        Returns:
+            ChatPromptTemplate: The compiled template
+        """
+        if name not in self.prompts:
+            raise KeyError(f"Prompt {name!r} is not in the prompt bundle")
+        return self.prompts[name]
+
+    def fingerprint(self, name: str):
+        """
+        Returns:
+            str | None: Version and content hash of the prompt, None if there is no such prompt
+        """
+        return self.fingerprints.get(name)
+
+
+def load_prompt_bundle(path: str = PROMPTS_PATH, override_path: str = PROMPTS_OVERRIDE_PATH) -> dict:
+    """
+    Load the vendored prompt bundle, prompts of the override file replace the ones with the same name.
+
+    Args:
+        path (str): The bundle shipped with the package
+        override_path (str): Optional json file with the same format
+
+    Returns:
+        dict: name -> {"version": str, "messages": [[role, template], ...]}
+    """
+    with open(path, "r") as f:
+        bundle = json.load(f)
+
+    if override_path:
+        with open(override_path, "r") as f:
+            overrides = json.load(f)
+        bundle.update(overrides)
+        print(f"\n Prompts overridden from {override_path}: {', '.join(overrides)}")
+    return bundle
+
+
+@singleton
+def get_prompt_registry():
+    return PromptRegistry(load_prompt_bundle())
+
+
+def get_prompt(name: str) -> ChatPromptTemplate:
+    return get_prompt_registry().get(name)
@@ -0,0 +1,129 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(text: str) -> str:
+    """
+    Key of a query, queries differing only in case, unicode form or spacing share it.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    LRU cache of query embeddings in front of an embedding model.
+
+    Only queries are cached, documents are embedded once per index build. The cache is
+    bounded by both the number of entries and their size in bytes, the least recently
+    used entries are evicted first. On a miss the query is embedded as given, the first
+    spelling of a normalized query is the one whose embedding is shared.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int, max_bytes: int):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # normalized query -> float32 embedding
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # model_name and the other attributes of the wrapped model. Before __init__ ran, eg. while
+        # copy or pickle restore the instance, there is none and the attribute is missing
+        embeddings = self.__dict__.get("embeddings")
+        if embeddings is None:
+            raise AttributeError(name)
+        return getattr(embeddings, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, eg. the rewrites of a question, with one batch for all the misses.
+
+        Args:
+            texts (list): The queries
+
+        Returns:
+            list: Embedding of each query, in the same order
+        """
+        keys = [normalize_query(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+
+        missing = {}
+        for text, key, vector in zip(texts, keys, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            if len(missing) == 1:
+                computed = [self.embeddings.embed_query(next(iter(missing.values())))]
+            else:
+                # the models used here encode queries and documents the same way
+                computed = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, (np.asarray(vector, dtype=np.float32) for vector in computed)))
+            for key, vector in computed.items():
+                self._put(key, vector)
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+
+        return [vector.tolist() for vector in vectors]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _get(self, key: str):
+        with self._lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return vector
+
+    def _put(self, key: str, vector: np.ndarray):
+        size = self._size(key, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= self._size(key, self.entries.pop(key))
+            self.entries[key] = vector
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                old_key, old_vector = self.entries.popitem(last=False)
+                self.bytes -= self._size(old_key, old_vector)
+                self.evictions += 1
+
+    @staticmethod
+    def _size(key: str, vector: np.ndarray) -> int:
+        return vector.nbytes + len(key.encode("utf-8"))
@@ -1,7 +1,9 @@
 from typing import Literal
-from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from .llm_config import llm
+from .llm_config import get_llm
+from .chain_cache import cached_chain
+from .prompt_registry import get_prompt
+from .lazy import singleton
 ## Query rewriter
 class RewriteQuery(BaseModel):
     """Rewrite a user query to a more specific question."""
@@ -9,20 +11,11 @@ class RewriteQuery(BaseModel):
         ..., description="Rewritten query"
     )
     
-structured_llm_query_rewriter = llm.with_structured_output(RewriteQuery)
-system = """You a question re-writer that converts an input question to a better version that is optimized \n 
-     for vectorstore retrieval. Look at the input and try to reason about the underlying semantic intent / meaning."""
-re_write_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system),
-        (
-            "human",
-            "Here is the initial question: \n\n {question} \n Formulate an improved question.",
-        ),
-    ]
-)
 
-question_rewriter = re_write_prompt | structured_llm_query_rewriter
+@singleton
+def get_question_rewriter():
+    structured_llm_query_rewriter = get_llm().with_structured_output(RewriteQuery)
+    return cached_chain("question_rewriter", get_prompt("question_rewriter") | structured_llm_query_rewriter, RewriteQuery)
 
 
 
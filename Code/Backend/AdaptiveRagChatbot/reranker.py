@@ -0,0 +1,54 @@
+from typing import List
+
+from langchain.schema import Document
+
+from .graders import GradeDocument
+from .lazy import singleton
+from .config import RERANKER_MODEL, RERANKER_THRESHOLD, RERANKER_MAX_LENGTH
+
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder that scores (question, document) pairs, an alternative to the LLM retrieval grader.
+
+    All the retrieved documents of a question are scored in a single batch, documents
+    scoring at least the threshold are relevant.
+    """
+
+    def __init__(self, model_name: str, threshold: float, max_length: int):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.threshold = threshold
+
+    def scores(self, question: str, documents: List[Document]) -> List[float]:
+        """
+        Returns:
+            list: Score of each document, in the same order as the documents
+        """
+        if not documents:
+            return []
+        pairs = [(question, d.page_content) for d in documents]
+        # one forward pass over every pair
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def rerank(self, question: str, documents: List[Document]):
+        """
+        Sort the documents by score and grade them against the threshold.
+
+        Args:
+            question (str): The user question
+            documents (list): Retrieved documents
+
+        Returns:
+            tuple: (documents sorted by decreasing score, GradeDocument of each in the same order)
+        """
+        ranked = sorted(zip(documents, self.scores(question, documents)), key=lambda item: item[1], reverse=True)
+        grades = [GradeDocument(binary_score="yes" if score >= self.threshold else "no") for _, score in ranked]
+        return [document for document, _ in ranked], grades
+
+
+@singleton
+def get_reranker():
+    return CrossEncoderReranker(RERANKER_MODEL, threshold=RERANKER_THRESHOLD, max_length=RERANKER_MAX_LENGTH)
@@ -1,11 +1,12 @@
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 
-# Initialize the embedding model
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+from .lazy import singleton
+from .config import (RETRIEVER_MODE, RETRIEVER_K, HYBRID_FETCH_K, HYBRID_DENSE_WEIGHT,
+                     HYBRID_SPARSE_WEIGHT, HYBRID_RRF_K, BM25_INDEX_PATH, UNIVERSITY_FILTER_ENABLED, EMBEDDING_MODEL,
+                     VECTOR_BACKEND, FLAT_INDEX_DIR, FLAT_INDEX_DTYPE, HNSW_INDEX_DIR, HNSW_EF_SEARCH,
+                     QUERY_EMBEDDING_CACHE_ENABLED, QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+                     QUERY_EMBEDDING_CACHE_MAX_BYTES, MULTI_SOURCE_ENABLED, MULTI_SOURCE_FETCH_K,
+                     CHUNKING_MODE, INGEST_MANIFEST_PATH)
 
 # loader = TextLoader("top_uni_detailed.txt")
 # docs = loader.load()
@@ -17,17 +18,143 @@ embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-b
 # print("\nNew vector store created")
 
 CHROMA_PERSIST_DIR = "AdaptiveRagChatbot/chroma_db"
+# collection of top_uni_detailed.txt, the default of langchain_chroma that the existing db was built with
+CHROMA_COLLECTION = "langchain"
 
-# Load or create vector store
-if os.path.exists(CHROMA_PERSIST_DIR):
-    vector_store = Chroma(persist_directory=CHROMA_PERSIST_DIR, embedding_function=embeddings)
-    print("\nChroma db loaded from memory")
-else:
-    loader = TextLoader("AdaptiveRagChatbot/top_uni_detailed.txt")
-    docs = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300)
-    all_splits = text_splitter.split_documents(docs)
-    vector_store = Chroma.from_documents(all_splits, embeddings, persist_directory=CHROMA_PERSIST_DIR)
-    print("\nNew vector store created")
-
-retriever = vector_store.as_retriever()
\ No newline at end of file
+
+@singleton
+def get_embeddings():
+    """
+    Initialize the embedding model, loading it takes a few seconds so it is done once per process.
+    Query embeddings go through an LRU cache, so a question embedded by the semantic cache is not encoded again to retrieve.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    if not QUERY_EMBEDDING_CACHE_ENABLED:
+        return embeddings
+
+    from .query_embedding_cache import CachedQueryEmbeddings
+
+    return CachedQueryEmbeddings(embeddings,
+                                 max_entries=QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+                                 max_bytes=QUERY_EMBEDDING_CACHE_MAX_BYTES)
+
+
+def open_vector_store():
+    """
+    Open the persisted vector store, empty if it was never built
+    """
+    from langchain_chroma import Chroma
+
+    return Chroma(collection_name=CHROMA_COLLECTION, persist_directory=CHROMA_PERSIST_DIR, embedding_function=get_embeddings())
+
+
+@singleton
+def get_chroma_store():
+    """
+    Load or create vector store, later changes of the sources are applied with the ingest command
+    """
+    if os.path.exists(CHROMA_PERSIST_DIR):
+        from .ingest import load_manifest
+
+        vector_store = open_vector_store()
+        print("\nChroma db loaded from memory")
+        chunking = load_manifest().get("chunking")
+        if chunking != CHUNKING_MODE:
+            # re-embedding the whole store takes minutes, it is left to the operator. Chunks without
+            # university metadata are searched unfiltered until then
+            print(f"\nWARNING: Chroma db chunked with {chunking or 'recursive'} chunking instead of {CHUNKING_MODE}, "
+                  f"using it as is. Run python -m AdaptiveRagChatbot.ingest to re-chunk it")
+    else:
+        from .ingest import ingest
+
+        vector_store = open_vector_store()
+        ingest(vector_store)
+        print("\nNew vector store created")
+    return vector_store
+
+
+@singleton
+def get_vector_store():
+    """
+    Vector store of the configured backend, the flat and HNSW indexes are built from Chroma the first time
+    """
+    if VECTOR_BACKEND == "chroma":
+        return get_chroma_store()
+    if VECTOR_BACKEND == "flat":
+        from .flat_index import FlatIndex
+
+        if not os.path.exists(FLAT_INDEX_DIR):
+            FlatIndex.export(get_chroma_store(), FLAT_INDEX_DIR, dtype=FLAT_INDEX_DTYPE)
+        vector_store = FlatIndex(FLAT_INDEX_DIR, get_embeddings())
+        print(f"\nFlat index loaded from memory ({len(vector_store)} chunks, {vector_store.dtype})")
+        return vector_store
+    if VECTOR_BACKEND == "hnsw":
+        from .hnsw_index import HnswIndex, sync_hnsw_index
+
+        if not os.path.exists(HNSW_INDEX_DIR):
+            sync_hnsw_index(get_chroma_store())
+        vector_store = HnswIndex.load(HNSW_INDEX_DIR, get_embeddings(), ef_search=HNSW_EF_SEARCH)
+        print(f"\nHNSW index loaded from memory ({len(vector_store)} chunks)")
+        return vector_store
+    raise ValueError(f"Unknown VECTOR_BACKEND {VECTOR_BACKEND!r}")
+
+
+@singleton
+def get_bm25_index():
+    """
+    Load the BM25 index, a vector store persisted without one gets it from its stored chunks
+    """
+    from .hybrid_retriever import BM25Index
+
+    if os.path.exists(BM25_INDEX_PATH):
+        bm25_index = BM25Index.load(BM25_INDEX_PATH)
+        print("\nBM25 index loaded from memory")
+    else:
+        stored = get_chroma_store().get(include=["documents", "metadatas"])
+        bm25_index = BM25Index(stored["documents"], [m or {} for m in stored["metadatas"]])
+        bm25_index.save(BM25_INDEX_PATH)
+        print("\nBM25 index created from the vector store")
+    return bm25_index
+
+
+def guide_retriever(university_detector=None, k: int = RETRIEVER_K):
+    """
+    Retriever of top_uni_detailed.txt over the configured vector backend
+    """
+    from .hybrid_retriever import HybridRetriever
+
+    if RETRIEVER_MODE != "hybrid":
+        # dense ranking only, the retriever is just the university filter around the vector store
+        return HybridRetriever(vector_store=get_vector_store(), university_detector=university_detector,
+                               k=k, fetch_k=k, sparse_weight=0.0)
+
+    return HybridRetriever(vector_store=get_vector_store(),
+                           bm25_index=get_bm25_index(),
+                           university_detector=university_detector,
+                           k=k,
+                           fetch_k=HYBRID_FETCH_K,
+                           dense_weight=HYBRID_DENSE_WEIGHT,
+                           sparse_weight=HYBRID_SPARSE_WEIGHT,
+                           rrf_k=HYBRID_RRF_K)
+
+
+@singleton
+def get_retriever():
+    from .metadata_filter import get_university_detector, has_university_metadata
+
+    if MULTI_SOURCE_ENABLED:
+        from .multi_source import build_multi_source_retriever, get_source_collections
+
+        # built before the detector, which also learns the universities of the datasets from their manifests
+        get_source_collections()
+        return build_multi_source_retriever(guide_retriever(k=MULTI_SOURCE_FETCH_K),
+                                            university_detector=get_university_detector() if UNIVERSITY_FILTER_ENABLED else None,
+                                            embeddings=get_embeddings() if QUERY_EMBEDDING_CACHE_ENABLED else None)
+
+    # a filter on a collection without university metadata would match nothing
+    filtered = UNIVERSITY_FILTER_ENABLED and has_university_metadata(INGEST_MANIFEST_PATH)
+    if RETRIEVER_MODE != "hybrid" and not filtered:
+        return get_vector_store().as_retriever(search_kwargs={"k": RETRIEVER_K})
+    return guide_retriever(get_university_detector() if filtered else None)
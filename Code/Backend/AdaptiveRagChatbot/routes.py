@@ -1,7 +1,10 @@
 from typing import Literal
-from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from .llm_config import llm
+from .llm_config import get_llm
+from .chain_cache import cached_chain
+from .prompt_registry import get_prompt
+from .local_router import local_first
+from .lazy import singleton
 #data model to return the route
 class RouteQuery(BaseModel):
     """Route a user query to the most relevant datasource"""
@@ -9,23 +12,16 @@ class RouteQuery(BaseModel):
         ..., description="Given a user query choose to route it to the vectorstore or professor search or general query route"
     )
 
-structured_llm_router = llm.with_structured_output(RouteQuery)
 
-## Prompt to handle routing
-system = """You are an expert at routing a user question to a vectorstore or professor search or general query routes.
-Vectorstore contains only the documents related to universities in United States but not about the professors, use it for university queries.
-. For queries related to professors or faculty use professor search.
-Otherwise, use the general query route."""
 
-route_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-        ("human","{question}")
-    ]
-)
+@singleton
+def get_llm_question_router():
+    structured_llm_router = get_llm().with_structured_output(RouteQuery)
+    return cached_chain("question_router", get_prompt("question_router") | structured_llm_router, RouteQuery)
 
-
-question_router = route_prompt | structured_llm_router
+@singleton
+def get_question_router():
+    return local_first("question_router", get_llm_question_router(), RouteQuery)
 
 
 class ProfessorSearchRoutes(BaseModel):
@@ -35,19 +31,16 @@ class ProfessorSearchRoutes(BaseModel):
         ..., description="Given a user query choose to route it to the existing json data or web search"
     )
 
-#prompt
-system = """You are an expert at routing a user question to a json data or web search.
-The Json data contains Universities and their professor's name and urls, use it for queries when university name or professor name is mentioned.
-. Otherwise for general query related to professors use web search."""
 
-professor_search_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-        ("human","{question}")
-    ]
-)
+@singleton
+def get_llm_professor_search_router():
+    return cached_chain("professor_search_router",
+                        get_prompt("professor_search_router") | get_llm().with_structured_output(ProfessorSearchRoutes),
+                        ProfessorSearchRoutes)
 
-professor_search_router = professor_search_prompt | llm.with_structured_output(ProfessorSearchRoutes)
+@singleton
+def get_professor_search_router():
+    return local_first("professor_search_router", get_llm_professor_search_router(), ProfessorSearchRoutes)
 
 
 
@@ -58,17 +51,9 @@ class JsonResultRoutes(BaseModel):
         ..., description="Given the document retrieved from json data, choose to route it to web search or format search results"
     )
 
-#prompt
-system = """You are an expert at routing a user question to web search or format search result route.
-Routing should be done by checking if the data in document is able to answer users question or not.
-If the document give has data like none or not found and is unable to answer the users question, use web search to find the relevant data.
-Otherwise, use the format search results to extract the relevant information"""
-
-json_route_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-        ("human","User question is :: {question}, retrieved docs is :: {documents}")
-    ]
-)
 
-json_results_router = json_route_prompt | llm.with_structured_output(JsonResultRoutes)
\ No newline at end of file
+@singleton
+def get_json_results_router():
+    return cached_chain("json_results_router",
+                        get_prompt("json_results_router") | get_llm().with_structured_output(JsonResultRoutes),
+                        JsonResultRoutes)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .retriever_setup import get_embeddings
+from .lazy import singleton
+from .config import (SEMANTIC_CACHE_THRESHOLD,
+                     SEMANTIC_CACHE_TTL_SECONDS,
+                     SEMANTIC_CACHE_MAX_ENTRIES,
+                     SEMANTIC_CACHE_PATH,
+                     SEMANTIC_CACHE_SAVE_SECONDS)
+
+
+class SemanticCache:
+    """
+    Cache of chatbot answers keyed on the embedding of the question.
+
+    A question whose embedding has a cosine similarity above the threshold with a
+    cached question naming the same universities gets the cached answer. Questions that
+    only differ in the university embed above the threshold, "admission requirements at
+    Stanford" must not get the answer about Princeton. Entries expire after the ttl and the
+    least recently used entry is evicted once the cache is full. Changes are written to
+    disk by a timer save_seconds after the first one, never in the request that made them.
+    """
+
+    def __init__(self, embeddings, path, similarity_threshold, ttl_seconds, max_entries, save_seconds=30.0,
+                 detect_universities=None):
+        """
+        Args:
+            detect_universities (callable): question -> universities it names, None to match on the embedding only
+        """
+        self.embeddings = embeddings
+        self.detect_universities = detect_universities
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.save_seconds = save_seconds
+
+        # question -> {"embedding": np.ndarray, "universities": list, "response": dict, "created_at": float}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # one writer at a time, the entries lock is only held to take a snapshot
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        self.load()
+
+    def lookup(self, question: str):
+        """
+        Get the cached response of the most similar question.
+
+        Args:
+            question (str): The rewritten user question
+
+        Returns:
+            dict | None: The cached response or None on a miss
+        """
+        query_embedding = self._embed(question)
+        universities = self._universities(question)
+        with self._lock:
+            self._evict_expired()
+            best_question, best_score = None, -1.0
+            questions = [q for q, entry in self.entries.items() if entry["universities"] == universities]
+            if questions:
+                scores = np.stack([self.entries[q]["embedding"] for q in questions]) @ query_embedding
+                best = int(np.argmax(scores))
+                best_question, best_score = questions[best], float(scores[best])
+
+            if best_question is not None and best_score >= self.similarity_threshold:
+                self.hits += 1
+                self.entries.move_to_end(best_question)
+                print(f"\n Semantic cache hit ({best_score:.3f}): {best_question}")
+                return self.entries[best_question]["response"]
+
+            self.misses += 1
+            return None
+
+    def add(self, question: str, response: dict):
+        """
+        Cache the response of a question, it is persisted by the next scheduled save.
+
+        Args:
+            question (str): The rewritten user question
+            response (dict): The graph output to return for similar questions
+        """
+        entry = {"embedding": self._embed(question), "universities": self._universities(question),
+                 "response": response, "created_at": time.time()}
+        with self._lock:
+            self.entries[question] = entry
+            self.entries.move_to_end(question)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._dirty = True
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_seconds, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    async def alookup(self, question: str):
+        """
+        Async version of lookup, the question is embedded in a thread
+        """
+        return await asyncio.to_thread(self.lookup, question)
+
+    async def aadd(self, question: str, response: dict):
+        """
+        Async version of add, the question is embedded in a thread
+        """
+        await asyncio.to_thread(self.add, question, response)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self):
+        """
+        Write the cache to disk if it changed, embeddings as a matrix and the rest as json.
+        Called by the save timer and at shutdown.
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # entries are replaced and never modified, the snapshot stays valid outside the lock
+                snapshot = list(self.entries.items())
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            matrix = np.array([entry["embedding"] for _, entry in snapshot], dtype=np.float32)
+            meta = [{"question": q,
+                     "universities": entry["universities"],
+                     "response": entry["response"],
+                     "created_at": entry["created_at"]} for q, entry in snapshot]
+
+            tmp_path = self.path + ".tmp.npz"
+            np.savez(tmp_path, embeddings=matrix, meta=np.array(json.dumps(meta, default=str)))
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            meta = json.loads(str(data["meta"]))
+            for item, embedding in zip(meta, data["embeddings"]):
+                # entries saved before the universities were recorded never match
+                self.entries[item["question"]] = {"embedding": embedding,
+                                                  "universities": item.get("universities"),
+                                                  "response": item["response"],
+                                                  "created_at": item["created_at"]}
+            self._evict_expired()
+            print(f"\nSemantic cache loaded with {len(self.entries)} entries")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"\nCould not load semantic cache, starting empty: {e}")
+            self.entries.clear()
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [q for q, entry in self.entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for q in expired:
+            del self.entries[q]
+
+    def _universities(self, question: str) -> list:
+        return list(self.detect_universities(question)) if self.detect_universities is not None else []
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        # normalised so that the dot product is the cosine similarity
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+
+@singleton
+def get_semantic_cache():
+    from .metadata_filter import get_university_detector
+
+    return SemanticCache(get_embeddings(),
+                         path=SEMANTIC_CACHE_PATH,
+                         similarity_threshold=SEMANTIC_CACHE_THRESHOLD,
+                         ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+                         max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                         save_seconds=SEMANTIC_CACHE_SAVE_SECONDS,
+                         detect_universities=get_university_detector().detect)
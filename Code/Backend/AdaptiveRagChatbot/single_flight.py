@@ -0,0 +1,79 @@
+import asyncio
+import re
+from typing import Optional
+
+from .tracing import metrics
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent async calls with the same key into one execution.
+
+    The first caller of a key starts the execution as its own task and later callers
+    wait on that task, so a caller that goes away (eg. a client disconnect) does not
+    cancel the execution for the others. The key is forgotten once the task is done,
+    this is not a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    async def run(self, key: str, afunc):
+        """
+        Args:
+            key (str): Calls with the same key share one execution
+            afunc (Callable): Coroutine function to run if no call with the key is in flight
+
+        Returns:
+            tuple: (result, True if the result was shared from a call already in flight)
+        """
+        shared = self.join(key)
+        if shared is not None:
+            return await shared, True
+        return await self.start(key, afunc), False
+
+    def start(self, key: str, afunc) -> asyncio.Future:
+        """
+        Start the execution of a key that is not in flight, later calls of run and join share it.
+
+        Args:
+            key (str): Key of the execution, check with join that none is in flight
+            afunc (Callable): Coroutine function to run
+
+        Returns:
+            asyncio.Future: Awaitable result of the execution, cancelling it does not cancel the execution
+        """
+        task = asyncio.ensure_future(afunc())
+        self._flights[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        metrics.increment(f"single_flight.{self.name}.executions")
+        return asyncio.shield(task)
+
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        """
+        Share the execution already in flight for the key, without starting one.
+
+        Returns:
+            asyncio.Future | None: Awaitable result of the execution, None if there is none
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        metrics.increment(f"single_flight.{self.name}.shared")
+        # cancelling the waiter must not cancel the execution of the others
+        return asyncio.shield(flight)
+
+    def _forget(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # retrieve the exception so that a failure nobody waited for is not logged as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+
+def normalize_question(question: str) -> str:
+    """
+    Key of a question, questions differing only in case, spacing or trailing punctuation share it.
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
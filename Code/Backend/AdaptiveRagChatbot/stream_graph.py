@@ -0,0 +1,48 @@
+from .create_graph import chatbot
+from .graph_setup import FINAL_ANSWER_TAG
+
+
+async def astream_chatbot(inputs, config=None):
+    """
+    Run the chatbot graph and yield progress and answer tokens as they are produced.
+
+    Events yielded as (event, data) tuples:
+        node: a graph node started or finished, data has node and status
+        answer_start: a final answer generation started, tokens of any earlier attempt
+                      (eg. a generation graded as hallucination) should be discarded
+        token: a chunk of the final answer, data has node and token
+        done: the graph finished, data has question and generation
+
+    Args:
+        inputs (dict): The initial graph state
+        config (dict): Optional runnable config
+
+    Yields:
+        tuple: (event name, event data)
+    """
+    final_state = None
+    async for event in chatbot.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+        node = event.get("metadata", {}).get("langgraph_node")
+        parent_ids = event.get("parent_ids", [])
+
+        # the graph run itself has no parent, its output is the final state
+        if kind == "on_chain_end" and not parent_ids:
+            final_state = event["data"].get("output")
+
+        # node runs are the direct children of the graph run
+        elif kind in ("on_chain_start", "on_chain_end") and len(parent_ids) == 1 \
+                and node == event["name"] and not node.startswith("__"):
+            status = "start" if kind == "on_chain_start" else "end"
+            yield "node", {"node": node, "status": status}
+
+        elif kind == "on_chat_model_start" and FINAL_ANSWER_TAG in event.get("tags", []):
+            yield "answer_start", {"node": node}
+
+        elif kind == "on_chat_model_stream" and FINAL_ANSWER_TAG in event.get("tags", []):
+            token = event["data"]["chunk"].content
+            if token:
+                yield "token", {"node": node, "token": token}
+
+    final_state = final_state or {}
+    yield "done", {"question": final_state.get("question"), "generation": final_state.get("generation")}
@@ -0,0 +1,258 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger("AdaptiveRagChatbot.tracing")
+
+# node that the graph goes to for each route
+ROUTE_NODES = {
+    "retrieve": "vectorstore",
+    "professor_search": "professor_search",
+    "general_query": "general_query",
+}
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, percentiles are estimated from the bucket upper bounds.
+    """
+    BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, float("inf")]
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or self.BUCKETS
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.total += value
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q / 100 * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Metrics:
+    """
+    Process wide registry of the histograms, counters and gauges.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(value)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        return {
+            "histograms": {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+            "counters": dict(sorted(counters.items())),
+            "gauges": dict(sorted(gauges.items())),
+        }
+
+
+metrics = Metrics()
+
+
+class RequestTracer(BaseCallbackHandler):
+    """
+    Records the wall time of every graph node and LLM call of a request, the token counts,
+    cache hits and the route taken. The summary is logged as one json line by finish().
+
+    Pass it in the callbacks of the graph run config.
+    """
+
+    def __init__(self, request_id: str, session_id: Optional[str] = None):
+        self.request_id = request_id
+        self.session_id = session_id
+        self.started_at = time.perf_counter()
+        self.route = None
+        self.nodes = []
+        self.llm_calls = []
+        self.cache_hits = []
+
+        # run_id -> (name, parent_run_id, start time, is a graph node)
+        self._runs = {}
+        self._graph_run_id = None
+        self._lock = threading.Lock()
+
+    ## chains and graph nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        name = name or (serialized or {}).get("name", "")
+        with self._lock:
+            if parent_run_id is None and self._graph_run_id is None:
+                self._graph_run_id = run_id
+            # graph nodes are the direct children of the graph run
+            is_node = parent_run_id is not None and parent_run_id == self._graph_run_id \
+                and (metadata or {}).get("langgraph_node") == name
+            self._runs[run_id] = (name, parent_run_id, time.perf_counter(), is_node)
+            if is_node and self.route is None and name in ROUTE_NODES:
+                self.route = ROUTE_NODES[name]
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id, error=error)
+
+    def _end_chain(self, run_id, error=None):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or not run[3]:
+            return
+        name, _, start, _ = run
+        duration_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.nodes.append({"node": name, "ms": round(duration_ms, 1), "error": repr(error) if error else None})
+        metrics.observe(f"node.{name}.ms", duration_ms)
+
+    ## LLM calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def _start_llm(self, run_id, parent_run_id, metadata):
+        with self._lock:
+            self._runs[run_id] = (self._caller(parent_run_id, metadata), parent_run_id, time.perf_counter(), False)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        caller, _, start, _ = run
+        duration_ms = (time.perf_counter() - start) * 1000
+        input_tokens, output_tokens = token_usage(response)
+
+        with self._lock:
+            self.llm_calls.append({"caller": caller, "ms": round(duration_ms, 1),
+                                   "input_tokens": input_tokens, "output_tokens": output_tokens})
+        metrics.observe(f"llm.{caller}.ms", duration_ms)
+        metrics.increment(f"llm.{caller}.calls")
+        metrics.increment(f"llm.{caller}.input_tokens", input_tokens)
+        metrics.increment(f"llm.{caller}.output_tokens", output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            metrics.increment(f"llm.{run[0]}.errors")
+
+    def _caller(self, parent_run_id, metadata) -> str:
+        """
+        Name of the chain that made the LLM call, the closest named ancestor run, else the graph node.
+        """
+        while parent_run_id in self._runs:
+            name, parent_run_id, _, _ = self._runs[parent_run_id]
+            if name and not name.startswith(("Runnable", "Chat", "LangGraph")):
+                return name
+        return (metadata or {}).get("langgraph_node") or "unknown"
+
+    ## cache hits and local routes dispatched as custom events by the caches and routers
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == "cache_hit":
+            self.record_cache_hit(data.get("cache", "unknown"), data.get("key"))
+        elif name == "local_route":
+            metrics.increment(f"router.{data.get('router')}.local")
+
+    def record_cache_hit(self, cache: str, key: Optional[str] = None):
+        with self._lock:
+            self.cache_hits.append({"cache": cache, "key": key})
+        metrics.increment(f"cache.{cache}.hits")
+
+    def finish(self) -> dict:
+        """
+        Log the summary of the request and record its total latency.
+
+        Returns:
+            dict: The summary
+        """
+        total_ms = (time.perf_counter() - self.started_at) * 1000
+        # requests answered without running the graph are reported under the cache that answered them
+        route = self.route or next((h["cache"] for h in self.cache_hits
+                                    if h["cache"] in ("semantic_cache", "single_flight")), "unknown")
+        metrics.observe(f"request.{route}.ms", total_ms)
+        metrics.increment(f"request.{route}.count")
+
+        with self._lock:
+            summary = {
+                "event": "chatbot_request",
+                "request_id": self.request_id,
+                "session_id": self.session_id,
+                "route": route,
+                "total_ms": round(total_ms, 1),
+                "nodes": list(self.nodes),
+                "llm_calls": list(self.llm_calls),
+                "input_tokens": sum(call["input_tokens"] for call in self.llm_calls),
+                "output_tokens": sum(call["output_tokens"] for call in self.llm_calls),
+                "cache_hits": list(self.cache_hits),
+            }
+        logger.info(json.dumps(summary))
+        return summary
+
+
+def token_usage(response) -> tuple:
+    """
+    Get the input and output token counts of an LLMResult.
+
+    Returns:
+        tuple: (input tokens, output tokens), zeros if the provider did not report them
+    """
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+
+    if not (input_tokens or output_tokens) and response.llm_output:
+        usage = response.llm_output.get("token_usage") or response.llm_output.get("usage") or {}
+        input_tokens = usage.get("prompt_tokens", usage.get("input_tokens", 0))
+        output_tokens = usage.get("completion_tokens", usage.get("output_tokens", 0))
+    return input_tokens, output_tokens
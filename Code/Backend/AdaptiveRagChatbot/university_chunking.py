@@ -0,0 +1,154 @@
+import re
+from typing import List
+
+from langchain.schema import Document
+
+# a university section starts with its name, followed by its "Rank:" line
+RANK_LINE = re.compile(r"^Rank:\s*(?P<rank>\d+)?")
+FIELD_LINE = re.compile(r"^(?P<field>Location|Aliases):\s*(?P<value>.+?)\s*$")
+NAME_WITH_ALIAS = re.compile(r"^(?P<name>.+?)\s*\((?P<alias>[^)]+)\)\s*$")
+# the sections written as a single paragraph, "<name> (<alias>), located in <city, state, country>, ... the 2nd position"
+PROSE_SECTION = re.compile(r"^(?P<name>[^,(\n]+?)(?:\s*\((?P<alias>[^)]+)\))?, located in (?P<location>[^,]+, [A-Z]{2}, [^,]+),")
+PROSE_RANK = re.compile(r"holding the (?P<rank>\d+)(?:st|nd|rd|th) position")
+
+# lines after the name that are searched for the location and aliases
+HEADER_LINES = 8
+
+
+def university_metadata(name_line: str, header: List[str]) -> dict:
+    """
+    Args:
+        name_line (str): First line of the section, eg. "Carnegie Mellon University (CMU)"
+        header (list): The lines that follow it
+
+    Returns:
+        dict: university, location, rank and aliases (comma separated) of the section
+    """
+    name, aliases = name_line.strip(), []
+    match = NAME_WITH_ALIAS.match(name)
+    if match:
+        name, aliases = match["name"], [match["alias"]]
+
+    metadata = {"university": name}
+    for line in header[:HEADER_LINES]:
+        rank = RANK_LINE.match(line)
+        if rank and rank["rank"] and "rank" not in metadata:
+            metadata["rank"] = int(rank["rank"])
+        field = FIELD_LINE.match(line)
+        if field and field["field"] == "Location":
+            metadata["location"] = field["value"]
+        elif field and field["field"] == "Aliases":
+            aliases += [alias.strip() for alias in field["value"].split(",")]
+    # chroma metadata values are scalars
+    metadata["aliases"] = ", ".join(dict.fromkeys(alias for alias in aliases if alias))
+    return metadata
+
+
+def prose_metadata(paragraph: str):
+    """
+    Returns:
+        dict | None: Metadata of a section written as a paragraph, None if the paragraph is not one
+    """
+    match = PROSE_SECTION.match(paragraph)
+    if not match:
+        return None
+    metadata = {"university": match["name"].strip(), "location": match["location"].strip(),
+                "aliases": match["alias"] or ""}
+    rank = PROSE_RANK.search(paragraph)
+    if rank:
+        metadata["rank"] = int(rank["rank"])
+    return metadata
+
+
+def split_sections(text: str) -> List[tuple]:
+    """
+    Split a document into university sections.
+
+    Returns:
+        list: (start offset, section text, metadata) in order, metadata is empty for the text outside any section
+    """
+    lines = text.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+
+    starts = []
+    for i, line in enumerate(lines):
+        if RANK_LINE.match(line):
+            name_index = i - 1
+            while name_index >= 0 and not lines[name_index].strip():
+                name_index -= 1
+            if name_index >= 0:
+                starts.append(name_index)
+
+    sections = []
+    for n, start in enumerate(starts):
+        end = starts[n + 1] if n + 1 < len(starts) else len(lines)
+        metadata = university_metadata(lines[start], lines[start + 1:end])
+        sections.append((offsets[start], "".join(lines[start:end]), metadata))
+
+    # before the first structured section, paragraphs are either a prose section or the table of contents
+    preamble_end = offsets[starts[0]] if starts else len(text)
+    preamble = []
+    for match in re.finditer(r"\S(?:.|\n(?!\s*\n))*", text[:preamble_end]):
+        preamble.append((match.start(), match.group(), prose_metadata(match.group()) or {}))
+    return preamble + sections
+
+
+def split_by_university(text: str, source: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """
+    Chunk a document along its university sections, a chunk never mixes two universities.
+
+    Sections longer than chunk_size are split further and every piece after the first
+    starts with the university name, so that it still says what it is about.
+
+    Args:
+        text (str): Content of the source file
+        source (str): Path of the source file
+        chunk_size (int): Maximum characters of a chunk, before the name prefix
+        chunk_overlap (int): Overlap between the pieces of a section
+
+    Returns:
+        list: Chunks with source, start_index, end_index and the university metadata
+    """
+    return split_into_chunks(split_sections(text), source, chunk_size, chunk_overlap)
+
+
+def split_records(records: List[tuple], source: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """
+    Chunk the records of a structured dataset, one university per record.
+
+    The records are laid out one after the other, separated by a blank line, and the
+    offsets of the chunks are offsets in that text.
+
+    Args:
+        records (list): (text, metadata) of each record, metadata has at least the university
+        source (str): Path of the dataset
+
+    Returns:
+        list: Chunks with source, start_index, end_index and the metadata of their record
+    """
+    sections, offset = [], 0
+    for text, metadata in records:
+        sections.append((offset, text, metadata))
+        offset += len(text) + 2
+    return split_into_chunks(sections, source, chunk_size, chunk_overlap)
+
+
+def split_into_chunks(sections: List[tuple], source: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    chunks = []
+    for section_start, section, metadata in sections:
+        if not section.strip():
+            continue
+        for piece in text_splitter.create_documents([section]):
+            start = section_start + piece.metadata["start_index"]
+            content = piece.page_content
+            if metadata.get("university") and not content.startswith(metadata["university"]):
+                content = f"{metadata['university']}\n{content}"
+            chunks.append(Document(page_content=content,
+                                   metadata={**metadata, "source": source, "start_index": start,
+                                             "end_index": start + len(piece.page_content)}))
+    return chunks
@@ -0,0 +1,77 @@
+import time
+
+from .llm_config import get_llm
+from .llm_gateway import get_llm_gateway
+from .retriever_setup import get_embeddings, get_vector_store, get_bm25_index, get_retriever
+from .graders import (get_retrieval_grader, get_hallucination_grader, get_answer_grader,
+                      get_generation_graders_parallel, get_generation_grader)
+from .query_rewriter import get_question_rewriter
+from .routes import get_question_router, get_professor_search_router, get_json_results_router
+from .professor_web_search import get_web_search_tool, get_keywords_extractor, get_professor_data_extractor
+from .graph_setup import get_rag_chain
+from .prompt_registry import get_prompt_registry
+from .chain_cache import get_chain_cache
+from .semantic_cache import get_semantic_cache
+from .reranker import get_reranker
+from .entity_matcher import get_entity_matcher
+from .metadata_filter import get_university_detector
+from .multi_source import get_source_collections
+from .config import RELEVANCE_GRADER, RETRIEVER_MODE, UNIVERSITY_FILTER_ENABLED, MULTI_SOURCE_ENABLED
+
+# in build order, the embedding model first since the vector store, local routers and semantic cache need it
+COMPONENTS = {
+    "prompts": get_prompt_registry,
+    "llm_gateway": get_llm_gateway,
+    "llm": get_llm,
+    "embeddings": get_embeddings,
+    "vector_store": get_vector_store,
+    "retriever": get_retriever,
+    "chain_cache": get_chain_cache,
+    "semantic_cache": get_semantic_cache,
+    "question_router": get_question_router,
+    "professor_search_router": get_professor_search_router,
+    "json_results_router": get_json_results_router,
+    "retrieval_grader": get_retrieval_grader,
+    "hallucination_grader": get_hallucination_grader,
+    "answer_grader": get_answer_grader,
+    "generation_graders_parallel": get_generation_graders_parallel,
+    "generation_grader": get_generation_grader,
+    "question_rewriter": get_question_rewriter,
+    "entity_matcher": get_entity_matcher,
+    "keywords_extractor": get_keywords_extractor,
+    "professor_data_extractor": get_professor_data_extractor,
+    "web_search_tool": get_web_search_tool,
+    "rag_chain": get_rag_chain,
+}
+if RETRIEVER_MODE == "hybrid":
+    COMPONENTS["bm25_index"] = get_bm25_index
+if UNIVERSITY_FILTER_ENABLED:
+    COMPONENTS["university_detector"] = get_university_detector
+if MULTI_SOURCE_ENABLED:
+    COMPONENTS["source_collections"] = get_source_collections
+if RELEVANCE_GRADER == "reranker":
+    COMPONENTS["reranker"] = get_reranker
+
+
+def warm_up(extra_components: dict = None) -> dict:
+    """
+    Build every lazy singleton of the chatbot so that the first request does not pay for it.
+
+    Args:
+        extra_components (dict): More name -> getter pairs to build after the chatbot ones
+
+    Returns:
+        dict: name -> {"seconds": build time, "error": repr of the error or None}
+    """
+    report = {}
+    for name, getter in {**COMPONENTS, **(extra_components or {})}.items():
+        start = time.perf_counter()
+        error = None
+        try:
+            getter()
+        except Exception as e:
+            error = repr(e)
+        seconds = time.perf_counter() - start
+        report[name] = {"seconds": round(seconds, 3), "error": error}
+        print(f"\n Warm up {name}: {seconds * 1000:.0f} ms" + (f" FAILED {error}" if error else ""))
+    return report
@@ -1,64 +1,47 @@
 from .fileparser import parser
 
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
 import json
 
-llm = ChatGroq(model = "meta-llama/llama-4-scout-17b-16e-instruct", temperature=0)
+from AdaptiveRagChatbot.lazy import singleton
+from AdaptiveRagChatbot.prompt_registry import get_prompt
+from AdaptiveRagChatbot.llm_gateway import get_llm_gateway, PRIORITY_SOP_REVIEW
 
-system = """You are an expert in reviewing academic Statements of Purpose (SOPs). A student has written an SOP to apply for graduate studies. Your task is to critically review and analyze the SOP based on the following four aspects:
 
-1. **Grammar & Style**
-- Check for grammatical errors, sentence structure issues, and academic tone.
-- Highlight passive voice, repetition, or verbosity.
+@singleton
+def get_reviewer():
+    from langchain_groq import ChatGroq
 
-2. **Content Structure**
-- Evaluate if the SOP follows a logical structure: introduction, academic background, professional experience (if any), research interests, and conclusion.
-- Point out missing or disorganized sections.
+    # max_retries=0, rate limited calls are retried by the gateway
+    llm = ChatGroq(model = "meta-llama/llama-4-scout-17b-16e-instruct", temperature=0, max_retries=0)
+    # groq is only used by the SOP review, the chat calls go to google and are limited separately
+    llm = get_llm_gateway().wrap(llm, provider="groq", priority=PRIORITY_SOP_REVIEW)
+    return get_prompt("sop_reviewer") | llm
 
-3. **Clarity & Coherence**
-- Determine if the SOP is easy to follow, with smooth transitions and clear ideas.
-- Flag vague or ambiguous statements.
 
-4. **Strength of Research Interests**
-- Assess how clearly the student states their research goals and how well it aligns with their past experience.
-- Comment on whether the SOP mentions professors, labs, or specific projects at the target institution (if applicable).
-
----
-
-Return your feedback strictly in the following JSON format for easy parsing, no preamble:
-
-{{
-  "grammar_and_style": "<your feedback here>",
-  "structure": "<your feedback here>",
-  "clarity_and_coherence": "<your feedback here>",
-  "research_interests_strength": "<your feedback here>",
-  "overall_rating": "<Strong / Moderate / Needs Improvement>"
-}}
+def review_sop(sop_text):
+    """
+    Review the SOP text and return the feedback in JSON format.
+    """
+    res = get_reviewer().invoke(
+                {"sop_text": sop_text}
+            )
 
----
+    return parse_review(res.content)
 
-"""
 
-review_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",system),
-       ("human", "SOP to review :\n\n {sop_text}"),
-    ]
-)
+async def areview_sop(sop_text):
+    """
+    Async version of review_sop, does not block the event loop while the LLM responds.
+    """
+    res = await get_reviewer().ainvoke({"sop_text": sop_text})
 
-reviewer = review_prompt | llm
+    return parse_review(res.content)
 
 
-def review_sop(sop_text):
+def parse_review(output):
     """
-    Review the SOP text and return the feedback in JSON format.
+    Parse the JSON feedback of the reviewer.
     """
-    res = reviewer.invoke(
-                {"sop_text": sop_text}
-            )
-
-    output = res.content 
     output = output.strip("`").strip()
     output = output.replace("json", "",1)
 
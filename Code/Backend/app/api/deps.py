@@ -1,4 +1,4 @@
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
 from typing import Annotated
 
 from jose import jwt,JWTError
@@ -7,8 +7,10 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 # from jwt import InvalidTokenError
 from pydantic import ValidationError
-from app.db.session import engine
+from app.db.session import engine, AsyncSessionLocal
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import  User
 from app.schemas import Token,TokenPayload
@@ -30,22 +32,16 @@ def get_db() -> Generator[Session, None, None]:
     with Session(engine) as session:
         yield session
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as session:
+        yield session
+
 SessionDep = Annotated[Session, Depends(get_db)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 def get_current_user(token:TokenDep,db:SessionDep) -> User:
-    try:
-        print("\n TOKEN IN QUERY: ",token)
-        if token_expired(token):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token is expired.")
-
-        token_data = decode_token(token)
-        # print(token_data)
-    except(JWTError,ValidationError):
-        raise HTTPException(
-            status_code = status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
+    token_data = validate_token(token)
         
     # get takes the second parameter as the primary key
     # user = session.get(User, token_data.user_id)
@@ -59,3 +55,34 @@ def get_current_user(token:TokenDep,db:SessionDep) -> User:
             detail="User not found"
         )
     return user
+
+async def aget_current_user(token:TokenDep,db:AsyncSessionDep) -> User:
+    """
+    Async version of get_current_user for the endpoints using the async session
+    """
+    token_data = validate_token(token)
+
+    result = await db.execute(select(User).where(User.email == token_data['sub']))
+    user = result.scalars().first()
+
+    if not user:
+        raise HTTPException(
+            status_code = status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return user
+
+def validate_token(token: str) -> dict:
+    try:
+        print("\n TOKEN IN QUERY: ",token)
+        if token_expired(token):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token is expired.")
+
+        token_data = decode_token(token)
+        # print(token_data)
+    except(JWTError,ValidationError):
+        raise HTTPException(
+            status_code = status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+    return token_data
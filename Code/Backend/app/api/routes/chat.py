@@ -1,20 +1,37 @@
+import asyncio
+import json
+import uuid
 from AdaptiveRagChatbot.create_graph import chatbot
+from AdaptiveRagChatbot.stream_graph import astream_chatbot
+from AdaptiveRagChatbot.semantic_cache import get_semantic_cache
+from AdaptiveRagChatbot.config import SEMANTIC_CACHE_ENABLED, SINGLE_FLIGHT_ENABLED
+from AdaptiveRagChatbot.budget import GraphBudget
+from AdaptiveRagChatbot.tracing import RequestTracer
+from AdaptiveRagChatbot.llm_gateway import LLMGatewayBusy
+from AdaptiveRagChatbot.single_flight import SingleFlight, normalize_question
 from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from app.api.deps import get_db,TokenDep,get_current_user
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_async_db,TokenDep,aget_current_user
 from app.models import User, ChatHistory, ChatSession  # assuming your model file is models.py
 from app.schemas import QueryRequestSchema
-from app.utils import rewrite_query
+from app.db.session import AsyncSessionLocal
+from app.utils import arewrite_query
 
 
 router = APIRouter(tags=["chatbot"],prefix ="/api/v1")
+
+# graph runs in flight, keyed by the normalized rewritten question
+chatbot_flights = SingleFlight("chatbot")
  
 
 @router.post("/sessions", status_code=status.HTTP_201_CREATED)
 async def create_session(request: QueryRequestSchema,
-                    db: Session= Depends(get_db),                    
-                    current_user : User = Depends(get_current_user)):
+                    db: AsyncSession= Depends(get_async_db),                    
+                    current_user : User = Depends(aget_current_user)):
     """
     Create a new chat session for the user.
     """
@@ -22,8 +39,8 @@ async def create_session(request: QueryRequestSchema,
     new_session = ChatSession(user_id = current_user.user_id)
     try:
         db.add(new_session)
-        db.commit()
-        db.refresh(new_session)
+        await db.commit()
+        await db.refresh(new_session)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -33,19 +50,13 @@ async def create_session(request: QueryRequestSchema,
 @router.post("/sessions/{session_id}/messages" ,status_code=status.HTTP_200_OK)
 async def answer_query(session_id :str,
                        request: QueryRequestSchema,
-                       db: Session = Depends(get_db),
-                       current_user: User = Depends(get_current_user)): 
+                       db: AsyncSession = Depends(get_async_db),
+                       current_user: User = Depends(aget_current_user)): 
     """
     Answer user query using the adpative rag chatbot
     """
     try:
-        session = db.query(ChatSession).filter_by(session_id = session_id, user_id = current_user.user_id).first()
-
-        if not session:
-            raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Session not found or not authorized"
-        )
+        session = await get_user_session(db, session_id, current_user)
 
         # Create the user message object
         user_message = ChatHistory(session_id = session_id,
@@ -62,29 +73,24 @@ async def answer_query(session_id :str,
            
         print(f"Session ID: {session.session_id}, Title : {session.title}")
 
-        # retrieve last 5 chat messages for the session (this query is okay)
-        chat_history = (db.query(ChatHistory)
-                       .filter_by(session_id = session_id)
-                       .order_by(ChatHistory.created_at.desc())
-                       .limit(10) 
-                       .all()
-                       )
-
-        #joining to a single string to pass the context
-        chat_context = "\n".join(f"{msg.role.capitalize()}: {msg.content}" for msg in reversed(chat_history))
+        chat_context = await get_chat_context(db, session_id)
 
-        print("\nChat context is :: ", chat_context)
         #rewriting the query basedo on chat history context and current query
-        rewritten_query = rewrite_query(query = request.query, chat_context = chat_context)
+        rewritten_query = await arewrite_query(query = request.query, chat_context = chat_context)
         print("\n Rewritten Query: ", rewritten_query)
 
-        inputs = {
-            "question": rewritten_query
-        }
+        budget = GraphBudget()
+        tracer = RequestTracer(request_id = str(uuid.uuid4()), session_id = session_id)
 
-        ai_response = chatbot.invoke(inputs)
+        # a similar question answered earlier skips the graph entirely
+        ai_response = await get_semantic_cache().alookup(rewritten_query) if SEMANTIC_CACHE_ENABLED else None
+        if ai_response is not None:
+            tracer.record_cache_hit("semantic_cache")
+        else:
+            ai_response, budget = await run_chatbot(rewritten_query, budget, tracer)
 
         print(ai_response["question"],ai_response["generation"])
+        tracer.finish()
 
         # Create the AI message object
         ai_message = ChatHistory(
@@ -95,28 +101,220 @@ async def answer_query(session_id :str,
         # Add the AI message to the session
         db.add(ai_message)
 
-        db.commit()
+        await db.commit()
 
-        db.refresh(user_message)
-        db.refresh(ai_message)
+        await db.refresh(user_message)
+        await db.refresh(ai_message)
 
         return {"session_id": session_id,
-                "response": ai_response["generation"] }
-
+                "request_id": tracer.request_id,
+                "response": ai_response["generation"],
+                "budget": budget.as_dict() }
+
+    except LLMGatewayBusy as e:
+        # the LLM provider is overloaded, the client should retry later instead of getting a 500
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/sessions/{session_id}/messages/stream" ,status_code=status.HTTP_200_OK)
+async def stream_answer_query(session_id :str,
+                              request: QueryRequestSchema,
+                              db: AsyncSession = Depends(get_async_db),
+                              current_user: User = Depends(aget_current_user)):
+    """
+    Answer user query using the adaptive rag chatbot, streamed as Server-Sent Events.
+
+    Events: node (graph progress), answer_start, token (final answer chunks),
+    cache_hit (answer served from the semantic cache), coalesced (answer shared from an
+    identical question in flight), done (final answer) and error.
+    """
+    session = await get_user_session(db, session_id, current_user)
+
+    user_message = ChatHistory(session_id = session_id,
+                               role = "user",
+                               content = request.query)
+    db.add(user_message)
+
+    if not session.title and request.query:
+        session.title = request.query[:20] + "..."
+
+    chat_context = await get_chat_context(db, session_id)
+    await db.commit()
+
+    async def event_stream():
+        try:
+            yield sse_event("node", {"node": "rewrite_query", "status": "start"})
+            rewritten_query = await arewrite_query(query = request.query, chat_context = chat_context)
+            yield sse_event("node", {"node": "rewrite_query", "status": "end"})
+
+            generation = None
+            budget = GraphBudget()
+            tracer = RequestTracer(request_id = str(uuid.uuid4()), session_id = session_id)
+            cached = await get_semantic_cache().alookup(rewritten_query) if SEMANTIC_CACHE_ENABLED else None
+            # the same question already being answered is waited for instead of streaming a second run
+            flight = None
+            if cached is None and SINGLE_FLIGHT_ENABLED:
+                flight = chatbot_flights.join(normalize_question(rewritten_query))
+
+            if cached is not None:
+                tracer.record_cache_hit("semantic_cache")
+                generation = cached["generation"]
+                yield sse_event("cache_hit", {"question": cached["question"]})
+            elif flight is not None:
+                tracer.record_cache_hit("single_flight")
+                yield sse_event("coalesced", {"question": rewritten_query})
+                data, budget = await flight
+                generation = data["generation"]
+            else:
+                events = asyncio.Queue()
+                run = stream_chatbot(rewritten_query, budget, tracer, events)
+                # registered so that identical questions arriving meanwhile wait for this run
+                if SINGLE_FLIGHT_ENABLED:
+                    result = chatbot_flights.start(normalize_question(rewritten_query), run)
+                else:
+                    result = asyncio.ensure_future(run())
+                try:
+                    while (item := await events.get()) is not None:
+                        yield sse_event(*item)
+                    data, budget = await result
+                finally:
+                    # a shared run goes on for the requests waiting on it when this client goes away
+                    if not SINGLE_FLIGHT_ENABLED:
+                        result.cancel()
+                generation = data["generation"]
+
+            tracer.finish()
+            if generation is None:
+                yield sse_event("error", {"detail": "No answer was generated"})
+                return
+
+            # the request scoped session may already be closed once streaming starts
+            async with AsyncSessionLocal() as stream_db:
+                stream_db.add(ChatHistory(session_id = session_id,
+                                          role = "assistant",
+                                          content = generation))
+                await stream_db.commit()
+
+            yield sse_event("done", {"session_id": session_id,
+                                     "request_id": tracer.request_id,
+                                     "response": generation,
+                                     "budget": budget.as_dict()})
+
+        except LLMGatewayBusy as e:
+            yield sse_event("error", {"detail": str(e), "status": 503, "retry_after": e.retry_after})
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(event_stream(),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def get_user_session(db: AsyncSession, session_id: str, current_user: User) -> ChatSession:
+    """
+    Get the chat session of the user, raises 404 if it does not belong to the user.
+    """
+    result = await db.execute(select(ChatSession).filter_by(session_id = session_id, user_id = current_user.user_id))
+    session = result.scalars().first()
+
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or not authorized"
+        )
+    return session
+
+
+async def get_chat_context(db: AsyncSession, session_id: str) -> str:
+    """
+    Join the last 10 chat messages of the session to a single string to pass as context.
+    """
+    result = await db.execute(select(ChatHistory)
+                              .filter_by(session_id = session_id)
+                              .order_by(ChatHistory.created_at.desc())
+                              .limit(10)
+                              )
+    chat_history = result.scalars().all()
+
+    chat_context = "\n".join(f"{msg.role.capitalize()}: {msg.content}" for msg in reversed(chat_history))
+    print("\nChat context is :: ", chat_context)
+    return chat_context
+
+
+async def run_chatbot(question: str, budget: GraphBudget, tracer: RequestTracer):
+    """
+    Answer the question with the graph, concurrent requests for the same question share one run.
+
+    Returns:
+        tuple: (graph output, budget of the run that produced it)
+    """
+    async def run():
+        ai_response = await chatbot.ainvoke({"question": question, "budget": budget},
+                                            config=graph_config(budget, tracer))
+        # an answer cut short by the budget is not good enough to be reused
+        if SEMANTIC_CACHE_ENABLED and not budget.exhausted:
+            await get_semantic_cache().aadd(question, {"question": ai_response["question"],
+                                                       "generation": ai_response["generation"]})
+        return ai_response, budget
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return await run()
+
+    result, shared = await chatbot_flights.run(normalize_question(question), run)
+    if shared:
+        tracer.record_cache_hit("single_flight")
+    return result
+
+
+def stream_chatbot(question: str, budget: GraphBudget, tracer: RequestTracer, events: asyncio.Queue):
+    """
+    Coroutine function of a streamed graph run, it puts the (event, data) to send on the queue
+    and None once the run is over.
+
+    Returns:
+        Callable: Coroutine function returning (the done event data, budget of the run)
+    """
+    async def run():
+        try:
+            async for event, data in astream_chatbot({"question": question, "budget": budget},
+                                                     config=graph_config(budget, tracer)):
+                if event == "done":
+                    if SEMANTIC_CACHE_ENABLED and data["generation"] is not None and not budget.exhausted:
+                        await get_semantic_cache().aadd(question, data)
+                    return data, budget
+                events.put_nowait((event, data))
+            return {"question": question, "generation": None}, budget
+        finally:
+            events.put_nowait(None)
+    return run
+
+
+def graph_config(budget: GraphBudget, tracer: RequestTracer) -> dict:
+    """
+    Runnable config of a graph run, counts the LLM calls into the budget and traces the run.
+    """
+    return {"callbacks": [budget.callback, tracer],
+            "metadata": {"request_id": tracer.request_id, "session_id": tracer.session_id}}
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
 @router.get("/sessions/{session_id}", status_code=status.HTTP_200_OK)
 async def get_chat_history(session_id : str,
-                            db: Session= Depends(get_db),
-                           current_user: User = Depends(get_current_user),
+                            db: AsyncSession= Depends(get_async_db),
+                           current_user: User = Depends(aget_current_user),
                            ):
     """
     Fetches all chat history entries for a specific user and session.
     """
     # Verify session belongs to the user (security check)
-    session = db.query(ChatSession).filter_by(session_id=session_id, user_id=current_user.user_id).first()
+    result = await db.execute(select(ChatSession).filter_by(session_id=session_id, user_id=current_user.user_id))
+    session = result.scalars().first()
     if not session:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -125,12 +323,12 @@ async def get_chat_history(session_id : str,
 
     # Fetch chat messages in the session
     
-    chat_history = (
-        db.query(ChatHistory)
+    result = await db.execute(
+        select(ChatHistory)
         .filter_by(session_id=session_id)
         .order_by(ChatHistory.created_at)
-        .all()
     )
+    chat_history = result.scalars().all()
     
     if not chat_history:
         return []  ## hanlde this later
@@ -141,11 +339,12 @@ async def get_chat_history(session_id : str,
 
 
 @router.get("/sessions", status_code=status.HTTP_200_OK)
-async def get_all_sessions(db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+async def get_all_sessions(db: AsyncSession = Depends(get_async_db), current_user = Depends(aget_current_user)):
     """
     Fetch all chat sessions for the user.
     """
-    sessions = db.query(ChatSession).filter_by(user_id=current_user.user_id).all()
+    result = await db.execute(select(ChatSession).filter_by(user_id=current_user.user_id))
+    sessions = result.scalars().all()
     
     if not sessions:
         return []
@@ -157,16 +356,19 @@ async def get_all_sessions(db: Session = Depends(get_db), current_user = Depends
 @router.delete("/sessions/{session_id}", status_code=status.HTTP_200_OK)
 async def delete_session(
     session_id: str,
-    db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(aget_current_user)
 ):
     """
     Delete a user session.
     """
-    session = db.query(ChatSession).filter_by(
-        session_id=session_id,
-        user_id=current_user.user_id
-    ).first()
+    # chat_history is loaded up front, lazy loading it during delete is not allowed on an async session
+    result = await db.execute(
+        select(ChatSession)
+        .options(selectinload(ChatSession.chat_history))
+        .filter_by(session_id=session_id, user_id=current_user.user_id)
+    )
+    session = result.scalars().first()
 
     if not session:
         raise HTTPException(
@@ -175,11 +377,11 @@ async def delete_session(
         )
 
     try:
-        db.delete(session)
-        db.commit()
+        await db.delete(session)
+        await db.commit()
         return {"detail": "Session deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete session: {str(e)}"
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, status
+
+from AdaptiveRagChatbot.tracing import metrics
+from AdaptiveRagChatbot.semantic_cache import get_semantic_cache
+from AdaptiveRagChatbot.chain_cache import get_chain_cache
+from AdaptiveRagChatbot.llm_gateway import get_llm_gateway
+from AdaptiveRagChatbot.retriever_setup import get_embeddings
+from app.api.deps import aget_current_user
+from app.models import User
+
+router = APIRouter(tags=["metrics"],prefix ="/api/v1")
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK)
+async def get_metrics(current_user: User = Depends(aget_current_user)):
+    """
+    Latency histograms and counters of the chatbot graph nodes, LLM calls, LLM gateway queues and caches.
+    Caches that have not been built yet are reported as None instead of being built here.
+    """
+    return {
+        **metrics.snapshot(),
+        "semantic_cache": get_semantic_cache().stats() if get_semantic_cache.is_built() else None,
+        "chain_cache": get_chain_cache().stats() if get_chain_cache.is_built() else None,
+        "llm_gateway": get_llm_gateway().stats() if get_llm_gateway.is_built() else None,
+        "query_embeddings": get_embeddings().stats()
+        if get_embeddings.is_built() and hasattr(get_embeddings(), "stats") else None,
+    }
@@ -1,5 +1,6 @@
 from SOPReview.fileparser import parser
-from SOPReview.reviewer import review_sop
+from SOPReview.reviewer import areview_sop
+from AdaptiveRagChatbot.llm_gateway import LLMGatewayBusy
 from fastapi import APIRouter, UploadFile, File
 from fastapi.responses import JSONResponse
 from fastapi import HTTPException
@@ -29,9 +30,12 @@ async def sop_review_endpoint(
         sop_content = parser(content)
         # print(type(sop_content))
         # Review the SOP
-        review_result = review_sop(sop_content)
+        review_result = await areview_sop(sop_content)
 
         return JSONResponse(content={"review": review_result})
 
+    except LLMGatewayBusy as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -23,5 +23,8 @@ class Settings:
 
         self.PROJECT_NAME:str = "UniBro"
 
+        # build the LLM clients, embedding model and vector store in the background at startup
+        self.WARM_UP_ON_STARTUP: bool = self.env_vars.get("WARM_UP_ON_STARTUP", "True").lower() == "true"
+
 #instatiate the class
 settings = Settings()
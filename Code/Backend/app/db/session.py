@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv
 import os
 
@@ -10,3 +11,26 @@ DATABASE_URL =  os.getenv("DATABASE_URL")
 # resources
 engine = create_engine(DATABASE_URL)
 
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Swap the sync driver in the database url with its async driver.
+    """
+    drivers = {
+        "postgresql+psycopg2://": "postgresql+asyncpg://",
+        "postgresql://": "postgresql+asyncpg://",
+        "postgres://": "postgresql+asyncpg://",
+        "sqlite://": "sqlite+aiosqlite://",
+    }
+    for sync_prefix, async_prefix in drivers.items():
+        if database_url.startswith(sync_prefix):
+            return async_prefix + database_url[len(sync_prefix):]
+    return database_url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+# async engine used by the chat endpoints so that db calls do not block the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# expire_on_commit is off so the objects can still be read after commit without another query
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
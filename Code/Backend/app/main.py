@@ -1,22 +1,63 @@
+import logging
+import threading
 from fastapi import FastAPI
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from app.models import Base
 from app.db.session import engine
-from app.api.routes import auth, chat, sop_review
+from app.api.routes import auth, chat, sop_review, metrics
 from app.core.config import settings
+from AdaptiveRagChatbot.warm_up import warm_up
+from AdaptiveRagChatbot.chain_cache import get_chain_cache
+from AdaptiveRagChatbot.semantic_cache import get_semantic_cache
+from SOPReview.reviewer import get_reviewer
 # from app.api
 
 app = FastAPI(title=settings.PROJECT_NAME, version="1.0.0")
 
+# per request traces of the chatbot are logged as json lines
+logging.basicConfig(format="%(message)s")
+logging.getLogger("AdaptiveRagChatbot.tracing").setLevel(logging.INFO)
+
 #create tables
 Base.metadata.create_all(bind=engine)
 
+# the chatbot components are built on first use, warm up builds them in the background at startup
+readiness = {"ready": not settings.WARM_UP_ON_STARTUP, "components": {}}
+
+def run_warm_up():
+    report = warm_up({"sop_reviewer": get_reviewer})
+    readiness["components"] = report
+    readiness["ready"] = not any(component["error"] for component in report.values())
+
+@app.on_event("startup")
+def start_warm_up():
+    if settings.WARM_UP_ON_STARTUP:
+        threading.Thread(target=run_warm_up, name="warm_up", daemon=True).start()
+
+@app.on_event("shutdown")
+def flush_caches():
+    # the caches write part of their state lazily, not on every request
+    if get_chain_cache.is_built():
+        get_chain_cache().flush()
+    if get_semantic_cache.is_built():
+        get_semantic_cache().save()
+
 @app.get("/")
 def read_root():
     return{"message":"Welcome to Chatbot"}
 
+@app.get("/ready")
+def read_ready():
+    """
+    Readiness probe, 503 until the warm up has built every component without errors.
+    """
+    status_code = 200 if readiness["ready"] else 503
+    return JSONResponse(status_code=status_code, content=readiness)
+
 
 
 app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(sop_review.router)
+app.include_router(metrics.router)
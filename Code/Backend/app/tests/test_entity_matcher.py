@@ -0,0 +1,59 @@
+import pytest
+
+from AdaptiveRagChatbot.entity_matcher import AhoCorasick, EntityMatcher, normalize_text
+
+
+def found(patterns, text):
+    return sorted((start, end, patterns[pattern_id]) for start, end, pattern_id in AhoCorasick(patterns).find(text))
+
+
+def test_overlapping_patterns():
+    assert found(["abc", "bcd", "cde"], "abcde") == [(0, 3, "abc"), (1, 4, "bcd"), (2, 5, "cde")]
+
+
+def test_suffix_patterns_are_reported_through_the_failure_links():
+    assert found(["he", "she", "his", "hers"], "ushers") == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+
+def test_pattern_inside_another_pattern():
+    assert found(["a", "aa", "aaa"], "aaa") == [(0, 1, "a"), (0, 2, "aa"), (0, 3, "aaa"),
+                                                (1, 2, "a"), (1, 3, "aa"), (2, 3, "a")]
+
+
+def test_no_match_and_empty_text():
+    assert found(["abc"], "abd ab") == []
+    assert found(["abc"], "") == []
+
+
+def test_matches_agree_with_a_naive_search():
+    patterns = ["ab", "bab", "abab", "b", "ba"]
+    text = "abababbab"
+    naive = sorted((i, i + len(p), p) for p in patterns for i in range(len(text)) if text.startswith(p, i))
+    assert found(patterns, text) == naive
+
+
+def test_normalize_text_matches_whole_words_only():
+    assert normalize_text("Prof. José  O'Brien!") == " prof jose o brien "
+    assert found([normalize_text("MIT")], normalize_text("Is admission at MIT hard?")) == [(16, 21, " mit ")]
+    assert found([normalize_text("MIT")], normalize_text("Submit the form")) == []
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return EntityMatcher({
+        "Stanford University": [["Andrew Ng", "AI"], ["Fei-Fei Li", "Vision"]],
+        "Carnegie Mellon University": [["Andrew Ng", "ML"], ["Tom Mitchell", "ML"]],
+        "University of Washington": [["Plato", "Philosophy"]],
+    })
+
+
+def test_longest_match_wins(matcher):
+    assert matcher.extract("Does Fei-Fei Li teach at Stanford University?") == ("Fei-Fei Li", "Stanford University")
+
+
+def test_shared_professor_name_prefers_the_named_university(matcher):
+    assert matcher.extract("Research of Andrew Ng at Carnegie Mellon University") == ("Andrew Ng", "Carnegie Mellon University")
+
+
+def test_single_word_professor_names_are_left_to_the_llm(matcher):
+    assert matcher.extract("What does Plato teach?") == (None, None)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from AdaptiveRagChatbot.flat_index import normalize, quantize
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    return normalize(rng.standard_normal((200, 384)).astype(np.float32))
+
+
+def dequantize(quantized, scales):
+    return quantized.astype(np.float32) * scales[:, None]
+
+
+def test_int8_uses_the_full_range_without_overflow(vectors):
+    quantized, _ = quantize(vectors, "int8")
+    assert quantized.dtype == np.int8
+    assert quantized.min() >= -127 and quantized.max() <= 127
+    # the largest component of each row maps to +-127, never wraps around to -128
+    assert (np.abs(quantized.astype(np.int16)).max(axis=1) == 127).all()
+
+
+def test_int8_extreme_rows_clip_to_127():
+    rows = np.array([[1.0, 0.0, 0.0], [-1.0, 0.0, 0.0], [0.6, -0.8, 0.0]], dtype=np.float32)
+    quantized, scales = quantize(rows, "int8")
+    assert quantized.tolist() == [[127, 0, 0], [-127, 0, 0], [95, -127, 0]]
+    assert np.allclose(dequantize(quantized, scales), rows, atol=scales.max() / 2)
+
+
+def test_int8_zero_row():
+    quantized, scales = quantize(np.zeros((1, 4), dtype=np.float32), "int8")
+    assert quantized.tolist() == [[0, 0, 0, 0]]
+    assert scales.tolist() == [1.0]
+
+
+def test_int8_round_trip_error_is_half_a_step(vectors):
+    quantized, scales = quantize(vectors, "int8")
+    error = np.abs(dequantize(quantized, scales) - vectors)
+    assert (error <= scales[:, None] / 2 + 1e-7).all()
+    # the cosine similarities barely move
+    similarities = vectors @ vectors[0]
+    assert np.abs(dequantize(quantized, scales) @ vectors[0] - similarities).max() < 0.01
+
+
+def test_float16_round_trip(vectors):
+    quantized, scales = quantize(vectors, "float16")
+    assert quantized.dtype == np.float16
+    assert (scales == 1.0).all()
+    assert np.abs(quantized.astype(np.float32) - vectors).max() < 1e-3
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        quantize(np.ones((1, 2), dtype=np.float32), "int4")
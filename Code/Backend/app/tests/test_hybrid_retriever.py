@@ -0,0 +1,57 @@
+from langchain.schema import Document
+
+from AdaptiveRagChatbot.hybrid_retriever import BM25Index, HybridRetriever, tokenize
+
+
+def retriever(texts, **kwargs):
+    return HybridRetriever(vector_store=None, bm25_index=BM25Index(texts), **kwargs)
+
+
+def contents(documents):
+    return [document.page_content for document in documents]
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the GRE score at UC-Berkeley?") == ["gre", "score", "uc", "berkeley"]
+
+
+def test_bm25_ranks_rare_terms_higher():
+    index = BM25Index(["stanford computer science", "computer science", "computer engineering"])
+    ranking = index.search("stanford computer", k=3)
+    assert [chunk_id for chunk_id, _ in ranking] == [0, 1, 2]
+    assert ranking[0][1] > ranking[1][1] > 0
+
+
+def test_bm25_filter_and_unknown_terms():
+    index = BM25Index(["duke tuition", "duke housing"], [{"university": "Duke"}, {"university": "Yale"}])
+    assert [chunk_id for chunk_id, _ in index.search("duke", k=5, filter={"university": "Yale"})] == [1]
+    assert index.search("harvard", k=5) == []
+
+
+def test_document_in_both_rankings_beats_a_single_first_place():
+    # "b" is second in both rankings, 2 / (60 + 2) is more than 1 / (60 + 1)
+    fused = retriever(["c", "b"], k=3).fuse("b c", [Document("a"), Document("b")])
+    assert contents(fused)[0] == "b"
+
+
+def test_documents_in_only_one_ranking_are_kept():
+    fused = retriever(["bm25 only"], k=5).fuse("bm25 only", [Document("dense only")])
+    assert sorted(contents(fused)) == ["bm25 only", "dense only"]
+
+
+def test_ties_keep_the_dense_ranking_first():
+    # first in one ranking each, equal scores
+    fused = retriever(["sparse"], k=2).fuse("sparse", [Document("dense")])
+    assert contents(fused) == ["dense", "sparse"]
+
+
+def test_weights_break_ties_and_zero_weight_drops_a_ranking():
+    fused = retriever(["sparse"], k=2, sparse_weight=2.0).fuse("sparse", [Document("dense")])
+    assert contents(fused) == ["sparse", "dense"]
+    fused = retriever(["sparse"], k=2, sparse_weight=0.0).fuse("sparse", [Document("dense")])
+    assert contents(fused) == ["dense"]
+
+
+def test_fusion_returns_at_most_k_documents():
+    fused = retriever(["d", "e"], k=2).fuse("d e", [Document("a"), Document("b"), Document("c")])
+    assert len(fused) == 2
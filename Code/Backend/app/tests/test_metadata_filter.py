@@ -0,0 +1,59 @@
+import pytest
+
+from AdaptiveRagChatbot.metadata_filter import UniversityDetector, matches_filter, university_filter
+
+# the aliases of top_uni_detailed.txt
+UNIVERSITIES = {
+    "University of Pennsylvania": ["Penn", "UPenn"],
+    "Columbia University": ["Columbia", "CU"],
+    "Cornell University": ["Cornell", "CU"],
+    "University of Michigan-Ann Arbor": ["UMich", "U-M", "Michigan"],
+    "University of Washington": ["UW", "UDub"],
+    "Duke University": ["Duke", "DU"],
+    "Northwestern University": ["NU", "Northwestern"],
+    "Georgia Institute of Technology": ["Georgia Tech", "GT"],
+    "University of Illinois at Urbana-Champaign": ["UIUC", "Illinois"],
+    "University of Texas at Austin": ["UT Austin", "UT"],
+    "University of Wisconsin-Madison": ["UW-Madison", "Wisconsin"],
+    "University of California, Berkeley": ["UC Berkeley", "Cal"],
+}
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return UniversityDetector(UNIVERSITIES)
+
+
+@pytest.mark.parametrize("question", [
+    "What is the acceptance rate of Penn State?",
+    "Does UT Dallas offer a PhD in computer science?",
+    "Which universities in Michigan have a good CS program?",
+    "Best engineering universities in Illinois",
+    "Tuition of public universities in Wisconsin",
+    "Is CU good for computer science?",
+    "How is Cal Poly for engineering?",
+    "Tell me about Michigan State University",
+])
+def test_ambiguous_names_are_not_detected(detector, question):
+    assert detector.detect(question) == []
+    assert detector.filter_for(question) is None
+
+
+@pytest.mark.parametrize("question, universities", [
+    ("What are the admission requirements at UPenn?", ["University of Pennsylvania"]),
+    ("Penn vs Columbia for CS", ["Columbia University", "University of Pennsylvania"]),
+    ("Deadlines of UT Austin", ["University of Texas at Austin"]),
+    ("Is UW-Madison better than UIUC?", ["University of Illinois at Urbana-Champaign", "University of Wisconsin-Madison"]),
+    ("Research at Georgia Tech", ["Georgia Institute of Technology"]),
+    ("Tuition of the University of Michigan-Ann Arbor", ["University of Michigan-Ann Arbor"]),
+    ("Cornell University or Duke?", ["Cornell University", "Duke University"]),
+])
+def test_unambiguous_names_are_detected(detector, question, universities):
+    assert detector.detect(question) == universities
+
+
+def test_filter_of_several_universities_matches_any_of_them():
+    metadata_filter = university_filter(["Duke University", "Cornell University"])
+    assert matches_filter({"university": "Duke University"}, metadata_filter)
+    assert not matches_filter({"university": "Columbia University"}, metadata_filter)
+    assert matches_filter({}, None)
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from AdaptiveRagChatbot.single_flight import SingleFlight, normalize_question
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight("test")
+        executions = []
+
+        async def work():
+            executions.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flights.run("key", work) for _ in range(3)))
+        return results, executions, flights.join("key")
+
+    results, executions, flight = asyncio.run(scenario())
+    assert len(executions) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert {result for result, _ in results} == {"answer"}
+    # the key is forgotten once the execution is done
+    assert flight is None
+
+
+def test_waiter_cancelled_while_the_leader_fails():
+    async def scenario():
+        flights = SingleFlight("test")
+        started = asyncio.Event()
+        fail = asyncio.Event()
+
+        async def work():
+            started.set()
+            await fail.wait()
+            raise RuntimeError("graph failed")
+
+        leader = asyncio.ensure_future(flights.run("key", work))
+        await started.wait()
+        cancelled = asyncio.ensure_future(flights.run("key", work))
+        waiter = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        fail.set()
+        outcomes = await asyncio.gather(leader, cancelled, waiter, return_exceptions=True)
+        return outcomes, flights.join("key")
+
+    (leader, cancelled, waiter), flight = asyncio.run(scenario())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    # the cancelled waiter neither cancels the execution nor hides its failure from the others
+    assert isinstance(leader, RuntimeError)
+    assert isinstance(waiter, RuntimeError)
+    assert flight is None
+
+
+def test_cancelled_leader_does_not_cancel_the_execution():
+    async def scenario():
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        return await waiter
+
+    assert asyncio.run(scenario()) == ("answer", True)
+
+
+def test_started_execution_is_joined():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        result = flights.start("key", work)
+        joined = flights.join("key")
+        return await result, await joined
+
+    assert asyncio.run(scenario()) == ("answer", "answer")
+
+
+@pytest.mark.parametrize("question", ["What is the GRE cutoff at MIT?", "  what is the  GRE cutoff at mit ", "What is the GRE cutoff at MIT!?"])
+def test_normalize_question(question):
+    assert normalize_question(question) == "what is the gre cutoff at mit"
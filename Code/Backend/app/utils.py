@@ -8,8 +8,8 @@ from pathlib import Path
 import emails
 from jinja2 import Template
 from app.core.config import settings
-from AdaptiveRagChatbot.llm_config import llm
-from langchain_core.prompts import ChatPromptTemplate
+from AdaptiveRagChatbot.llm_config import get_llm
+from AdaptiveRagChatbot.prompt_registry import get_prompt
 
 @dataclass
 class EmailData:
@@ -84,16 +84,32 @@ def rewrite_query(query: str, chat_context: str) -> str:
         if chat_context is None:
             return query
         else:
-            query_template = ChatPromptTemplate.from_messages([
-                ("system",
-                "You are query rewriting specialist for University Question and Answering application."
-                " From the input of previous chat histroy and the human input, generate a clear query for the chat application. Donot make it more than two sentences."),
-                ("system", "STRICTLY RESPOND WITH THE FINAL QUERY ONLY, NO ADDITIONAL TEXT AND PREAMBLE."),
-                ("system", f"Previous Chat History (for context, if relevant):\n{chat_context}"),
-                ("human", "{input}")
-            ])
-            
-            query = query_template.format(input= query)
-            response = llm.invoke(query)
+            query = rewrite_query_prompt(query, chat_context)
+            response = get_llm().invoke(query)
             new_query = response.content
             return new_query
+
+
+async def arewrite_query(query: str, chat_context: str) -> str:
+        """
+        Async version of rewrite_query, does not block the event loop while the LLM responds.
+        
+        Args:
+            query (str): The original query to be rewritten.
+        
+        Returns:
+            str: The rewritten query.
+        """
+        if chat_context is None:
+            return query
+        else:
+            query = rewrite_query_prompt(query, chat_context)
+            response = await get_llm().ainvoke(query)
+            new_query = response.content
+            return new_query
+
+
+def rewrite_query_prompt(query: str, chat_context: str):
+        query_template = get_prompt("chat_query_rewriter")
+
+        return query_template.format(input= query, chat_context= chat_context)